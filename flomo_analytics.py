@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import bisect
+import json
+import os
+import re
+from collections import Counter
+
+from flomo_store import html_to_text
+
+TAG_RE = re.compile(r'#([^\s#<]+)')
+PREVIEW_LENGTH = 100
+
+
+def default_parse(memo):
+    """不依赖 bs4 的解析：纯文本字数、标签（优先用接口返回的 tags）"""
+    content = memo.get("content", "")
+    text = html_to_text(content)
+    return {
+        "created_at": memo.get("created_at"),
+        "plain_text": text,
+        "word_count": len(text),
+        "tags": memo.get("tags") or TAG_RE.findall(content),
+    }
+
+
+class MemoAnalyticsViews:
+    """
+    备忘录统计的物化视图
+
+    增量维护月度/每日条数、标签次数和字数、总字数，以及按 created_at 排序的索引。
+    作为同步引擎的监听者使用：每条备忘录只在 updated_at 变化时重新解析，
+    统计查询直接读取计数器，最新 N 条从有序索引尾部取出，不需要排序全部备忘录。
+    """
+
+    def __init__(self, parse=None):
+        """
+        Args:
+            parse: memo -> {"created_at", "plain_text", "word_count", "tags"}，默认 default_parse
+        """
+        self.parse = parse or default_parse
+        self.records = {}            # slug -> [updated_at, created_at, 标签, 字数, 预览]
+        self.monthly = Counter()     # YYYY-MM -> 条数
+        self.daily = Counter()       # YYYY-MM-DD -> 条数
+        self.tag_counts = Counter()  # 标签 -> 次数
+        self.tag_words = Counter()   # 标签 -> 带该标签的备忘录字数合计
+        self.total_words = 0
+        self.order = []              # [(created_at, slug)]，升序
+
+    def _apply(self, slug, record, delta):
+        _, created_at, tags, words, _ = record
+        self.total_words += delta * words
+        if created_at:
+            self._bump(self.monthly, created_at[:7], delta)
+            self._bump(self.daily, created_at[:10], delta)
+            key = (created_at, slug)
+            if delta > 0:
+                bisect.insort(self.order, key)
+            else:
+                position = bisect.bisect_left(self.order, key)
+                if position < len(self.order) and self.order[position] == key:
+                    del self.order[position]
+        for tag in tags:
+            self._bump(self.tag_counts, tag, delta)
+            self._bump(self.tag_words, tag, delta * words)
+
+    @staticmethod
+    def _bump(counter, key, delta):
+        counter[key] += delta
+        if counter[key] <= 0:
+            del counter[key]
+
+    def add(self, memo):
+        """
+        写入或更新一条备忘录
+
+        Returns:
+            是否重新解析了这条备忘录（updated_at 未变化时跳过）
+        """
+        slug = memo.get("slug")
+        if not slug:
+            return False
+        old = self.records.get(slug)
+        if old is not None and not memo.get("deleted_at") and old[0] == memo.get("updated_at"):
+            return False
+        if old is not None:
+            del self.records[slug]
+            self._apply(slug, old, -1)
+        if memo.get("deleted_at"):
+            return old is not None
+
+        parsed = self.parse(memo)
+        text = parsed.get("plain_text") or ""
+        preview = text[:PREVIEW_LENGTH] + "..." if len(text) > PREVIEW_LENGTH else text
+        record = [memo.get("updated_at"), parsed.get("created_at") or memo.get("created_at"),
+                  list(dict.fromkeys(parsed.get("tags", []))), parsed.get("word_count", 0), preview]
+        self.records[slug] = record
+        self._apply(slug, record, 1)
+        return True
+
+    def build(self, memos):
+        return sum(1 for memo in memos if self.add(memo))
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调"""
+        self.build(memos)
+
+    def __len__(self):
+        return len(self.records)
+
+    def latest(self, n=5):
+        """按 created_at 最新的 n 条：[{"slug", "created_at", "preview"}]"""
+        return [{"slug": slug, "created_at": created_at, "preview": self.records[slug][4]}
+                for created_at, slug in reversed(self.order[-n:])] if n > 0 else []
+
+    def date_range(self):
+        if not self.order:
+            return None, None
+        return self.order[0][0], self.order[-1][0]
+
+    def daily_distribution(self, start=None, end=None):
+        """[start, end] 之间（YYYY-MM-DD，含两端）的每日条数，按日期排序"""
+        return {day: count for day, count in sorted(self.daily.items())
+                if (start is None or day >= start) and (end is None or day <= end)}
+
+    def summary(self, top_tags=20, latest=5):
+        """与 FlomoAnalyzer.analyze_memos 相同口径的统计结果"""
+        total = len(self.records)
+        earliest, last = self.date_range()
+        return {
+            "total_memos": total,
+            "total_words": self.total_words,
+            "avg_words_per_memo": round(self.total_words / total, 2) if total > 0 else 0,
+            "date_range": f"{earliest or 'N/A'} 到 {last or 'N/A'}",
+            "monthly_distribution": dict(self.monthly.most_common()),
+            "top_tags": dict(self.tag_counts.most_common(top_tags)),
+            "tag_words": {tag: self.tag_words[tag] for tag, _ in self.tag_counts.most_common(top_tags)},
+            "latest_memos": self.latest(latest),
+        }
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.records, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, parse=None):
+        """从 save() 的结果恢复（计数器由记录重建，不需要重新解析正文）"""
+        views = cls(parse)
+        with open(path, "r", encoding="utf-8") as f:
+            views.records = json.load(f)
+        keys = []
+        for slug, record in views.records.items():
+            _, created_at, tags, words, _ = record
+            views.total_words += words
+            if created_at:
+                views.monthly[created_at[:7]] += 1
+                views.daily[created_at[:10]] += 1
+                keys.append((created_at, slug))
+            for tag in tags:
+                views.tag_counts[tag] += 1
+                views.tag_words[tag] += words
+        views.order = sorted(keys)
+        return views
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flomo_store import to_epoch
+
+CAPABILITY_CACHE_VERSION = 2
+
+DEFAULT_ENDPOINTS = (
+    "/tag/updated/",
+    "/tag/",
+    "/tag/list/",
+    "/tag/all/",
+    "/tags/",
+    "/tags/updated/",
+    "/tags/list/",
+    "/memo/tags/",
+)
+
+DEFAULT_PAGE_SIZES = (50, 200, 500, 1000)
+
+# 分页参数 -> 从上一页最后一条记录取游标值的方法
+CURSOR_FIELDS = {
+    "latest_updated_at": lambda items: to_epoch(items[-1].get("updated_at")),
+    "latest_order": lambda items: items[-1].get("order"),
+    "latest_id": lambda items: items[-1].get("id"),
+    "offset": lambda items: len(items),
+    "start_cursor": lambda items: items[-1].get("id"),
+}
+
+
+class CapabilityProber:
+    """
+    接口能力探测
+
+    并发探测候选端点、每页数量上限和可用的分页游标参数，结果写入带版本号的
+    JSON 缓存。客户端启动时 load() 读取缓存，跳过不可用的端点和分页策略；
+    缓存版本不符或过期时重新探测。
+    """
+
+    def __init__(self, client, cache_path="flomo_capabilities.json", max_workers=8, timeout=10,
+                 ttl=7 * 24 * 3600):
+        """
+        Args:
+            client: 提供 _generate_params、transport、base_url 的客户端
+            cache_path: 能力缓存文件
+            max_workers: 并发探测的线程数
+            timeout: 单个探测请求的超时（秒）
+            ttl: 缓存有效期（秒），None 表示永不过期
+        """
+        self.client = client
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.ttl = ttl
+        self.capabilities = None
+
+    def load(self):
+        """读取能力缓存；不存在、版本不符或已过期时返回 None"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                capabilities = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if capabilities.get("version") != CAPABILITY_CACHE_VERSION:
+            return None
+        if self.expired(capabilities):
+            return None
+        self.capabilities = capabilities
+        return capabilities
+
+    def expired(self, capabilities=None):
+        """能力结果是否已超过有效期；没有结果时视为过期"""
+        capabilities = capabilities if capabilities is not None else self.capabilities
+        if not capabilities:
+            return True
+        return self.ttl is not None and time.time() - capabilities.get("probed_at", 0) > self.ttl
+
+    def save(self):
+        if not self.cache_path or self.capabilities is None:
+            return
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.capabilities, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def probe_request(self, endpoint, extra_params=None):
+        """
+        发送一次探测请求
+
+        Returns:
+            {"success", "status", "count", "fields", "items", "error", "elapsed"}
+        """
+        request_params = {"limit": "200", "tz": "8:0"}
+        request_params.update(extra_params or {})
+        params = self.client._generate_params(request_params)
+        start = time.time()
+        result = {"success": False, "status": None, "count": 0, "fields": [], "items": [], "error": None}
+        try:
+            response = self.client.transport.get(self.client.base_url + endpoint, params=params,
+                                                 timeout=self.timeout)
+            result["status"] = response.status_code
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+            else:
+                data = response.json()
+                if data.get("code") != 0:
+                    result["error"] = data.get("message", "Unknown")
+                else:
+                    items = data.get("data", [])
+                    if not isinstance(items, list):
+                        items = [items]
+                    result["success"] = True
+                    result["count"] = len(items)
+                    result["items"] = items
+                    if items and isinstance(items[0], dict):
+                        result["fields"] = list(items[0].keys())
+        except json.JSONDecodeError:
+            result["error"] = "JSON decode error"
+        except Exception as e:
+            result["error"] = str(e)[:50]
+        result["elapsed"] = round(time.time() - start, 3)
+        return result
+
+    def probe_endpoints(self, endpoints, extra_params=None):
+        """并发探测一组端点，返回 {endpoint: result}"""
+        return self._run({endpoint: (endpoint, extra_params) for endpoint in endpoints})
+
+    def _run(self, jobs):
+        """并发执行 {key: (endpoint, params)}，返回 {key: result}"""
+        if not jobs:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(jobs))) as executor:
+            futures = {key: executor.submit(self.probe_request, endpoint, params)
+                       for key, (endpoint, params) in jobs.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    def probe(self, endpoints=DEFAULT_ENDPOINTS, page_sizes=DEFAULT_PAGE_SIZES,
+              cursor_fields=tuple(CURSOR_FIELDS), pagination_endpoint="/tag/updated/"):
+        """
+        探测端点能力并写入缓存
+
+        第一轮并发请求所有端点和 pagination_endpoint 的各个每页数量；
+        第二轮用第一页的最后一条记录并发尝试各个游标参数，
+        返回的第一条记录与第一页不同即视为该参数有效。
+        """
+        start = time.time()
+        jobs = {("endpoint", endpoint): (endpoint, None) for endpoint in endpoints}
+        for size in page_sizes:
+            jobs[("page_size", size)] = (pagination_endpoint, {"limit": str(size)})
+        first_round = self._run(jobs)
+
+        endpoint_results = {endpoint: first_round[("endpoint", endpoint)] for endpoint in endpoints}
+        size_counts = {size: first_round[("page_size", size)]["count"]
+                       for size in page_sizes if first_round[("page_size", size)]["success"]}
+        # 服务器实际返回满页的最大数量；服务器可能悄悄截断 limit，所以不能直接取请求值。
+        # 数据量不足一页时只能取观察到的最大返回条数
+        full_sizes = [size for size, count in sorted(size_counts.items()) if count == size]
+        if full_sizes:
+            max_page_size = full_sizes[-1]
+        else:
+            max_page_size = max(size_counts.values(), default=0) or None
+
+        # 游标探测用最小的、能返回满页的每页数量，保证存在下一页
+        cursor_results = {}
+        if full_sizes:
+            size = full_sizes[0]
+            first_page = first_round[("page_size", size)]["items"]
+            jobs = {}
+            for field in cursor_fields:
+                value = CURSOR_FIELDS[field](first_page)
+                if value is None:
+                    cursor_results[field] = {"supported": False, "error": "no cursor value"}
+                    continue
+                jobs[field] = (pagination_endpoint, {"limit": str(size), field: str(value)})
+            for field, result in self._run(jobs).items():
+                advanced = bool(result["items"]) and result["items"][0] != first_page[0]
+                cursor_results[field] = {"supported": result["success"] and advanced,
+                                         "count": result["count"], "error": result["error"]}
+
+        capabilities = {
+            "version": CAPABILITY_CACHE_VERSION,
+            "probed_at": time.time(),
+            "probed_at_iso": datetime.now().isoformat(),
+            "pagination_endpoint": pagination_endpoint,
+            "endpoints": {
+                endpoint: {key: value for key, value in result.items() if key != "items"}
+                for endpoint, result in endpoint_results.items()
+            },
+            "page_sizes": {str(size): count for size, count in size_counts.items()},
+            "max_page_size": max_page_size,
+            "cursor_fields": cursor_results
+        }
+        supported = [endpoint for endpoint, result in endpoint_results.items() if result["success"]]
+        if supported:
+            self.capabilities = capabilities
+            self.save()
+        # 全部失败多半是网络问题：不缓存，也不覆盖已有的结果
+        print(f"🛰️ 能力探测完成: {len(supported)}/{len(endpoints)} 个端点可用，"
+              f"每页上限 {max_page_size}，耗时 {time.time() - start:.1f}s")
+        return capabilities
+
+    def ensure(self, **probe_kwargs):
+        """优先使用缓存，没有可用缓存时探测"""
+        return self.load() or self.probe(**probe_kwargs)
+
+    def supported_endpoints(self):
+        if not self.capabilities:
+            return []
+        return [endpoint for endpoint, result in self.capabilities["endpoints"].items() if result["success"]]
+
+    def is_supported(self, endpoint):
+        """未探测过的端点视为可用"""
+        if not self.capabilities or endpoint not in self.capabilities["endpoints"]:
+            return True
+        return self.capabilities["endpoints"][endpoint]["success"]
+
+    def supported_cursor_fields(self):
+        if not self.capabilities:
+            return list(CURSOR_FIELDS)
+        return [field for field, result in self.capabilities["cursor_fields"].items() if result["supported"]]
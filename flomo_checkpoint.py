@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+
+
+class JobCheckpoint:
+    """
+    长任务检查点
+
+    - <path>.jsonl：只追加的结果日志，每条结果一行；崩溃时最多丢失最后一行不完整的记录
+    - <path>.json：任务状态（参数、是否完成等），原子替换写入
+
+    结果每次追加都写入操作系统缓冲，每隔 interval 秒 fsync 一次。
+    重新启动的任务用 results() 读回已完成的部分，从中断处继续。
+    """
+
+    _BLOCK_SIZE = 65536
+
+    def __init__(self, path, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self.state_path = path + ".json"
+        self.log_path = path + ".jsonl"
+        self.state = {}
+        self._log = None
+        self._last_sync = time.time()
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    @property
+    def done(self):
+        return bool(self.state.get("done"))
+
+    def results(self):
+        """读回日志中已保存的结果（跳过末尾不完整的行）"""
+        if not os.path.exists(self.log_path):
+            return []
+        records = []
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    def append(self, records):
+        """追加一批结果"""
+        if self._log is None:
+            self._truncate_partial_line()
+            self._log = open(self.log_path, "a", encoding="utf-8")
+        for record in records:
+            self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._log.flush()
+        if time.time() - self._last_sync >= self.interval:
+            self.sync()
+
+    def _truncate_partial_line(self):
+        """上次崩溃留下的半行会破坏后续追加，先截掉"""
+        if not os.path.exists(self.log_path):
+            return
+        # 从文件末尾按块向前找最后一个换行，不读入整个日志
+        with open(self.log_path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - self._BLOCK_SIZE)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end != size:
+                f.truncate(end)
+
+    def update(self, **fields):
+        """更新任务状态，按间隔落盘"""
+        self.state.update(fields)
+        if time.time() - self._last_sync >= self.interval:
+            self.sync()
+
+    def sync(self):
+        """把结果日志和状态写入磁盘"""
+        if self._log is not None:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+        self._last_sync = time.time()
+
+    def complete(self):
+        """标记任务完成（保留结果，供上层任务复用）"""
+        self.state["done"] = True
+        self.sync()
+        self.close()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def discard(self):
+        """删除检查点文件"""
+        self.close()
+        for path in (self.state_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import time
+
+import numpy as np
+
+
+class UnionFind:
+    """并查集（路径压缩 + 按大小合并）"""
+
+    def __init__(self, size):
+        # 纯 Python 列表在逐个元素访问时比 NumPy 标量快得多
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, node):
+        parent = self.parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+    def labels(self):
+        """每个节点的根（0..n-1 重新编号）"""
+        roots = np.fromiter((self.find(i) for i in range(len(self.parent))), dtype=np.int64,
+                            count=len(self.parent))
+        _, labels = np.unique(roots, return_inverse=True)
+        return labels
+
+
+def build_knn_graph(vector_index, graph, k=10, min_similarity=0.85):
+    """用本地向量索引为每条备忘录找 k 个近邻，把相似度达标的边写入关系图"""
+    start = time.time()
+    for slug in list(vector_index.slug_to_id):
+        for similarity, other in vector_index.related(slug, k=k):
+            if similarity >= min_similarity:
+                graph.upsert_edge(slug, other, similarity)
+    graph.compact()
+    print(f"🕸️ 近邻图已建立: {graph.node_count} 个节点，{graph.edge_count} 条边，耗时 {time.time() - start:.1f}s")
+    return graph
+
+
+class ClusterEngine:
+    """
+    全量聚类
+
+    1. 过滤掉相似度低于阈值的边后，用并查集求连通分量
+    2. 在每个分量内做半同步标签传播（每轮随机更新一半节点，避免震荡），
+       得到社区；每轮是对边数组的一次排序，整体接近线性
+    3. 输出社区 id、大小和代表备忘录（社区内加权度最高的节点）
+    """
+
+    def __init__(self, graph, min_similarity=0.85, max_iterations=20, seed=0):
+        self.graph = graph
+        self.min_similarity = min_similarity
+        self.max_iterations = max_iterations
+        self.seed = seed
+
+    def _edges(self):
+        graph = self.graph
+        graph.compact()
+        rows = np.repeat(np.arange(graph.node_count, dtype=np.int64), np.diff(graph.indptr))
+        cols = graph.indices.astype(np.int64)
+        weights = graph.weights
+        keep = weights >= self.min_similarity
+        return rows[keep], cols[keep], weights[keep]
+
+    def connected_components(self):
+        rows, cols, _ = self._edges()
+        union_find = UnionFind(self.graph.node_count)
+        for a, b in zip(rows.tolist(), cols.tolist()):
+            if a < b:
+                union_find.union(a, b)
+        return union_find.labels()
+
+    def label_propagation(self):
+        n = self.graph.node_count
+        rows, cols, weights = self._edges()
+        labels = np.arange(n, dtype=np.int64)
+        if not len(rows):
+            return labels
+
+        rng = np.random.default_rng(self.seed)
+        for _ in range(self.max_iterations):
+            # 每个 (节点, 邻居标签) 的权重和；节点自身标签加一个小权重保持稳定
+            keys = np.concatenate([rows * n + labels[cols], np.arange(n) * n + labels])
+            values = np.concatenate([weights.astype(np.float64), np.full(n, 1e-6)])
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            totals = np.bincount(inverse, weights=values)
+            key_rows = unique_keys // n
+            key_labels = unique_keys % n
+
+            # 每个节点取权重最大的标签（平分时取较小的标签）
+            order = np.lexsort((key_labels, -totals, key_rows))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = key_rows[order][1:] != key_rows[order][:-1]
+            best = np.empty(n, dtype=np.int64)
+            best[key_rows[order][first]] = key_labels[order][first]
+
+            # 收敛看全部节点：本轮没被抽中更新的节点也必须已经取到最优标签
+            stable = not (best != labels).any()
+            if stable:
+                break
+            update = rng.random(n) < 0.5
+            labels = np.where(update, best, labels)
+        return labels
+
+    def run(self, min_cluster_size=2, representatives=3):
+        """
+        Returns:
+            [{"cluster_id", "size", "representatives", "members", "component_id"}]，按大小降序
+        """
+        start = time.time()
+        components = self.connected_components()
+        labels = self.label_propagation()
+
+        rows, cols, weights = self._edges()
+        same = labels[rows] == labels[cols]
+        strength = np.bincount(rows[same], weights=weights[same], minlength=self.graph.node_count)
+
+        order = np.lexsort((-strength, labels))
+        sorted_labels = labels[order]
+        bounds = np.flatnonzero(np.diff(sorted_labels)) + 1
+        clusters = []
+        for members in np.split(order, bounds):
+            if len(members) < min_cluster_size:
+                continue
+            slugs = [self.graph.slugs[node] for node in members.tolist()]
+            clusters.append({
+                "size": len(members),
+                "representatives": slugs[:representatives],
+                "members": slugs,
+                "component_id": int(components[members[0]])
+            })
+
+        clusters.sort(key=lambda cluster: -cluster["size"])
+        for cluster_id, cluster in enumerate(clusters):
+            cluster["cluster_id"] = cluster_id
+
+        component_count = len(np.unique(components)) if len(components) else 0
+        print(f"🧩 聚类完成: {self.graph.node_count} 个节点，{component_count} 个连通分量，"
+              f"{len(clusters)} 个社区（≥{min_cluster_size}），耗时 {time.time() - start:.1f}s")
+        return clusters
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import json
+import os
+
+import numpy as np
+
+from flomo_clustering import UnionFind
+from flomo_query_cache import normalize_query
+from flomo_store import html_to_text
+
+_PRIME = np.uint64(0x100000001B3)
+
+
+def _mix(values):
+    """splitmix64 末轮混合（向量化，uint64 溢出即取模）"""
+    with np.errstate(over="ignore"):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def shingle_text(memo):
+    """用于指纹的文本：纯文本规范化后去掉所有空白，排版差异不影响指纹"""
+    return "".join(normalize_query(html_to_text(memo.get("content", ""))).split())
+
+
+def shingle_hashes(text, ngram=3):
+    """文本按字符切成 ngram 元组，返回去重后的 64 位哈希（只依赖码点，跨进程稳定）"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    ngram = min(ngram, len(codes))
+    count = len(codes) - ngram + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(ngram):
+            hashes = hashes * _PRIME + codes[offset:offset + count]
+    return np.unique(_mix(hashes))
+
+
+class NearDuplicateIndex:
+    """
+    近似重复备忘录索引（MinHash + 分段 LSH）
+
+    每条备忘录写入时计算一次 num_perm 个最小哈希组成的签名，两个签名相同位置
+    相等的比例就是字符切片集合 Jaccard 相似度的估计。签名分成 bands 段，
+    至少有一段完全相同的备忘录才成为候选，再用完整签名核对相似度。
+
+    查重时每段对全部备忘录的段哈希排序一次，相同段哈希的连续区间就是候选组，
+    整体为 O(n log n)，不需要两两比较；签名保存在 NumPy 矩阵中，按 slug 增量更新。
+    """
+
+    def __init__(self, threshold=0.7, num_perm=64, bands=16, ngram=3, min_length=10, seed=0):
+        """
+        Args:
+            threshold: 视为近似重复的最低 Jaccard 相似度（签名估计值）
+            num_perm: 签名长度
+            bands: LSH 分段数（每段 num_perm // bands 个哈希）
+            ngram: 字符切片长度
+            min_length: 规范化后短于此长度的备忘录不参与查重（太短的文本没有区分度）
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.min_length = min_length
+        self.seed = seed
+        self._salts = _mix(np.arange(1, num_perm + 1, dtype=np.uint64) + np.uint64(seed) * _PRIME)
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.band_keys = np.zeros((0, bands), dtype=np.uint64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.slugs = []
+        self.rows_by_slug = {}
+        self._free = []
+
+    def __len__(self):
+        return len(self.rows_by_slug)
+
+    def signature(self, text):
+        hashes = shingle_hashes(text, self.ngram)
+        permuted = _mix(hashes[:, None] ^ self._salts[None, :])
+        return (permuted.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    def _bands_of(self, signatures):
+        """(n, num_perm) 签名 -> (n, bands) 段哈希"""
+        grouped = signatures[:, :self.bands * self.rows].astype(np.uint64).reshape(-1, self.bands, self.rows)
+        keys = np.zeros(grouped.shape[:2], dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for row in range(self.rows):
+                keys = keys * _PRIME + grouped[:, :, row]
+        return _mix(keys ^ np.arange(self.bands, dtype=np.uint64))
+
+    def _grow(self, capacity):
+        if capacity <= len(self.alive):
+            return
+        capacity = max(capacity, len(self.alive) * 2, 1024)
+        extra = capacity - len(self.alive)
+        self.signatures = np.vstack([self.signatures, np.zeros((extra, self.num_perm), dtype=np.uint32)])
+        self.band_keys = np.vstack([self.band_keys, np.zeros((extra, self.bands), dtype=np.uint64)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+
+    def add_signature(self, slug, signature):
+        row = self.rows_by_slug.get(slug)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+                self.slugs[row] = slug
+            else:
+                row = len(self.slugs)
+                self.slugs.append(slug)
+                self._grow(row + 1)
+            self.rows_by_slug[slug] = row
+        self.signatures[row] = signature
+        self.band_keys[row] = self._bands_of(signature[None, :])[0]
+        self.alive[row] = True
+
+    def remove(self, slug):
+        row = self.rows_by_slug.pop(slug, None)
+        if row is None:
+            return
+        self.alive[row] = False
+        self.slugs[row] = None
+        self._free.append(row)
+
+    def add(self, memo):
+        slug = memo.get("slug")
+        if not slug:
+            return
+        text = shingle_text(memo) if not memo.get("deleted_at") else ""
+        if len(text) < self.min_length:
+            self.remove(slug)
+            return
+        self.add_signature(slug, self.signature(text))
+
+    def build(self, memos):
+        for memo in memos:
+            self.add(memo)
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调"""
+        self.build(memos)
+
+    def similarity(self, slug_a, slug_b):
+        """两条备忘录的 Jaccard 相似度估计"""
+        row_a, row_b = self.rows_by_slug.get(slug_a), self.rows_by_slug.get(slug_b)
+        if row_a is None or row_b is None:
+            return 0.0
+        return float(np.mean(self.signatures[row_a] == self.signatures[row_b]))
+
+    def duplicates_of(self, slug, threshold=None):
+        """与 slug 近似重复的备忘录：[(slug, 相似度)]，按相似度降序"""
+        threshold = self.threshold if threshold is None else threshold
+        row = self.rows_by_slug.get(slug)
+        if row is None:
+            return []
+        size = len(self.slugs)
+        candidates = np.flatnonzero(self.alive[:size] &
+                                    (self.band_keys[:size] == self.band_keys[row]).any(axis=1))
+        candidates = candidates[candidates != row]
+        scores = (self.signatures[candidates] == self.signatures[row]).mean(axis=1)
+        keep = scores >= threshold
+        matches = [(self.slugs[other], float(score)) for other, score in zip(candidates[keep], scores[keep])]
+        return sorted(matches, key=lambda item: (-item[1], item[0]))
+
+    def candidate_pairs(self):
+        """所有至少有一段相同的行对：(left, right) 两个数组，left < right"""
+        rows = np.flatnonzero(self.alive[:len(self.slugs)])
+        lefts, rights = [], []
+        for band in range(self.bands):
+            keys = self.band_keys[rows, band]
+            order = np.argsort(keys, kind="stable")
+            ordered = keys[order]
+            # 相同段哈希的连续区间
+            starts = np.flatnonzero(np.concatenate([[True], ordered[1:] != ordered[:-1]]))
+            sizes = np.diff(np.concatenate([starts, [len(ordered)]]))
+            for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+                members = rows[order[start:start + size]]
+                left, right = np.triu_indices(size, k=1)
+                lefts.append(members[left])
+                rights.append(members[right])
+        if not lefts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        left, right = np.concatenate(lefts), np.concatenate(rights)
+        left, right = np.minimum(left, right), np.maximum(left, right)
+        pairs = np.unique(left.astype(np.int64) * len(self.slugs) + right)
+        return pairs // len(self.slugs), pairs % len(self.slugs)
+
+    def groups(self, threshold=None, min_size=2):
+        """
+        全部近似重复组（相似关系的连通分量）
+
+        Returns:
+            [[slug, ...]]，按组大小降序；组内按 slug 排序
+        """
+        threshold = self.threshold if threshold is None else threshold
+        left, right = self.candidate_pairs()
+        union_find = UnionFind(len(self.slugs))
+        if len(left):
+            scores = (self.signatures[left] == self.signatures[right]).mean(axis=1)
+            keep = scores >= threshold
+            for a, b in zip(left[keep].tolist(), right[keep].tolist()):
+                union_find.union(a, b)
+
+        grouped = {}
+        for slug, row in self.rows_by_slug.items():
+            grouped.setdefault(union_find.find(row), []).append(slug)
+        result = [sorted(members) for members in grouped.values() if len(members) >= min_size]
+        result.sort(key=lambda members: (-len(members), members[0]))
+        return result
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        slugs = list(self.rows_by_slug)
+        rows = [self.rows_by_slug[slug] for slug in slugs]
+        np.save(os.path.join(directory, "signatures.npy"), self.signatures[rows])
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"threshold": self.threshold, "num_perm": self.num_perm, "bands": self.bands,
+                       "ngram": self.ngram, "min_length": self.min_length, "seed": self.seed,
+                       "slugs": slugs}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        """恢复签名并重算段哈希（不需要重新解析正文）"""
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(threshold=meta["threshold"], num_perm=meta["num_perm"], bands=meta["bands"],
+                    ngram=meta["ngram"], min_length=meta["min_length"], seed=meta["seed"])
+        signatures = np.load(os.path.join(directory, "signatures.npy"))
+        index.slugs = list(meta["slugs"])
+        index.rows_by_slug = {slug: row for row, slug in enumerate(index.slugs)}
+        index.signatures = signatures
+        index.band_keys = index._bands_of(signatures) if len(signatures) else index.band_keys
+        index.alive = np.ones(len(signatures), dtype=bool)
+        return index
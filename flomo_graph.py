@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import json
+from collections import deque
+from datetime import datetime
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+
+class MemoGraph:
+    """
+    备忘录关系图（无向、带权）
+
+    slug 映射为整数 id，邻接关系以 CSR 数组保存：
+    indptr(int64) / indices(int32) / weights(float32)。
+    增量写入的边先进入增量表，查询时与 CSR 合并，
+    增量表超过阈值时压实进 CSR。邻居查询为 O(度数)。
+    """
+
+    def __init__(self, compact_threshold=100000):
+        self.slugs = []
+        self.ids = {}
+        self.node_attrs = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self._delta = {}          # id -> {邻居 id: 权重}，NaN 表示删除
+        self._delta_size = 0
+        self.compact_threshold = compact_threshold
+
+    @property
+    def node_count(self):
+        return len(self.slugs)
+
+    @property
+    def edge_count(self):
+        """无向边数量"""
+        self.compact()
+        return len(self.indices) // 2
+
+    def node_id(self, slug, **attrs):
+        """取得（必要时创建）节点 id，并合并节点属性"""
+        node = self.ids.get(slug)
+        if node is None:
+            node = len(self.slugs)
+            self.ids[slug] = node
+            self.slugs.append(slug)
+        if attrs:
+            self.node_attrs.setdefault(node, {}).update(attrs)
+        return node
+
+    def _set(self, src, dst, weight):
+        row = self._delta.setdefault(src, {})
+        if dst not in row:
+            self._delta_size += 1
+        row[dst] = weight
+
+    def upsert_edge(self, source, target, weight):
+        """写入或更新一条边（取较新的权重）"""
+        if source == target:
+            return
+        src, dst = self.node_id(source), self.node_id(target)
+        self._set(src, dst, float(weight))
+        self._set(dst, src, float(weight))
+        if self._delta_size >= self.compact_threshold:
+            self.compact()
+
+    def remove_edge(self, source, target):
+        src, dst = self.ids.get(source), self.ids.get(target)
+        if src is None or dst is None:
+            return
+        self._set(src, dst, float("nan"))
+        self._set(dst, src, float("nan"))
+
+    def _row(self, node):
+        if node + 1 < len(self.indptr):
+            start, end = self.indptr[node], self.indptr[node + 1]
+            return self.indices[start:end], self.weights[start:end]
+        return self.indices[:0], self.weights[:0]
+
+    def neighbor_ids(self, node):
+        """返回 {邻居 id: 权重}"""
+        indices, weights = self._row(node)
+        result = dict(zip(indices.tolist(), weights.tolist()))
+        for dst, weight in self._delta.get(node, {}).items():
+            if weight != weight:  # NaN：已删除
+                result.pop(dst, None)
+            else:
+                result[dst] = weight
+        return result
+
+    def neighbors(self, slug):
+        """返回 [(邻居 slug, 相似度)]，相似度从高到低"""
+        node = self.ids.get(slug)
+        if node is None:
+            return []
+        items = sorted(self.neighbor_ids(node).items(), key=lambda item: -item[1])
+        return [(self.slugs[dst], round(weight, 6)) for dst, weight in items]
+
+    def k_hop(self, slug, k=2, min_weight=0.0):
+        """k 跳以内的节点，返回 {slug: 跳数}（不含起点）"""
+        start = self.ids.get(slug)
+        if start is None:
+            return {}
+        hops = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if hops[node] >= k:
+                continue
+            for dst, weight in self.neighbor_ids(node).items():
+                if weight >= min_weight and dst not in hops:
+                    hops[dst] = hops[node] + 1
+                    queue.append(dst)
+        return {self.slugs[node]: hop for node, hop in hops.items() if node != start}
+
+    def compact(self):
+        """把增量表合并进 CSR 数组"""
+        if not self._delta and len(self.indptr) == self.node_count + 1:
+            return
+        n = self.node_count
+        base_rows = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+
+        delta_rows, delta_cols, delta_weights = [], [], []
+        for src, row in self._delta.items():
+            for dst, weight in row.items():
+                delta_rows.append(src)
+                delta_cols.append(dst)
+                delta_weights.append(weight)
+
+        rows = np.concatenate([base_rows, np.asarray(delta_rows, dtype=np.int64)])
+        cols = np.concatenate([self.indices.astype(np.int64), np.asarray(delta_cols, dtype=np.int64)])
+        weights = np.concatenate([self.weights, np.asarray(delta_weights, dtype=np.float32)])
+        # 增量在后：排序后同一 (row, col) 保留最后一条
+        source = np.concatenate([np.zeros(len(base_rows), dtype=np.int8), np.ones(len(delta_rows), dtype=np.int8)])
+        order = np.lexsort((source, cols, rows))
+        rows, cols, weights = rows[order], cols[order], weights[order]
+        if len(rows):
+            last = np.ones(len(rows), dtype=bool)
+            last[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+            keep = last & ~np.isnan(weights)
+            rows, cols, weights = rows[keep], cols[keep], weights[keep]
+
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=self.indptr[1:])
+        self.indices = cols.astype(np.int32)
+        self.weights = weights.astype(np.float32)
+        self._delta = {}
+        self._delta_size = 0
+
+    def iter_edges(self):
+        """逐条产出无向边 (source, target, weight)，每条边只出现一次"""
+        self.compact()
+        for node in range(self.node_count):
+            indices, weights = self._row(node)
+            for dst, weight in zip(indices.tolist(), weights.tolist()):
+                if node < dst:
+                    yield self.slugs[node], self.slugs[dst], round(weight, 6)
+
+    def export_json(self, filename, metadata=None):
+        """流式导出 JSON（与原 nodes/edges 结构兼容，逐行写出）"""
+        self.compact()
+        metadata = dict(metadata or {})
+        metadata.update({
+            "export_time": datetime.now().isoformat(),
+            "total_nodes": self.node_count,
+            "total_edges": self.edge_count
+        })
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write('{"nodes": [\n')
+            for node, slug in enumerate(self.slugs):
+                record = {"id": slug, "type": "memo"}
+                record.update(self.node_attrs.get(node, {}))
+                f.write(("" if node == 0 else ",\n") + json.dumps(record, ensure_ascii=False))
+            f.write('\n], "edges": [\n')
+            for i, (source, target, weight) in enumerate(self.iter_edges()):
+                edge = {"source": source, "target": target, "similarity": weight, "type": "similarity"}
+                f.write(("" if i == 0 else ",\n") + json.dumps(edge, ensure_ascii=False))
+            f.write('\n], "metadata": ' + json.dumps(metadata, ensure_ascii=False) + "}\n")
+        return metadata
+
+    def export_graphml(self, filename):
+        """流式导出 GraphML"""
+        self.compact()
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+            f.write('  <key id="similarity" for="edge" attr.name="similarity" attr.type="float"/>\n')
+            f.write('  <key id="is_main_node" for="node" attr.name="is_main_node" attr.type="boolean"/>\n')
+            f.write('  <graph id="flomo" edgedefault="undirected">\n')
+            for node, slug in enumerate(self.slugs):
+                is_main = self.node_attrs.get(node, {}).get("is_main_node")
+                if is_main is None:
+                    f.write(f"    <node id={quoteattr(slug)}/>\n")
+                else:
+                    f.write(f"    <node id={quoteattr(slug)}>"
+                            f'<data key="is_main_node">{"true" if is_main else "false"}</data></node>\n')
+            for source, target, weight in self.iter_edges():
+                f.write(f"    <edge source={quoteattr(source)} target={quoteattr(target)}>"
+                        f'<data key="similarity">{escape(repr(weight))}</data></edge>\n')
+            f.write("  </graph>\n</graphml>\n")
+
+    def export_edgelist(self, filename):
+        """流式导出边表（source<TAB>target<TAB>similarity）"""
+        with open(filename, "w", encoding="utf-8") as f:
+            for source, target, weight in self.iter_edges():
+                f.write(f"{source}\t{target}\t{weight}\n")
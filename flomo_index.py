@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+
+import heapq
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+from flomo_query_cache import normalize_query
+from flomo_store import html_to_text, to_epoch
+
+_lazy_pinyin = None
+
+
+def lazy_pinyin(text):
+    """
+    pypinyin.lazy_pinyin，第一次使用时才导入（加载拼音词典较慢）
+
+    pypinyin 为可选依赖，没有安装时返回 None，只建立原文索引。
+    """
+    global _lazy_pinyin
+    if _lazy_pinyin is None:
+        try:
+            from pypinyin import lazy_pinyin as convert
+        except ImportError:
+            convert = False
+        _lazy_pinyin = convert
+    return _lazy_pinyin(text) if _lazy_pinyin else None
+
+
+_CJK_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_ALPHA_RE = re.compile(r"^[a-z]+$")
+
+
+def levenshtein(a, b, max_distance=None):
+    """编辑距离；超过 max_distance 时提前返回 max_distance + 1"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """
+    BK 树：按编辑距离组织词表，支持增量插入和半径查询
+
+    words 中的词在第一次插入或查询时才建树（从快照加载时不必立刻付出建树的开销）。
+    """
+
+    def __init__(self, words=None):
+        self.root = None
+        self.size = 0
+        self._pending = list(words or [])
+
+    def _build_pending(self):
+        pending, self._pending = self._pending, []
+        for word in pending:
+            self._insert(word)
+
+    def __iter__(self):
+        yield from self._pending
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            word, children = stack.pop()
+            yield word
+            stack.extend(children.values())
+
+    def add(self, word):
+        if self._pending:
+            self._pending.append(word)
+        else:
+            self._insert(word)
+
+    def _insert(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = levenshtein(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, word, max_distance):
+        """返回 [(distance, word)]，按距离升序"""
+        if self._pending:
+            self._build_pending()
+        if self.root is None:
+            return []
+        results = []
+        stack = [self.root]
+        while stack:
+            candidate, children = stack.pop()
+            distance = levenshtein(word, candidate)
+            if distance <= max_distance:
+                results.append((distance, candidate))
+            for d in range(distance - max_distance, distance + max_distance + 1):
+                child = children.get(d)
+                if child is not None:
+                    stack.append(child)
+        results.sort()
+        return results
+
+
+class LocalSearchIndex:
+    """
+    本地搜索索引
+
+    - 原文：CJK 单字和双字词、英文单词/数字，倒排表记录词频（供相关性排序使用）
+    - 拼音：全拼字符串的三元组索引，例如 "夕阳" 可以用 "xiyang" 找到
+    - 首字母：拼音首字母的二元组索引，例如 "xy"
+    - 模糊：英文单词和 CJK 双字词的拼音放入 BK 树，按编辑距离扩展候选词
+
+    一次 search() 在本地依次尝试 原文 → 拼音 → 首字母 → 模糊，不访问服务器。
+    """
+
+    def __init__(self, tz="8:0"):
+        self.tz = tz
+        self.postings = defaultdict(dict)           # token -> {slug: tf}
+        self.pinyin_postings = defaultdict(set)     # 拼音三元组 -> {slug}
+        self.initials_postings = defaultdict(set)   # 首字母二元组 -> {slug}
+        self.doc_tokens = {}                        # slug -> Counter，用于删除
+        self.doc_lengths = {}
+        self.doc_text = {}                          # slug -> 规范化文本，用于校验
+        self.doc_pinyin = {}                        # slug -> [全拼串]
+        self.doc_initials = {}                      # slug -> [首字母串]
+        self.doc_created = {}                       # slug -> epoch
+        self.vocabulary = BKTree()
+        self._pinyin_words = {}                     # 拼音词 -> 原文双字词
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @staticmethod
+    def tokenize(text):
+        """把规范化文本切分为 CJK 单字、双字词和英文单词"""
+        tokens = []
+        for run in _CJK_RE.findall(text):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        tokens.extend(_WORD_RE.findall(text))
+        return tokens
+
+    @staticmethod
+    def _pinyin_runs(text):
+        """返回每段 CJK 文本的 (全拼串, 首字母串, 原文, 逐字拼音)"""
+        runs = []
+        for run in _CJK_RE.findall(text):
+            syllables = lazy_pinyin(run)
+            if syllables is None:
+                return []
+            syllables = [s.lower() for s in syllables]
+            runs.append(("".join(syllables), "".join(s[0] for s in syllables if s), run, syllables))
+        return runs
+
+    def add(self, memo):
+        """加入或更新一条备忘录"""
+        slug = memo.get("slug")
+        if not slug:
+            return
+        if slug in self.doc_lengths:
+            self.remove(slug)
+        if memo.get("deleted_at"):
+            return
+
+        text = normalize_query(html_to_text(memo.get("content", "")) + " " + " ".join(memo.get("tags", [])))
+        counts = Counter(self.tokenize(text))
+        for token, tf in counts.items():
+            self.postings[token][slug] = tf
+            if _ALPHA_RE.match(token) and len(token) > 2:
+                self.vocabulary.add(token)
+
+        pinyin, initials = [], []
+        for full, first, run, syllables in self._pinyin_runs(text):
+            pinyin.append(full)
+            initials.append(first)
+            for i in range(len(full) - 2):
+                self.pinyin_postings[full[i:i + 3]].add(slug)
+            for i in range(len(first) - 1):
+                self.initials_postings[first[i:i + 2]].add(slug)
+            for i in range(len(run) - 1):
+                word = syllables[i] + syllables[i + 1]
+                if word not in self._pinyin_words:
+                    self._pinyin_words[word] = run[i:i + 2]
+                    self.vocabulary.add(word)
+
+        length = sum(counts.values())
+        self.doc_tokens[slug] = counts
+        self.doc_lengths[slug] = length
+        self.doc_text[slug] = text
+        self.doc_pinyin[slug] = pinyin
+        self.doc_initials[slug] = initials
+        try:
+            self.doc_created[slug] = to_epoch(memo.get("created_at"), self.tz) or 0
+        except ValueError:
+            self.doc_created[slug] = 0
+        self.total_length += length
+
+    def remove(self, slug):
+        counts = self.doc_tokens.pop(slug, None)
+        if counts is None:
+            return
+        for token in counts:
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.pop(slug, None)
+                if not docs:
+                    del self.postings[token]
+        for full in self.doc_pinyin.pop(slug, []):
+            for i in range(len(full) - 2):
+                self._discard(self.pinyin_postings, full[i:i + 3], slug)
+        for first in self.doc_initials.pop(slug, []):
+            for i in range(len(first) - 1):
+                self._discard(self.initials_postings, first[i:i + 2], slug)
+        self.total_length -= self.doc_lengths.pop(slug)
+        self.doc_text.pop(slug, None)
+        self.doc_created.pop(slug, None)
+
+    @staticmethod
+    def _discard(postings, key, slug):
+        """从集合倒排表中删除 slug，集合空了就删掉这个键"""
+        docs = postings.get(key)
+        if docs is not None:
+            docs.discard(slug)
+            if not docs:
+                del postings[key]
+
+    def _live_word(self, word):
+        """
+        词表中的词是否还出现在某条备忘录里
+
+        BK 树不支持删除，删除备忘录后词可能已经不在任何文档中：
+        拼音词要求它的每个三元组都还在拼音倒排表中，其它词要求还在原文倒排表中。
+        """
+        if word in self._pinyin_words:
+            return all(word[i:i + 3] in self.pinyin_postings for i in range(len(word) - 2))
+        return word in self.postings
+
+    def build(self, memos):
+        for memo in memos:
+            self.add(memo)
+        print(f"📚 本地索引已建立: {len(self)} 条备忘录，{len(self.postings)} 个词")
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调（add 会处理 deleted_at）"""
+        for memo in memos:
+            self.add(memo)
+
+    def save(self, directory):
+        """
+        保存为可以内存映射打开的快照
+
+        倒排表保存为 CSR 数组（词 -> 文档行号 + 词频），文档文本和拼音保存为
+        字符串表；doc_tokens 不保存，加载后需要时由文档文本重新切词得到。
+        """
+        import numpy as np
+        from flomo_mmap import StringBlob, peek, peek_items, save_csr
+
+        os.makedirs(directory, exist_ok=True)
+        slugs = list(self.doc_lengths)
+        rows = {slug: row for row, slug in enumerate(slugs)}
+
+        def posting_rows(postings, with_tf):
+            for key, docs in peek_items(postings):
+                ids = [rows[slug] for slug in docs]
+                yield key, ids, [docs[slug] for slug in docs] if with_tf else None
+
+        save_csr(directory, "postings", posting_rows(self.postings, True))
+        save_csr(directory, "pinyin", posting_rows(self.pinyin_postings, False))
+        save_csr(directory, "initials", posting_rows(self.initials_postings, False))
+        # 通过 peek 读取：内存映射打开的索引保存时不会把全部文档解码进覆盖层
+        StringBlob.write(directory, "text", (peek(self.doc_text, slug) for slug in slugs))
+        StringBlob.write(directory, "doc_pinyin", (" ".join(peek(self.doc_pinyin, slug)) for slug in slugs))
+        StringBlob.write(directory, "doc_initials", (" ".join(peek(self.doc_initials, slug)) for slug in slugs))
+
+        np.save(os.path.join(directory, "lengths.npy"),
+                np.asarray([peek(self.doc_lengths, slug) for slug in slugs], dtype=np.int32))
+        np.save(os.path.join(directory, "created.npy"),
+                np.asarray([peek(self.doc_created, slug, 0) for slug in slugs], dtype=np.int64))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "tz": self.tz,
+                "slugs": slugs,
+                "total_length": self.total_length,
+                # 快照只保留仍然有效的词，BK 树在下次加载时按新词表重建
+                "vocabulary": [word for word in self.vocabulary if self._live_word(word)],
+                "pinyin_words": {word: bigram for word, bigram in self._pinyin_words.items()
+                                 if self._live_word(word)}
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, read_only=False):
+        """
+        以内存映射打开 save() 的快照
+
+        只读取词表和 slug 列表；倒排表、文档文本等在第一次访问某个键时才从映射文件解码，
+        之后的增量更新写入覆盖层，不修改快照文件。read_only 时解码结果不缓存
+        （只读进程不会增量更新），多个进程只共享映射文件的页缓存。
+        """
+        import numpy as np
+        from flomo_mmap import FrozenMapping, StringBlob, load_csr
+
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(tz=meta["tz"])
+        slugs = meta["slugs"]
+        rows = {slug: row for row, slug in enumerate(slugs)}
+
+        def posting_table(name, default_factory):
+            keys, ptr, cols, vals = load_csr(directory, name)
+
+            def load_row(row):
+                start, end = int(ptr[row]), int(ptr[row + 1])
+                ids = cols[start:end].tolist()
+                if vals is None:
+                    return {slugs[i] for i in ids}
+                return dict(zip((slugs[i] for i in ids), vals[start:end].tolist()))
+
+            return FrozenMapping({key: row for row, key in enumerate(keys)}, load_row, default_factory,
+                                 cache=not read_only)
+
+        text = StringBlob(directory, "text")
+        pinyin = StringBlob(directory, "doc_pinyin")
+        initials = StringBlob(directory, "doc_initials")
+        lengths = np.load(os.path.join(directory, "lengths.npy"), mmap_mode="r")
+        created = np.load(os.path.join(directory, "created.npy"), mmap_mode="r")
+
+        index.postings = posting_table("postings", dict)
+        index.pinyin_postings = posting_table("pinyin", set)
+        index.initials_postings = posting_table("initials", set)
+        cache = not read_only
+        index.doc_text = FrozenMapping(rows, text.__getitem__, cache=cache)
+        index.doc_tokens = FrozenMapping(rows, lambda row: Counter(cls.tokenize(text[row])), cache=cache)
+        index.doc_pinyin = FrozenMapping(rows, lambda row: pinyin[row].split(), cache=cache)
+        index.doc_initials = FrozenMapping(rows, lambda row: initials[row].split(), cache=cache)
+        index.doc_lengths = FrozenMapping(rows, lambda row: int(lengths[row]), cache=cache)
+        index.doc_created = FrozenMapping(rows, lambda row: int(created[row]), cache=cache)
+        index.total_length = meta["total_length"]
+        index.vocabulary = BKTree(meta["vocabulary"])
+        index._pinyin_words = meta["pinyin_words"]
+        return index
+
+    @staticmethod
+    def _intersect(posting_sets):
+        posting_sets = sorted(posting_sets, key=len)
+        if not posting_sets:
+            return set()
+        result = set(posting_sets[0])
+        for docs in posting_sets[1:]:
+            result.intersection_update(docs)
+            if not result:
+                break
+        return result
+
+    def _match_text(self, term):
+        """原文匹配，返回 (slugs, 命中的词)"""
+        tokens = self.tokenize(term)
+        if not tokens:
+            return set(), []
+        # 双字词比单字更有区分度；只有一个字时退回单字
+        keys = [t for t in tokens if len(t) != 1 or len(tokens) == 1 or t.isascii()]
+        candidates = self._intersect([self.postings.get(t, {}).keys() for t in keys])
+        return {slug for slug in candidates if term in self.doc_text[slug]}, keys
+
+    def _match_pinyin(self, term):
+        if len(term) < 3 or not _ALPHA_RE.match(term):
+            return set()
+        grams = [self.pinyin_postings.get(term[i:i + 3], set()) for i in range(len(term) - 2)]
+        candidates = self._intersect(grams)
+        return {slug for slug in candidates if any(term in full for full in self.doc_pinyin[slug])}
+
+    def _match_initials(self, term):
+        if len(term) < 2 or not _ALPHA_RE.match(term):
+            return set()
+        grams = [self.initials_postings.get(term[i:i + 2], set()) for i in range(len(term) - 1)]
+        candidates = self._intersect(grams)
+        return {slug for slug in candidates if any(term in first for first in self.doc_initials[slug])}
+
+    def expand_fuzzy(self, term, max_distance=None):
+        """用 BK 树找出与 term 编辑距离相近的词（英文单词或拼音词）"""
+        if max_distance is None:
+            max_distance = 1 if len(term) <= 5 else 2
+        return [word for _, word in self.vocabulary.search(term, max_distance)
+                if word != term and self._live_word(word)]
+
+    def match_term(self, term, fuzzy=True):
+        """
+        匹配单个词
+
+        Returns:
+            (slugs, mode, terms)：mode 为 text/pinyin/initials/fuzzy，
+            terms 为参与匹配的原文词（供相关性排序使用）
+        """
+        slugs, terms = self._match_text(term)
+        if slugs:
+            return slugs, "text", terms
+
+        slugs = self._match_pinyin(term)
+        if slugs:
+            return slugs, "pinyin", self._pinyin_terms(term)
+
+        slugs = self._match_initials(term)
+        if slugs:
+            return slugs, "initials", []
+
+        if fuzzy and _WORD_RE.fullmatch(term):
+            slugs, terms = set(), []
+            for word in self.expand_fuzzy(term):
+                if word in self._pinyin_words:
+                    slugs |= self._match_pinyin(word)
+                    terms.append(self._pinyin_words[word])
+                else:
+                    slugs |= self.postings.get(word, {}).keys()
+                    terms.append(word)
+            if slugs:
+                return slugs, "fuzzy", terms
+
+        return set(), None, []
+
+    def _pinyin_terms(self, term):
+        """找出 term 中能对应到原文双字词的拼音片段"""
+        terms = []
+        for i in range(len(term)):
+            for j in range(i + 2, min(len(term), i + 12) + 1):
+                word = self._pinyin_words.get(term[i:j])
+                if word:
+                    terms.append(word)
+        return terms
+
+    def match(self, query, fuzzy=True):
+        """
+        匹配查询（空白分隔的多个词取交集）
+
+        Returns:
+            (slugs, modes, terms)
+        """
+        slugs, modes, terms = None, [], []
+        for term in normalize_query(query).split(" "):
+            if not term:
+                continue
+            matched, mode, matched_terms = self.match_term(term, fuzzy=fuzzy)
+            slugs = matched if slugs is None else slugs & matched
+            modes.append(mode)
+            terms.extend(matched_terms)
+            if not slugs:
+                return set(), modes, terms
+        return slugs or set(), modes, terms
+
+    def match_text(self, query):
+        """
+        只做原文匹配（不扩展拼音、首字母和模糊），与服务端 q 搜索的语义一致
+
+        空查询匹配全部备忘录。
+        """
+        slugs = None
+        for term in normalize_query(query).split(" "):
+            if not term:
+                continue
+            matched, _ = self._match_text(term)
+            slugs = matched if slugs is None else slugs & matched
+            if not slugs:
+                return set()
+        return set(self.doc_lengths) if slugs is None else slugs
+
+    def contains_text(self, slug, query):
+        """slug 的文本是否包含 query 的全部词（逐条核对，不查倒排表）"""
+        text = self.doc_text.get(slug)
+        return text is not None and all(term in text for term in normalize_query(query).split(" ") if term)
+
+    def most_recent(self, slugs, limit=50):
+        """取创建时间最新的 limit 条"""
+        return heapq.nlargest(limit, slugs, key=lambda slug: self.doc_created.get(slug, 0))
+
+    def search(self, query, limit=50, fuzzy=True):
+        """返回匹配的 slug 列表（按创建时间倒序）"""
+        slugs, _, _ = self.match(query, fuzzy=fuzzy)
+        return self.most_recent(slugs, limit)
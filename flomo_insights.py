@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import json
+import os
+
+import numpy as np
+
+from flomo_index import LocalSearchIndex
+from flomo_query_cache import normalize_query
+from flomo_store import html_to_text
+
+
+def insight_terms(text):
+    """用于关键词的词项：CJK 双字词和英文单词（单字噪声太大，不参与）"""
+    return [token for token in LocalSearchIndex.tokenize(normalize_query(text)) if len(token) >= 2]
+
+
+def _ranges(starts, lengths):
+    """把若干 [start, start + length) 区间展开成一个下标数组（向量化）"""
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return offsets + np.arange(total)
+
+
+class InsightEngine:
+    """
+    关键词 / 洞察提取
+
+    每条备忘录写入时切词一次，词频以稀疏行（词项 id + 次数）保存；查询时拼成 CSR，
+    用向量化的 TF-IDF 计算每个分组（月份、年份、标签或聚类）的质心，再乘以
+    “分组逆文档频率”，得到各分组最有区分度的词。分组结果按数据版本缓存，
+    同步有变化时才重新计算。
+    """
+
+    def __init__(self, min_df=2, max_df_ratio=0.5):
+        """
+        Args:
+            min_df: 词项至少出现在多少条备忘录中才参与计算
+            max_df_ratio: 出现在超过这个比例的备忘录中的词视为常用词，不参与计算
+        """
+        self.min_df = min_df
+        self.max_df_ratio = max_df_ratio
+        self.vocabulary = {}     # 词项 -> id
+        self.terms = []
+        self.rows = {}           # slug -> (词项 id 数组, 次数数组)
+        self.meta = {}           # slug -> (created_at, [标签], updated_at)
+        self.version = 0
+        self._compiled = None
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _term_id(self, term):
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            term_id = self.vocabulary[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+    def add(self, memo):
+        """
+        写入或更新一条备忘录
+
+        Returns:
+            是否重新切词（updated_at 未变化时跳过）
+        """
+        slug = memo.get("slug")
+        if not slug:
+            return False
+        old = self.meta.get(slug)
+        if old is not None and not memo.get("deleted_at") and old[2] == memo.get("updated_at"):
+            return False
+        self.rows.pop(slug, None)
+        self.meta.pop(slug, None)
+        self.version += 1
+        if memo.get("deleted_at"):
+            return old is not None
+        counts = {}
+        for term in insight_terms(html_to_text(memo.get("content", ""))):
+            term_id = self._term_id(term)
+            counts[term_id] = counts.get(term_id, 0) + 1
+        self.rows[slug] = (np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)),
+                           np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        self.meta[slug] = (memo.get("created_at") or "", list(dict.fromkeys(memo.get("tags", []))),
+                           memo.get("updated_at"))
+        return True
+
+    def build(self, memos):
+        return sum(1 for memo in memos if self.add(memo))
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调"""
+        self.build(memos)
+
+    def _matrix(self):
+        """拼成 CSR：(slugs, indptr, indices, tfidf)，行已 L2 归一化"""
+        if self._compiled is not None and self._compiled[0] == self.version:
+            return self._compiled[1]
+        slugs = list(self.rows)
+        lengths = np.fromiter((len(self.rows[slug][0]) for slug in slugs), dtype=np.int64, count=len(slugs))
+        indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        if slugs:
+            indices = np.concatenate([self.rows[slug][0] for slug in slugs])
+            counts = np.concatenate([self.rows[slug][1] for slug in slugs])
+        else:
+            indices, counts = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+        # 每行内词项不重复，bincount 即文档频率
+        df = np.bincount(indices, minlength=len(self.terms))
+        usable = (df >= self.min_df) & (df <= max(self.max_df_ratio * len(slugs), self.min_df))
+        idf = np.log((1 + len(slugs)) / (1 + df)) + 1
+        weights = (1 + np.log(np.maximum(counts, 1))) * idf[indices] * usable[indices]
+        row_of = np.repeat(np.arange(len(slugs)), lengths)
+        norms = np.sqrt(np.bincount(row_of, weights=weights ** 2, minlength=len(slugs)))
+        weights = weights / np.maximum(norms[row_of], 1e-12)
+
+        matrix = (slugs, indptr, indices, weights.astype(np.float32))
+        self._compiled = (self.version, matrix)
+        return matrix
+
+    def _memberships(self, slugs, by):
+        """(行号数组, 分组号数组, 分组名列表)；一条备忘录可以属于多个分组（例如多个标签）"""
+        labels, rows, groups = {}, [], []
+        for row, slug in enumerate(slugs):
+            created_at, tags, _ = self.meta[slug]
+            if by == "month":
+                keys = [created_at[:7]] if created_at else []
+            elif by == "year":
+                keys = [created_at[:4]] if created_at else []
+            elif by == "tag":
+                keys = tags
+            elif callable(by):
+                keys = [by(slug)]
+            else:
+                keys = [by.get(slug)]
+            for key in keys:
+                if key is None:
+                    continue
+                rows.append(row)
+                groups.append(labels.setdefault(key, len(labels)))
+        return np.asarray(rows, dtype=np.int64), np.asarray(groups, dtype=np.int64), list(labels)
+
+    def top_terms(self, by="month", k=10, groups=None, min_docs=2):
+        """
+        各分组最有区分度的词
+
+        Args:
+            by: "month"、"year"、"tag"，或 slug -> 分组名 的字典/函数（例如聚类结果）
+            k: 每组返回的词数
+            groups: 只返回这些分组
+            min_docs: 词项在组内至少出现在多少条备忘录中
+
+        Returns:
+            {分组名: [{"term", "score", "memos"}]}
+        """
+        key = (by if isinstance(by, str) else id(by), k, min_docs)
+        cached = self._cache.get(key)
+        if cached is None or cached[0] != self.version or not isinstance(by, str):
+            cached = (self.version, self._compute_top_terms(by, k, min_docs))
+            if isinstance(by, str):
+                self._cache[key] = cached
+        result = cached[1]
+        if groups is not None:
+            return {group: result.get(group, []) for group in groups}
+        return result
+
+    def _compute_top_terms(self, by, k, min_docs):
+        slugs, indptr, indices, weights = self._matrix()
+        member_rows, member_groups, labels = self._memberships(slugs, by)
+        if not len(member_rows):
+            return {}
+        group_sizes = np.bincount(member_groups, minlength=len(labels))
+
+        # 每个 (分组, 行) 展开成该行的全部非零项
+        starts, lengths = indptr[member_rows], indptr[member_rows + 1] - indptr[member_rows]
+        nnz = _ranges(starts, lengths)
+        nnz_groups = np.repeat(member_groups, lengths)
+        nnz_terms = indices[nnz].astype(np.int64)
+        keep = weights[nnz] > 0
+        nnz, nnz_groups, nnz_terms = nnz[keep], nnz_groups[keep], nnz_terms[keep]
+
+        # (分组, 词项) 聚合：权重之和、出现的备忘录数
+        pair_keys = nnz_groups * len(self.terms) + nnz_terms
+        pairs, inverse = np.unique(pair_keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=weights[nnz])
+        docs = np.bincount(inverse)
+        pair_groups, pair_terms = pairs // len(self.terms), pairs % len(self.terms)
+        enough = docs >= min_docs
+        pair_groups, pair_terms, sums, docs = pair_groups[enough], pair_terms[enough], sums[enough], docs[enough]
+
+        # 组内质心 × 分组逆文档频率：只在少数分组中突出的词得分更高
+        group_df = np.bincount(pair_terms, minlength=len(self.terms))
+        group_idf = np.log((1 + len(labels)) / (1 + group_df[pair_terms])) + 1
+        scores = sums / group_sizes[pair_groups] * group_idf
+
+        order = np.lexsort((-scores, pair_groups))
+        result = {}
+        for i in order:
+            group = labels[pair_groups[i]]
+            terms = result.setdefault(group, [])
+            if len(terms) < k:
+                terms.append({"term": self.terms[pair_terms[i]], "score": round(float(scores[i]), 4),
+                              "memos": int(docs[i])})
+        return result
+
+    def year_over_year(self, k=10):
+        """
+        逐年关键词报告
+
+        Returns:
+            [{"year", "memos", "top_terms", "new_terms", "faded_terms"}]，按年份升序；
+            new_terms 为今年进入前 k、去年不在前 3k 的词，faded_terms 反之
+        """
+        yearly = self.top_terms(by="year", k=k * 3)
+        counts = {}
+        for created_at, _, _ in self.meta.values():
+            if created_at:
+                counts[created_at[:4]] = counts.get(created_at[:4], 0) + 1
+
+        report, previous = [], None
+        for year in sorted(yearly):
+            terms = yearly[year]
+            top = [item["term"] for item in terms[:k]]
+            entry = {"year": year, "memos": counts.get(year, 0), "top_terms": terms[:k],
+                     "new_terms": [], "faded_terms": []}
+            if previous is not None:
+                last_all = {item["term"] for item in previous}
+                this_all = {item["term"] for item in terms}
+                entry["new_terms"] = [term for term in top if term not in last_all]
+                entry["faded_terms"] = [item["term"] for item in previous[:k] if item["term"] not in this_all]
+            report.append(entry)
+            previous = terms
+        return report
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        slugs = list(self.rows)
+        lengths = [len(self.rows[slug][0]) for slug in slugs]
+        np.save(os.path.join(directory, "indptr.npy"), np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+        np.save(os.path.join(directory, "indices.npy"),
+                np.concatenate([self.rows[slug][0] for slug in slugs]) if slugs else np.zeros(0, dtype=np.int32))
+        np.save(os.path.join(directory, "counts.npy"),
+                np.concatenate([self.rows[slug][1] for slug in slugs]) if slugs else np.zeros(0, dtype=np.float32))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"min_df": self.min_df, "max_df_ratio": self.max_df_ratio, "terms": self.terms,
+                       "slugs": slugs, "meta": [self.meta[slug] for slug in slugs]}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        """恢复词频行（不需要重新切词）"""
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        engine = cls(min_df=meta["min_df"], max_df_ratio=meta["max_df_ratio"])
+        engine.terms = meta["terms"]
+        engine.vocabulary = {term: i for i, term in enumerate(engine.terms)}
+        indptr = np.load(os.path.join(directory, "indptr.npy"))
+        indices = np.load(os.path.join(directory, "indices.npy"))
+        counts = np.load(os.path.join(directory, "counts.npy"))
+        for row, slug in enumerate(meta["slugs"]):
+            start, end = indptr[row], indptr[row + 1]
+            engine.rows[slug] = (indices[start:end], counts[start:end])
+            engine.meta[slug] = tuple(meta["meta"][row])
+        return engine
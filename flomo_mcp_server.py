@@ -0,0 +1,996 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_IMPORT_START = time.perf_counter()
+
+import numpy as np
+
+from flomo_analytics import MemoAnalyticsViews
+from flomo_index import LocalSearchIndex
+from flomo_mmap import WarmStateDirectory, resident_values
+from flomo_scheduler import BULK, SYNC, BackgroundScheduler, RequestScheduler
+from flomo_segments import MemoSegmentLog
+from flomo_store import MemoStore, html_to_text, to_epoch
+from flomo_sync import FlomoSyncEngine
+from flomo_tags import MemoTagIndex
+from flomo_timeline import TimestampIndex
+from flomo_transport import FlomoTransport
+from test3_searchapi import FlomoSearchAPI
+from test_relation import FlomoCompleteAPI
+from test_tags import FlomoTagEnhancedTest
+
+_IMPORTS_DONE = time.perf_counter()
+
+PROTOCOL_VERSION = "2024-11-05"
+
+# memory_estimate 的粗略系数（字节）
+MEMO_OVERHEAD = 600           # 每条备忘录的字典和元数据
+INDEX_FACTOR = 4              # 索引中每个字符对应的倒排和拼音结构
+RECOMMENDATION_SIZE = 2048    # 每条缓存的推荐结果
+ANALYTICS_RECORD_SIZE = 400   # 统计视图中每条备忘录的记录和预览
+TIMELINE_ENTRY_SIZE = 200     # 时间索引中每条备忘录的 epoch、slug 和字典项
+SERVER_INFO = {"name": "flomo-mcp-server", "version": "0.1.0"}
+# start_background_sync 注册的任务名（多账号时加 job_prefix）
+BACKGROUND_JOBS = ("memos", "tags", "recommendations", "follow")
+
+
+def format_memo(memo, score=None):
+    """工具返回的备忘录结构"""
+    result = {
+        "id": memo.get("slug"),
+        "content": html_to_text(memo.get("content", "")),
+        "tags": memo.get("tags", []),
+        "created_at": memo.get("created_at"),
+        "updated_at": memo.get("updated_at"),
+        "files": [file_item.get("name") for file_item in memo.get("files", [])],
+        "url": f"https://v.flomoapp.com/mine/?memo_id={memo.get('slug')}"
+    }
+    if score is not None:
+        result["similarity_score"] = round(float(score), 4)
+    return result
+
+
+class StartupTimer:
+    """记录启动各阶段耗时"""
+
+    def __init__(self):
+        self.phases = [("imports", _IMPORTS_DONE - _IMPORT_START)]
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        return {phase: round(seconds * 1000, 1) for phase, seconds in self.phases}
+
+    def print_report(self):
+        total = sum(seconds for _, seconds in self.phases)
+        print(f"⏱️ 启动耗时 {total * 1000:.0f} ms: " +
+              "，".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases), file=sys.stderr)
+
+
+def format_parsed(result):
+    """parse_search_result 解析结果转换为工具返回的备忘录结构"""
+    return {
+        "id": result["slug"],
+        "content": result["plain_text"],
+        "tags": result["tags"],
+        "created_at": result["created_at"],
+        "updated_at": result["updated_at"],
+        "files": [file_item.get("name") for file_item in result["files"]],
+        "url": result["url"]
+    }
+
+
+class FlomoContext:
+    """
+    服务器的共享状态
+
+    所有工具共用同一个传输层（连接池 + 条件请求缓存）、本地存储、
+    搜索索引、标签计数和向量索引。同步引擎增量更新这些结构，
+    工具调用直接读取，不需要像脚本那样每次冷启动重新拉取。
+
+    warm_dir 中保存上次同步后的预热快照（备忘录、搜索索引、标签计数、向量），
+    启动时以内存映射打开，不需要重新解析 JSON 或重建索引。
+
+    所有请求共用一个按优先级分配的速率配额：工具调用走 interactive 通道，
+    后台的备忘录/标签增量同步走 sync 通道，推荐关系抓取走 bulk 通道，
+    前台请求总是先拿到配额。
+
+    archive_dir 中是原始备忘录的只追加分段日志：同步时追加，本地快照都不可用时
+    从日志重建存储和索引，不需要重新全量拉取。
+
+    多账号部署时由 FlomoTenantManager 创建：request_scheduler 接到进程级的
+    共享配额上，background 为所有账号共用，job_prefix 区分各账号的任务。
+
+    多个工作进程共用一个 warm_dir 时，只有一个进程负责同步和发布快照，其余以
+    follower=True 只读打开：存储、搜索/标签/向量索引都内存映射同一代快照，
+    各进程共享一份页缓存；每次工具调用前读一次共享的代数计数器，
+    发现新的一代就重新打开（旧的映射随对象释放）。follower 不写存储、快照和归档。
+    """
+
+    def __init__(self, token, store_path="flomo_store.json", warm_dir="flomo_warm",
+                 rate=5.0, burst=10, request_scheduler=None, background=None, job_prefix="",
+                 archive_dir="flomo_archive", follower=False):
+        self.token = token
+        self.store_path = store_path
+        self.warm_state = WarmStateDirectory(warm_dir) if warm_dir else None
+        self.follower = follower and self.warm_state is not None
+        self.generation = 0
+        self.archive = MemoSegmentLog(archive_dir) if archive_dir and not self.follower else None
+        self.request_scheduler = request_scheduler or RequestScheduler(rate=rate, capacity=burst)
+        self.transport = FlomoTransport(token, scheduler=self.request_scheduler)
+        self._owns_background = background is None
+        self.background = background or BackgroundScheduler()
+        self.job_prefix = job_prefix
+        self.vector_index = None
+        self.dedup_index = None
+        self.insights = None
+        # slug -> 远程推荐结果；内容变化的备忘录排队等待后台重新抓取
+        self.recommendations = {}
+        self._stale_recommendations = OrderedDict()
+        self.startup = StartupTimer()
+        # 索引在工作线程中读写，用一把锁保证同步写入和查询互不干扰
+        self.lock = threading.RLock()
+        # 后台任务和 sync_memos 工具可能同时同步，写存储的操作串行执行
+        self._sync_lock = threading.Lock()
+
+    def _locked(self, callback):
+        def wrapper(memos):
+            with self.lock:
+                callback(memos)
+        return wrapper
+
+    def _on_memos_synced_lazy(self, memos):
+        if self.vector_index is not None:
+            self.vector_index.on_memos_synced(memos)
+        if self.dedup_index is not None:
+            self.dedup_index.on_memos_synced(memos)
+        if self.insights is not None:
+            self.insights.on_memos_synced(memos)
+
+    def _queue_recommendations(self, memos):
+        for memo in memos:
+            slug = memo["slug"]
+            if memo.get("deleted_at"):
+                self.recommendations.pop(slug, None)
+                self._stale_recommendations.pop(slug, None)
+            else:
+                self._stale_recommendations[slug] = True
+                self._stale_recommendations.move_to_end(slug)
+
+    def _warm_directory(self):
+        """可用的预热快照目录；比 JSON 快照旧时返回 None"""
+        if self.warm_state is None:
+            return None
+        directory = self.warm_state.current()
+        if directory is None:
+            return None
+        # follower 只跟随已发布的快照；同步进程写 JSON 和发布快照之间的间隙不算过期
+        if not self.follower and self.store_path and os.path.exists(self.store_path) and \
+                os.path.getmtime(self.store_path) > self.warm_state.mtime():
+            return None
+        return directory
+
+    def warm_up(self):
+        """打开本地快照并建立共享的客户端和索引"""
+        if self.warm_state is not None:
+            self.generation = self.warm_state.generation()
+        directory = self._warm_directory()
+        with self.lock:
+            if directory:
+                self.store = MemoStore.load_mmap(directory, path=self.store_path,
+                                                read_only=self.follower)
+                self.startup.mark("store(mmap)")
+                self.local_index = LocalSearchIndex.load(os.path.join(directory, "index"), read_only=self.follower)
+                self.startup.mark("search_index(mmap)")
+                if os.path.exists(os.path.join(directory, "tags", "meta.json")):
+                    tag_index = MemoTagIndex.load_mmap(os.path.join(directory, "tags"), read_only=self.follower)
+                else:
+                    tag_index = MemoTagIndex.load(os.path.join(directory, "tags.json"))
+                self.startup.mark("tag_index")
+                analytics_path = os.path.join(directory, "analytics.json")
+                if os.path.exists(analytics_path):
+                    self.analytics = MemoAnalyticsViews.load(analytics_path)
+                else:
+                    # 旧版本的快照没有统计视图
+                    self.analytics = MemoAnalyticsViews()
+                    self.analytics.build(list(self.store.values()))
+                self.startup.mark("analytics")
+                timeline_path = os.path.join(directory, "timeline")
+                if os.path.exists(os.path.join(timeline_path, "meta.json")):
+                    self.timeline = TimestampIndex.load(timeline_path)
+                else:
+                    self.timeline = TimestampIndex(tz=self.store.tz)
+                    self.timeline.build(list(self.store.values()))
+                self.startup.mark("timeline")
+                if os.path.exists(os.path.join(directory, "vectors", "meta.json")):
+                    from flomo_vectors import MemoVectorIndex
+                    self.vector_index = MemoVectorIndex.load(os.path.join(directory, "vectors"), mmap_mode="r")
+                    self.startup.mark("vectors(mmap)")
+                if os.path.exists(os.path.join(directory, "dedup", "meta.json")):
+                    from flomo_dedup import NearDuplicateIndex
+                    self.dedup_index = NearDuplicateIndex.load(os.path.join(directory, "dedup"))
+                    self.startup.mark("dedup")
+                if os.path.exists(os.path.join(directory, "insights", "meta.json")):
+                    from flomo_insights import InsightEngine
+                    self.insights = InsightEngine.load(os.path.join(directory, "insights"))
+                    self.startup.mark("insights")
+            else:
+                self.store = MemoStore(self.store_path)
+                self.startup.mark("store(json)")
+                if self.archive is not None and not len(self.store) and len(self.archive):
+                    self._restore_from_archive()
+                    self.startup.mark("store(archive)")
+                self.local_index = LocalSearchIndex(tz=self.store.tz)
+                self.local_index.build(list(self.store.values()))
+                self.startup.mark("search_index(build)")
+                tag_index = MemoTagIndex()
+                tag_index.build(list(self.store.values()))
+                self.startup.mark("tag_index")
+                self.analytics = MemoAnalyticsViews()
+                self.analytics.build(list(self.store.values()))
+                self.startup.mark("analytics")
+                self.timeline = TimestampIndex(tz=self.store.tz)
+                self.timeline.build(list(self.store.values()))
+                self.startup.mark("timeline")
+
+            self.search_api = FlomoSearchAPI(self.token, transport=self.transport, store=self.store,
+                                             local_index=self.local_index, timeline=self.timeline,
+                                             tag_index=tag_index)
+            self.complete_api = FlomoCompleteAPI(self.token, transport=self.transport, store=self.store,
+                                                 vector_index=self.vector_index, dedup_index=self.dedup_index)
+            self.tag_api = FlomoTagEnhancedTest(self.token, transport=self.transport, store=self.store,
+                                                tag_index=tag_index)
+            self.tag_index = tag_index
+
+            self.sync_engine = FlomoSyncEngine(self.complete_api, self.store)
+            self.sync_engine.add_listener(self._locked(self.search_api.query_cache.on_memos_synced))
+            self.sync_engine.add_listener(self._locked(self.local_index.on_memos_synced))
+            self.sync_engine.add_listener(self._locked(self.tag_index.on_memos_synced))
+            self.sync_engine.add_listener(self._locked(self.analytics.on_memos_synced))
+            self.sync_engine.add_listener(self._locked(self.timeline.on_memos_synced))
+            self.sync_engine.add_listener(self._locked(self.search_api.planner.on_memos_synced))
+            self.sync_engine.add_listener(self._locked(self._on_memos_synced_lazy))
+            self.sync_engine.add_listener(self._locked(self._queue_recommendations))
+            if self.archive is not None:
+                self.sync_engine.add_listener(self.archive.on_memos_synced)
+                if not len(self.archive) and len(self.store):
+                    # 第一次启用归档时写入现有的全部备忘录
+                    self.archive.append(list(self.store.values()))
+                    self.archive.flush()
+            self.startup.mark("clients")
+
+        self.startup.print_report()
+        if not directory and len(self.store):
+            self.save_warm_state()
+
+    def _restore_from_archive(self):
+        """从分段日志重建存储；游标取最后更新的备忘录，之后的增量同步从那里继续"""
+        for memo in self.archive.iter_memos():
+            self.store.upsert(memo)
+        latest = max((to_epoch(memo["updated_at"], self.store.tz), memo["slug"]) for memo in self.store.values())
+        self.store.cursor = {"latest_slug": latest[1], "latest_updated_at": latest[0]}
+        self.store.save()
+        print(f"📦 已从归档恢复 {len(self.store)} 条备忘录", file=sys.stderr)
+
+    def save_warm_state(self):
+        """写入新一代预热快照（在同步线程中调用，不阻塞查询）"""
+        if self.warm_state is None or self.follower:
+            return
+        start = time.time()
+        directory = self.warm_state.new_generation()
+        self.store.save_mmap(directory)
+        self.local_index.save(os.path.join(directory, "index"))
+        self.tag_index.save_mmap(os.path.join(directory, "tags"))
+        self.analytics.save(os.path.join(directory, "analytics.json"))
+        self.timeline.save(os.path.join(directory, "timeline"))
+        if self.vector_index is not None:
+            self.vector_index.save(os.path.join(directory, "vectors"))
+        if self.dedup_index is not None:
+            self.dedup_index.save(os.path.join(directory, "dedup"))
+        if self.insights is not None:
+            self.insights.save(os.path.join(directory, "insights"))
+        self.warm_state.publish(directory)
+        self.generation = self.warm_state.generation()
+        print(f"💾 预热快照已保存: {directory}，耗时 {time.time() - start:.1f}s", file=sys.stderr)
+
+    def publish_warm_state(self):
+        """
+        在工具线程中保存预热快照
+
+        与后台同步共用 _sync_lock：save() 遍历的索引不会在保存过程中被同步修改，
+        两次保存也不会选到同一个 gen-N 目录。
+        """
+        with self._sync_lock:
+            self.save_warm_state()
+
+    def refresh(self):
+        """
+        follower 切换到最新发布的快照
+
+        Returns:
+            是否切换了
+        """
+        if not self.follower or self.warm_state.generation() == self.generation:
+            return False
+        with self._sync_lock:
+            if self.warm_state.generation() == self.generation:
+                return False
+            self.startup = StartupTimer()
+            with self.lock:
+                # 新一代快照里没有的可选索引不能沿用旧对象，需要时再由 ensure_* 建立
+                self.vector_index = None
+                self.dedup_index = None
+                self.insights = None
+            self.warm_up()
+        print(f"🔁 已切换到第 {self.generation} 代快照", file=sys.stderr)
+        return True
+
+    def sync(self):
+        if self.follower:
+            # 只读进程不访问服务器，由负责同步的进程发布新快照
+            self.refresh()
+            return 0
+        with self._sync_lock:
+            cursor = dict(self.store.cursor)
+            changed = self.sync_engine.sync()
+            if self.archive is not None:
+                self.archive.flush()
+                self.archive.maybe_compact()
+            if changed or self.store.cursor != cursor:
+                # JSON 快照重写过，预热快照要跟着发布新的一代，否则下次启动会被判为过期
+                self.save_warm_state()
+        return changed
+
+    def sync_tags(self):
+        if self.follower:
+            return self.refresh()
+        with self._sync_lock:
+            tag_cursor = dict(self.store.tag_cursor)
+            changed = self.tag_api.sync_tags()
+            if changed or self.store.tag_cursor != tag_cursor:
+                self.save_warm_state()
+            return changed
+
+    def get_recommendations(self, slug):
+        """远程推荐，优先返回后台已抓取的结果"""
+        with self.lock:
+            cached = self.recommendations.get(slug)
+        if cached is not None:
+            return cached
+        recommendations = self.complete_api.get_memo_recommendations(slug, raise_errors=True)
+        self._remember_recommendations(slug, recommendations)
+        return recommendations
+
+    def _remember_recommendations(self, slug, recommendations):
+        with self.lock:
+            self.recommendations[slug] = recommendations
+            self._stale_recommendations.pop(slug, None)
+            for item in recommendations:
+                if item.get("memo"):
+                    self.complete_api.graph.upsert_edge(slug, item["memo"]["slug"],
+                                                        float(item.get("similarity", 0)))
+
+    def refresh_recommendations(self, batch=20):
+        """重新抓取最近变化的一批备忘录的推荐关系（最新变化的优先）"""
+        with self.lock:
+            slugs = []
+            while self._stale_recommendations and len(slugs) < batch:
+                slugs.append(self._stale_recommendations.popitem(last=True)[0])
+        refreshed = 0
+        for slug in slugs:
+            try:
+                recommendations = self.complete_api.get_memo_recommendations(slug, raise_errors=True)
+            except Exception:
+                # 失败的留到下一轮
+                with self.lock:
+                    self._stale_recommendations.setdefault(slug, True)
+                continue
+            self._remember_recommendations(slug, recommendations)
+            refreshed += 1
+        return refreshed
+
+    def start_background_sync(self, memo_interval=300, tag_interval=1800, recommendation_interval=60,
+                              jitter=0.1, run_immediately=True, follow_interval=5):
+        """
+        启动后台增量同步
+
+        备忘录和标签走 sync 通道，推荐关系抓取走 bulk 通道；
+        间隔带 ±jitter 的随机抖动。follower 不同步，只每隔 follow_interval 秒检查新快照
+        （空闲时也及时切换，旧一代的文件才能被释放）。
+        """
+        prefix = self.job_prefix
+        if self.follower:
+            self.background.add_job(prefix + "follow", self.refresh, follow_interval, lane=SYNC, jitter=jitter)
+        else:
+            self.background.add_job(prefix + "memos", self.sync, memo_interval, lane=SYNC, jitter=jitter,
+                                    run_immediately=run_immediately)
+            self.background.add_job(prefix + "tags", self.sync_tags, tag_interval, lane=SYNC, jitter=jitter,
+                                    run_immediately=run_immediately)
+        self.background.add_job(prefix + "recommendations", self.refresh_recommendations,
+                                recommendation_interval, lane=BULK, jitter=jitter, run_immediately=False)
+        self.background.start()
+
+    def memory_estimate(self):
+        """
+        估算常驻内存（字节）
+
+        只统计已解码进内存的部分：内存映射打开、尚未访问的备忘录和索引行不计入。
+        """
+        with self.lock:
+            if not hasattr(self, "store"):
+                return 0
+            total = sum(len(memo.get("content") or "") + MEMO_OVERHEAD
+                        for memo in list(resident_values(self.store.memos)))
+            total += sum(len(text) * INDEX_FACTOR + MEMO_OVERHEAD
+                         for text in list(resident_values(self.local_index.doc_text)))
+            total += self.transport.cached_bytes()
+            total += len(self.recommendations) * RECOMMENDATION_SIZE
+            total += len(self.analytics.records) * ANALYTICS_RECORD_SIZE
+            total += len(self.timeline) * TIMELINE_ENTRY_SIZE
+            if self.dedup_index is not None:
+                total += self.dedup_index.signatures.nbytes + self.dedup_index.band_keys.nbytes
+            if self.insights is not None:
+                total += sum(ids.nbytes + counts.nbytes for ids, counts in self.insights.rows.values())
+            vectors = getattr(self.vector_index, "vectors", None)
+            if vectors is not None and not isinstance(vectors, np.memmap):
+                total += vectors.nbytes
+        return total
+
+    def background_busy(self):
+        """本账号是否有后台任务正在运行"""
+        return any(self.background.is_running(self.job_prefix + name) for name in BACKGROUND_JOBS)
+
+    def close(self):
+        """
+        停止本账号的后台任务并释放连接（预热快照留在磁盘上）
+
+        已经开始的同步或推荐抓取会先执行完，之后才关闭归档和连接。
+        """
+        for name in BACKGROUND_JOBS:
+            self.background.remove_job(self.job_prefix + name)
+        if self._owns_background:
+            self.background.stop(timeout=1)
+        while self.background_busy():
+            time.sleep(0.05)
+        # sync_memos 工具发起的同步也持有这把锁
+        with self._sync_lock:
+            if self.archive is not None:
+                self.archive.close()
+            self.transport.session.close()
+
+    def ensure_vector_index(self):
+        """第一次需要本地推荐时建立向量索引"""
+        with self.lock:
+            if self.vector_index is not None or not len(self.store):
+                return self.vector_index
+            from flomo_vectors import MemoVectorIndex
+            self.vector_index = MemoVectorIndex()
+            self.vector_index.build(list(self.store.values()))
+            self.complete_api.vector_index = self.vector_index
+        # 下次启动直接内存映射打开
+        self.publish_warm_state()
+        return self.vector_index
+
+    def ensure_dedup_index(self):
+        """第一次查重时计算全部备忘录的指纹，之后随同步增量更新"""
+        with self.lock:
+            if self.dedup_index is not None:
+                return self.dedup_index
+            from flomo_dedup import NearDuplicateIndex
+            self.dedup_index = NearDuplicateIndex()
+            self.dedup_index.build(list(self.store.values()))
+            self.complete_api.dedup_index = self.dedup_index
+        self.publish_warm_state()
+        return self.dedup_index
+
+    def ensure_insights(self):
+        """第一次提取关键词时为全部备忘录切词，之后随同步增量更新"""
+        with self.lock:
+            if self.insights is not None:
+                return self.insights
+            from flomo_insights import InsightEngine
+            self.insights = InsightEngine()
+            self.insights.build(list(self.store.values()))
+        self.publish_warm_state()
+        return self.insights
+
+
+class ToolCall:
+    """
+    一次工具调用的进度和取消状态（在工作线程中使用）
+
+    notify 由服务器提供，线程安全地发出 notifications/progress；
+    调用方没有要求进度时为 None。cancelled 在收到 notifications/cancelled 时置位。
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self.cancelled = threading.Event()
+
+    def progress(self, progress, total=None, message=None, **extra):
+        if self.notify is not None:
+            self.notify(progress, total, message, extra)
+
+
+class FlomoTools:
+    """MCP 工具实现（同步函数，在线程池中执行）"""
+
+    # 接受 call 参数、会逐页发出进度的工具
+    STREAMING = {"search_memos", "advanced_search"}
+
+    def __init__(self, context):
+        self.context = context
+
+    def search_memos(self, keywords, limit=20, sort_by="relevance", call=None):
+        context = self.context
+        call = call or ToolCall()
+        with context.lock:
+            has_local = len(context.local_index) > 0
+            if has_local and sort_by == "relevance":
+                hits = context.search_api.ranked_search(keywords, k=limit)
+                return {"source": "local", "results": [format_memo(memo, score) for score, memo in hits]}
+            if has_local:
+                memos = context.search_api.local_search(keywords, limit=limit)
+                return {"source": "local", "results": [format_memo(memo) for memo in memos]}
+        # 远程搜索逐页返回：每页发一次进度（附带该页结果），取消后停止翻页
+        memos = []
+        pages = context.search_api.iter_search_pages(keywords, max_results=limit)
+        try:
+            for page in pages:
+                memos.extend(page)
+                call.progress(len(memos), limit, f"已获取 {len(memos)} 条",
+                              results=[format_memo(memo) for memo in page])
+                if call.cancelled.is_set():
+                    break
+        finally:
+            pages.close()
+        if sort_by == "relevance":
+            memos = context.search_api.ranker.rank_memos(keywords, memos, k=limit)
+        elif sort_by in ("created_at", "updated_at"):
+            memos = sorted(memos, key=lambda memo: memo.get(sort_by) or "", reverse=True)
+        return {"source": "remote", "results": [format_memo(memo) for memo in memos[:limit]]}
+
+    def advanced_search(self, query, include_tags=None, exclude_tags=None, has_files=None, days=None,
+                        limit=20, explain=False, call=None):
+        context = self.context
+        call = call or ToolCall()
+        date_from = time.time() - days * 86400 if days else None
+        filters = {"include_tags": include_tags, "exclude_tags": exclude_tags, "has_files": has_files,
+                   "date_from": date_from}
+        with context.lock:
+            plan = context.search_api.explain_search(query, **filters)
+        results = []
+        scanned_pages = 0
+        # 本地计划只在读取索引和取出原始备忘录时持锁，HTML 解析不阻塞同步；服务端计划不持锁等待网络
+        pages = context.search_api.iter_advanced_search(query, plan=plan, lock=context.lock, **filters)
+        try:
+            for page in pages:
+                scanned_pages += 1
+                formatted = [format_parsed(result) for result in page][:limit - len(results)]
+                results.extend(formatted)
+                call.progress(len(results), limit, f"已扫描 {scanned_pages} 页，命中 {len(results)} 条",
+                              results=formatted)
+                # 结果够了就不再翻页
+                if len(results) >= limit or call.cancelled.is_set():
+                    break
+        finally:
+            pages.close()
+        result = {"source": "remote" if plan["plan"] == "server" else "local", "plan": plan["plan"],
+                  "results": results}
+        if explain:
+            result["explain"] = plan
+        return result
+
+    def get_recent_memos(self, days=7, limit=20):
+        context = self.context
+        with context.lock:
+            memos = context.search_api.recent_memos(days=days, limit=limit)
+            return {"results": [format_memo(memo) for memo in memos]}
+
+    def get_related_memos(self, memo_id, similarity_threshold=0.7, exclude_same_tags=False, limit=10,
+                          source="remote"):
+        context = self.context
+        if source == "local":
+            context.ensure_vector_index()
+            with context.lock:
+                recommendations = context.complete_api.get_local_recommendations(memo_id, k=limit)
+        else:
+            if exclude_same_tags:
+                recommendations = context.complete_api.get_memo_recommendations(memo_id, no_same_tag=1)
+            else:
+                recommendations = context.get_recommendations(memo_id)
+        results = []
+        for item in recommendations:
+            similarity = float(item.get("similarity", 0))
+            if similarity >= similarity_threshold and item.get("memo"):
+                results.append(format_memo(item["memo"], similarity))
+        return {"source": source, "results": results[:limit]}
+
+    def find_duplicates(self, threshold=0.7, limit=20):
+        context = self.context
+        context.ensure_dedup_index()
+        with context.lock:
+            groups = context.complete_api.find_near_duplicates(threshold=threshold)
+            return {"total_groups": len(groups), "groups": groups[:limit]}
+
+    def extract_insights(self, group_by="month", periods=None, top_k=10, year_over_year=False):
+        context = self.context
+        context.ensure_insights()
+        with context.lock:
+            if year_over_year:
+                return {"years": context.insights.year_over_year(k=top_k)}
+            groups = context.insights.top_terms(by=group_by, k=top_k, groups=periods)
+            if periods is None and group_by == "month":
+                # 默认只返回最近 12 个月
+                groups = dict(sorted(groups.items())[-12:])
+            return {"group_by": group_by, "groups": groups}
+
+    def analyze_tags(self, top_n=20, include_hierarchy=True, sync_catalogue=False):
+        context = self.context
+        if sync_catalogue:
+            context.sync_tags()
+        with context.lock:
+            counts = context.tag_index.counts
+            result = {
+                "total_tags": len(counts),
+                "top_tags": dict(counts.most_common(top_n))
+            }
+            if include_hierarchy:
+                result["top_level_tags"] = dict(context.tag_index.root_counts.most_common(top_n))
+            if context.store.tags:
+                reconciliation = context.tag_api.tag_sync.reconcile(context.tag_index)
+                result["missing_tags"] = reconciliation["missing_tags"]
+                result["orphaned_tags"] = reconciliation["orphaned_tags"]
+            return result
+
+    def get_statistics(self):
+        context = self.context
+        with context.lock:
+            analytics = context.analytics
+            earliest, latest = analytics.date_range()
+            return {
+                "total_memos": len(context.store),
+                "total_tags": len(context.tag_index.counts),
+                "total_words": analytics.total_words,
+                "date_range": {"earliest": earliest, "latest": latest},
+                "monthly_distribution": dict(sorted(analytics.monthly.items())),
+                "top_tags": dict(context.tag_index.counts.most_common(20)),
+                "latest_memos": analytics.latest(5),
+                "network": context.transport.report(),
+                "startup_ms": context.startup.report(),
+                "background": context.background.status(context.job_prefix),
+                "rate_lanes": context.request_scheduler.report(),
+                "archive": context.archive.stats() if context.archive is not None else None,
+                "warm_generation": context.generation,
+                "query_cache": context.search_api.query_cache.report()
+            }
+
+    def sync_memos(self):
+        changed = self.context.sync()
+        return {"changed": changed, "total_memos": len(self.context.store)}
+
+
+TOOLS = [
+    {
+        "name": "search_memos",
+        "description": "搜索备忘录（有本地索引时支持拼音、首字母和模糊匹配）",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "keywords": {"type": "string", "description": "搜索关键词，支持多个词用空格分隔"},
+                "limit": {"type": "integer", "default": 20, "minimum": 1, "maximum": 100},
+                "sort_by": {"type": "string", "enum": ["relevance", "created_at", "updated_at"],
+                            "default": "relevance"}
+            },
+            "required": ["keywords"]
+        }
+    },
+    {
+        "name": "advanced_search",
+        "description": "高级搜索：按标签、附件、时间过滤，自动选择本地索引、标签优先或服务端搜索；支持进度通知，够数即停止",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "搜索关键词"},
+                "include_tags": {"type": "array", "items": {"type": "string"}},
+                "exclude_tags": {"type": "array", "items": {"type": "string"}},
+                "has_files": {"type": "boolean"},
+                "days": {"type": "integer", "minimum": 1, "description": "只要最近几天的备忘录"},
+                "limit": {"type": "integer", "default": 20, "minimum": 1, "maximum": 100},
+                "explain": {"type": "boolean", "default": False,
+                            "description": "附带执行计划（各计划的估算代价、基数统计和实际扫描量）"}
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "name": "get_recent_memos",
+        "description": "获取最近的备忘录列表",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "days": {"type": "integer", "default": 7, "minimum": 1, "maximum": 365},
+                "limit": {"type": "integer", "default": 20, "minimum": 1, "maximum": 100}
+            }
+        }
+    },
+    {
+        "name": "get_related_memos",
+        "description": "获取与指定备忘录相关的推荐内容",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "memo_id": {"type": "string", "description": "备忘录ID（slug）"},
+                "similarity_threshold": {"type": "number", "default": 0.7, "minimum": 0.0, "maximum": 1.0},
+                "exclude_same_tags": {"type": "boolean", "default": False},
+                "limit": {"type": "integer", "default": 10, "minimum": 1, "maximum": 50},
+                "source": {"type": "string", "enum": ["remote", "local"], "default": "remote",
+                           "description": "remote=flomo 推荐接口，local=本地向量索引"}
+            },
+            "required": ["memo_id"]
+        }
+    },
+    {
+        "name": "analyze_tags",
+        "description": "分析标签使用情况（全部备忘录）",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "top_n": {"type": "integer", "default": 20, "minimum": 1},
+                "include_hierarchy": {"type": "boolean", "default": True},
+                "sync_catalogue": {"type": "boolean", "default": False,
+                                   "description": "先同步标签目录，再对比缺失/未使用的标签"}
+            }
+        }
+    },
+    {
+        "name": "find_duplicates",
+        "description": "查找全部近似重复的备忘录（重复摘录、修改后的副本）",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "threshold": {"type": "number", "default": 0.7, "minimum": 0, "maximum": 1,
+                              "description": "最低相似度（字符切片的 Jaccard 估计）"},
+                "limit": {"type": "integer", "default": 20, "minimum": 1}
+            }
+        }
+    },
+    {
+        "name": "extract_insights",
+        "description": "提取各时间段/标签最有区分度的关键词（TF-IDF），或逐年关键词变化报告",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "group_by": {"type": "string", "enum": ["month", "year", "tag"], "default": "month"},
+                "periods": {"type": "array", "items": {"type": "string"},
+                            "description": "只返回这些分组，例如 [\"2024-03\"] 或标签名；默认按月时为最近 12 个月"},
+                "top_k": {"type": "integer", "default": 10, "minimum": 1},
+                "year_over_year": {"type": "boolean", "default": False,
+                                   "description": "返回逐年报告（每年的关键词、新出现和淡出的词）"}
+            }
+        }
+    },
+    {
+        "name": "get_statistics",
+        "description": "备忘录统计（总数、月度分布、常用标签、网络和缓存状态）",
+        "inputSchema": {"type": "object", "properties": {}}
+    },
+    {
+        "name": "sync_memos",
+        "description": "增量同步备忘录到本地",
+        "inputSchema": {"type": "object", "properties": {}}
+    },
+]
+
+
+class FlomoMCPServer:
+    """
+    MCP stdio 服务器（JSON-RPC 2.0，每行一条消息）
+
+    事件循环只负责读写消息和分发；工具执行、结果序列化等 CPU 工作
+    都交给线程池，多个工具调用可以并发进行。请求带 _meta.progressToken 时，
+    分页工具每取到一页就发出 notifications/progress；notifications/cancelled
+    会让进行中的调用停止翻页，并且不再发送响应。
+
+    传入 tenants（FlomoTenantManager）时，请求的 _meta.flomoToken 指定账号，
+    工具在该账号的上下文中执行；没有 flomoToken 的请求使用 context。
+    """
+
+    def __init__(self, context, max_workers=4, tenants=None):
+        self.context = context
+        self.tenants = tenants
+        self.tools = FlomoTools(context)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.loop = None
+        self._out = None
+        self._pending = set()
+        self._calls = {}
+
+    def _write(self, message):
+        self._out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        self._out.flush()
+
+    def _progress_notifier(self, token):
+        def notify(progress, total, message, extra):
+            params = {"progressToken": token, "progress": progress}
+            if total is not None:
+                params["total"] = total
+            if message:
+                params["message"] = message
+            params.update(extra)
+            notification = {"jsonrpc": "2.0", "method": "notifications/progress", "params": params}
+            self.loop.call_soon_threadsafe(self._write, notification)
+        return notify
+
+    async def _call_tool(self, name, arguments, call, token=None):
+        handler = getattr(self.tools, name, None)
+        if name not in {tool["name"] for tool in TOOLS} or handler is None:
+            return {"content": [{"type": "text", "text": f"未知工具: {name}"}], "isError": True}
+        if name in self.tools.STREAMING:
+            arguments = dict(arguments, call=call)
+
+        def run():
+            if token is not None and self.tenants is not None:
+                with self.tenants.session(token) as context:
+                    result = getattr(FlomoTools(context), name)(**arguments)
+            elif self.context is None:
+                raise ValueError("缺少 _meta.flomoToken")
+            else:
+                self.context.refresh()
+                result = handler(**arguments)
+            return json.dumps(result, ensure_ascii=False, default=str)
+
+        try:
+            text = await self.loop.run_in_executor(self.executor, run)
+            return {"content": [{"type": "text", "text": text}], "isError": False}
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"{type(e).__name__}: {e}"}], "isError": True}
+
+    async def handle(self, message):
+        """处理一条请求，返回响应（通知返回 None）"""
+        method = message.get("method")
+        params = message.get("params") or {}
+        request_id = message.get("id")
+
+        if method == "initialize":
+            result = {
+                "protocolVersion": params.get("protocolVersion", PROTOCOL_VERSION),
+                "capabilities": {"tools": {"listChanged": False}},
+                "serverInfo": SERVER_INFO
+            }
+        elif method == "ping":
+            result = {}
+        elif method == "tools/list":
+            result = {"tools": TOOLS}
+        elif method == "tools/call":
+            meta = params.get("_meta") or {}
+            token = meta.get("progressToken")
+            call = ToolCall(self._progress_notifier(token) if token is not None else None)
+            if request_id is not None:
+                self._calls[request_id] = call
+            try:
+                result = await self._call_tool(params.get("name"), params.get("arguments") or {}, call,
+                                               token=meta.get("flomoToken"))
+            finally:
+                self._calls.pop(request_id, None)
+            if call.cancelled.is_set():
+                return None
+        elif method == "notifications/cancelled":
+            call = self._calls.get(params.get("requestId"))
+            if call is not None:
+                call.cancelled.set()
+            return None
+        elif request_id is None:
+            return None  # notifications/initialized 等通知不需要响应
+        else:
+            return {"jsonrpc": "2.0", "id": request_id,
+                    "error": {"code": -32601, "message": f"Method not found: {method}"}}
+
+        if request_id is None:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    async def _dispatch(self, line):
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError as e:
+            self._write({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": f"Parse error: {e}"}})
+            return
+        try:
+            response = await self.handle(message)
+        except Exception as e:
+            response = {"jsonrpc": "2.0", "id": message.get("id"),
+                        "error": {"code": -32603, "message": str(e)}}
+        if response is not None:
+            self._write(response)
+
+    async def serve(self, stdin=None, stdout=None, sync_on_start=True, background_sync=None):
+        """
+        Args:
+            sync_on_start: 启动后立即做一次增量同步
+            background_sync: FlomoContext.start_background_sync 的参数（间隔等）；
+                为 None 时不启动后台同步
+        """
+        self.loop = asyncio.get_running_loop()
+        stdin = stdin or sys.stdin
+        # stdout 是协议通道；脚本里的 print 一律改到 stderr
+        self._out = stdout or sys.stdout
+        sys.stdout = sys.stderr
+
+        if self.context is not None:
+            await self.loop.run_in_executor(self.executor, self.context.warm_up)
+            if background_sync is not None:
+                self.context.start_background_sync(run_immediately=sync_on_start, **background_sync)
+            elif sync_on_start:
+                self._spawn(self.loop.run_in_executor(self.executor, self.context.sync))
+
+        while True:
+            line = await self.loop.run_in_executor(None, stdin.readline)
+            if not line:
+                break
+            if line.strip():
+                self._spawn(self._dispatch(line))
+
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self.context is not None:
+            self.context.close()
+        if self.tenants is not None:
+            self.tenants.close()
+        self.executor.shutdown(wait=False)
+
+    def _spawn(self, awaitable):
+        task = asyncio.ensure_future(awaitable)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+
+def main():
+    token = os.environ.get("FLOMO_TOKEN")
+    tenant_dir = os.environ.get("FLOMO_TENANT_DIR")
+    if not token and not tenant_dir:
+        print("❌ 请设置环境变量 FLOMO_TOKEN（形如 'Bearer xxx'），"
+              "或设置 FLOMO_TENANT_DIR 以多账号模式运行", file=sys.stderr)
+        sys.exit(1)
+
+    # FLOMO_SYNC_INTERVAL=0 关闭后台同步
+    interval = int(os.environ.get("FLOMO_SYNC_INTERVAL", "300"))
+    background_sync = {"memo_interval": interval, "tag_interval": interval * 6} if interval > 0 else None
+
+    tenants = None
+    if tenant_dir:
+        from flomo_tenants import FlomoTenantManager
+        tenants = FlomoTenantManager(
+            root=tenant_dir,
+            memory_limit=int(os.environ.get("FLOMO_MEMORY_LIMIT_MB", "512")) * 1024 * 1024,
+            rate=float(os.environ.get("FLOMO_HOST_RATE", "50")),
+            tenant_rate=float(os.environ.get("FLOMO_RATE", "5")),
+            background_sync=background_sync)
+
+    context = None
+    if token:
+        context = FlomoContext(token,
+                               store_path=os.environ.get("FLOMO_STORE", "flomo_store.json"),
+                               warm_dir=os.environ.get("FLOMO_WARM_DIR", "flomo_warm"),
+                               archive_dir=os.environ.get("FLOMO_ARCHIVE_DIR", "flomo_archive"),
+                               follower=os.environ.get("FLOMO_FOLLOWER", "0") == "1",
+                               rate=float(os.environ.get("FLOMO_RATE", "5")))
+    server = FlomoMCPServer(context, tenants=tenants)
+    asyncio.run(server.serve(sync_on_start=os.environ.get("FLOMO_SYNC_ON_START", "1") != "0",
+                             background_sync=background_sync))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+import json
+import mmap
+import os
+import shutil
+import struct
+from collections.abc import MutableMapping
+
+import numpy as np
+
+
+class StringBlob:
+    """
+    内存映射的字符串表
+
+    <name>.bin 保存全部字符串的 UTF-8 拼接，<name>.offsets.npy 保存 N+1 个偏移量；
+    按行号读取时才解码，打开文件几乎不花时间。
+    """
+
+    def __init__(self, directory, name):
+        self.offsets = np.load(os.path.join(directory, name + ".offsets.npy"), mmap_mode="r")
+        path = os.path.join(directory, name + ".bin")
+        if os.path.getsize(path):
+            with open(path, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return self.data[int(self.offsets[row]):int(self.offsets[row + 1])].decode("utf-8")
+
+    @staticmethod
+    def write(directory, name, strings):
+        offsets = [0]
+        with open(os.path.join(directory, name + ".bin"), "wb") as f:
+            for value in strings:
+                encoded = value.encode("utf-8")
+                f.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+        np.save(os.path.join(directory, name + ".offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+
+def save_csr(directory, name, rows):
+    """把 [(key, [列号], [值])] 写成 CSR 数组（值为 None 时只保存列号）"""
+    keys, ptr, columns, values = [], [0], [], None
+    for key, cols, vals in rows:
+        keys.append(key)
+        columns.extend(cols)
+        if vals is not None:
+            values = values or []
+            values.extend(vals)
+        ptr.append(len(columns))
+    np.save(os.path.join(directory, name + ".ptr.npy"), np.asarray(ptr, dtype=np.int64))
+    np.save(os.path.join(directory, name + ".cols.npy"), np.asarray(columns, dtype=np.int32))
+    if values is not None:
+        np.save(os.path.join(directory, name + ".vals.npy"), np.asarray(values, dtype=np.int32))
+    with open(os.path.join(directory, name + ".keys.json"), "w", encoding="utf-8") as f:
+        json.dump(keys, f, ensure_ascii=False)
+
+
+def load_csr(directory, name):
+    """返回 (keys, ptr, cols, vals)；数组以只读内存映射打开，vals 可能为 None"""
+    with open(os.path.join(directory, name + ".keys.json"), "r", encoding="utf-8") as f:
+        keys = json.load(f)
+    ptr = np.load(os.path.join(directory, name + ".ptr.npy"), mmap_mode="r")
+    cols = np.load(os.path.join(directory, name + ".cols.npy"), mmap_mode="r")
+    vals_path = os.path.join(directory, name + ".vals.npy")
+    vals = np.load(vals_path, mmap_mode="r") if os.path.exists(vals_path) else None
+    return keys, ptr, cols, vals
+
+
+class FrozenMapping(MutableMapping):
+    """
+    只读底表 + 写入覆盖层的字典
+
+    底表是内存映射文件中的 key -> 行号，读取某个键时才用 load_row 解码该行，
+    解码结果放进覆盖层（之后的原地修改会保留）。写入和删除只改覆盖层，
+    不会修改底层文件。default_factory 与 defaultdict 相同。
+
+    cache=False 用于只读进程：读取时每次从映射文件解码、不放进覆盖层，
+    进程私有内存不随查询增长，数据只在共享的页缓存中保留一份；
+    覆盖层只保存显式写入的值（此时对读出的值原地修改不会保留）。
+    """
+
+    def __init__(self, rows, load_row, default_factory=None, cache=True):
+        self._rows = rows
+        self._load_row = load_row
+        self._cache = cache
+        self._overlay = {}
+        self._removed = set()
+        self._size = len(rows)
+        self.default_factory = default_factory
+
+    def _in_base(self, key):
+        return key in self._rows and key not in self._removed
+
+    def __contains__(self, key):
+        return key in self._overlay or self._in_base(key)
+
+    def __getitem__(self, key):
+        value = self._overlay.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self._in_base(key):
+            value = self._load_row(self._rows[key])
+            if self._cache:
+                self._overlay[key] = value
+            return value
+        if self.default_factory is None:
+            raise KeyError(key)
+        value = self[key] = self.default_factory()
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._size += 1
+        self._overlay[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._overlay.pop(key, None)
+        if key in self._rows:
+            self._removed.add(key)
+        self._size -= 1
+
+    def __iter__(self):
+        yield from list(self._overlay)
+        for key in self._rows:
+            if key not in self._overlay and key not in self._removed:
+                yield key
+
+    def __len__(self):
+        return self._size
+
+    def peek(self, key, default=None):
+        """读取一个值但不放进覆盖层（用于保存快照）"""
+        value = self._overlay.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self._in_base(key):
+            return self._load_row(self._rows[key])
+        return default
+
+    def peek_items(self):
+        """遍历全部键值，底表中的行只解码、不放进覆盖层（用于保存快照）"""
+        for key in self:
+            value = self._overlay.get(key, _MISSING)
+            yield key, value if value is not _MISSING else self._load_row(self._rows[key])
+
+
+_MISSING = object()
+
+
+def peek_items(mapping):
+    """遍历普通字典或 FrozenMapping，不会把底表解码结果常驻内存"""
+    if isinstance(mapping, FrozenMapping):
+        return mapping.peek_items()
+    return mapping.items()
+
+
+def peek(mapping, key, default=None):
+    """读取普通字典或 FrozenMapping 的一个值，不会把底表解码结果常驻内存"""
+    if isinstance(mapping, FrozenMapping):
+        return mapping.peek(key, default)
+    return mapping.get(key, default)
+
+
+def resident_values(mapping):
+    """已经在内存中的值：FrozenMapping 只返回覆盖层，普通字典返回全部"""
+    if isinstance(mapping, FrozenMapping):
+        return mapping._overlay.values()
+    return mapping.values()
+
+
+class GenerationCounter:
+    """
+    跨进程共享的代数计数器
+
+    一个 8 字节的文件，各进程以共享方式内存映射同一页：读取只是一次内存访问，
+    不需要系统调用，适合在每次请求前检查；写入方更新后其它进程立即可见。
+    """
+
+    _FORMAT = struct.Struct("<q")
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "ab") as f:
+            if f.tell() < self._FORMAT.size:
+                f.write(b"\0" * (self._FORMAT.size - f.tell()))
+        with open(path, "r+b") as f:
+            self._map = mmap.mmap(f.fileno(), self._FORMAT.size)
+
+    @property
+    def value(self):
+        return self._FORMAT.unpack_from(self._map, 0)[0]
+
+    def set(self, value):
+        self._FORMAT.pack_into(self._map, 0, value)
+
+
+class WarmStateDirectory:
+    """
+    按代保存的预热快照
+
+    每次保存写入新的 gen-<n> 子目录，写完后原子替换 CURRENT 指针，再更新 GENERATION
+    计数器；正在被内存映射读取的旧文件不会被覆盖，只保留最近 keep 代。
+    多个进程打开同一个目录时，只读进程用 generation() 判断是否有新的一代可以切换。
+    """
+
+    def __init__(self, root, keep=2):
+        self.root = root
+        self.keep = keep
+        self.pointer = os.path.join(root, "CURRENT")
+        self._counter = None
+
+    @property
+    def counter(self):
+        if self._counter is None:
+            self._counter = GenerationCounter(os.path.join(self.root, "GENERATION"))
+        return self._counter
+
+    def generation(self):
+        """当前发布的代数（没有计数器文件的旧目录从 CURRENT 指针解析）"""
+        value = self.counter.value
+        if value:
+            return value
+        current = self.current()
+        return int(os.path.basename(current)[4:]) if current else 0
+
+    def current(self):
+        if not os.path.exists(self.pointer):
+            return None
+        with open(self.pointer, "r", encoding="utf-8") as f:
+            name = f.read().strip()
+        path = os.path.join(self.root, name)
+        return path if name and os.path.isdir(path) else None
+
+    def mtime(self):
+        return os.path.getmtime(self.pointer) if os.path.exists(self.pointer) else 0
+
+    def new_generation(self):
+        os.makedirs(self.root, exist_ok=True)
+        generations = self._generations()
+        number = generations[-1][0] + 1 if generations else 1
+        path = os.path.join(self.root, f"gen-{number}")
+        os.makedirs(path)
+        return path
+
+    def publish(self, path):
+        tmp_path = self.pointer + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(os.path.basename(path))
+        os.replace(tmp_path, self.pointer)
+        self.counter.set(int(os.path.basename(path)[4:]))
+        for _, name in self._generations()[:-self.keep]:
+            # 已映射的文件在 POSIX 上删除后仍可继续读取
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def _generations(self):
+        generations = []
+        for name in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            if name.startswith("gen-") and name[4:].isdigit():
+                generations.append((int(name[4:]), name))
+        return sorted(generations)
+
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import math
+
+from flomo_mmap import peek_items
+from flomo_query_cache import normalize_query
+
+# 代价单位为估算的微秒数，可以直接和 explain 中的实际耗时对照
+PROBE_COST = 0.2             # 一次集合查找或文本包含判断
+PARSE_COST = 500.0           # 解析一条 HTML 结果（bs4 + html2text）
+REMOTE_PAGE_COST = 800000.0  # 一次远程分页请求（网络往返和翻页间隔）
+REMOTE_MAX_RESULTS = 500   # 远程搜索最多扫描的条数，本地计划返回同样上限的最新结果
+REMOTE_PAGE_SIZE = 50
+
+
+class QueryPlanner:
+    """
+    advanced_search 的代价优化器
+
+    用本地索引里已有的基数统计（标签计数和标签 → 备忘录、时间索引上的区间计数、
+    倒排表长度、带附件的比例）估算每种执行方式的代价，选择最便宜的一种：
+
+    - server：服务端 q 搜索（最多 500 条）后在本地过滤，本地数据不可用时的唯一选择
+    - local_index：本地倒排表原文匹配，再用标签、时间、附件条件过滤
+    - tag_first：从最小的 标签/时间区间 候选集出发，逐条核对其它条件和关键词，
+      适合“罕见标签 + 最近几天”这类选择性很高的过滤
+
+    plan() 返回的字典就是 explain 输出：各计划的估算代价和行数、使用的统计信息和选择理由。
+    """
+
+    def __init__(self, store=None, local_index=None, tag_index=None, timeline=None):
+        self.store = store
+        self.local_index = local_index
+        self.tag_index = tag_index
+        self.timeline = timeline
+        self.with_files = None   # 带附件的 slug；第一次需要时才遍历存储建立
+
+    def add(self, memo):
+        slug = memo.get("slug")
+        if not slug or self.with_files is None:
+            return
+        if memo.get("files") and not memo.get("deleted_at"):
+            self.with_files.add(slug)
+        else:
+            self.with_files.discard(slug)
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调"""
+        for memo in memos:
+            self.add(memo)
+
+    def _files(self):
+        if self.with_files is None:
+            # peek_items 逐条解码 mmap 底表，不把全部备忘录留在覆盖层里
+            self.with_files = {slug for slug, memo in peek_items(self.store.memos)
+                               if memo.get("files") and not memo.get("deleted_at")}
+        return self.with_files
+
+    @property
+    def local_available(self):
+        """本地已完成过同步，且有搜索索引"""
+        return (self.store is not None and self.local_index is not None and len(self.local_index) > 0
+                and bool(self.store.cursor.get("latest_slug")))
+
+    def _text_estimate(self, query):
+        """(倒排表查找次数, 原文匹配行数上界)：每个词取最短的倒排表"""
+        terms = [term for term in normalize_query(query).split(" ") if term]
+        if not terms:
+            return 0, len(self.local_index)
+        lookup, rows = 0, len(self.local_index)
+        for term in terms:
+            tokens = self.local_index.tokenize(term)
+            # 与 LocalSearchIndex._match_text 相同：有双字词时不查单字
+            keys = [token for token in tokens if len(token) != 1 or len(tokens) == 1 or token.isascii()]
+            sizes = [len(self.local_index.postings.get(key, ())) for key in keys]
+            lookup += sum(sizes)
+            rows = min(rows, min(sizes) if sizes else 0)
+        return lookup, rows
+
+    def statistics(self, query, include_tags=None, exclude_tags=None, has_files=None, start=None, end=None):
+        """各条件的基数（None 表示该条件未指定）"""
+        total = len(self.local_index)
+        stats = {"total_memos": total, "text_lookup": 0, "text_rows": total,
+                 "tag_rows": None, "date_rows": None, "files_rows": None, "has_files_ratio": None}
+        stats["text_lookup"], stats["text_rows"] = self._text_estimate(query)
+        if include_tags and self.tag_index is not None:
+            stats["tags"] = {tag: self.tag_index.counts.get(tag, 0) for tag in include_tags}
+            stats["tag_rows"] = min(stats["tags"].values())
+        if (start is not None or end is not None) and self.timeline is not None:
+            stats["date_rows"] = self.timeline.count_between(start, end)
+        if has_files is not None:
+            with_files = len(self._files())
+            stats["has_files_ratio"] = round(with_files / total, 4) if total else 0
+            stats["files_rows"] = with_files if has_files else total - with_files
+        return stats
+
+    def plan(self, query, include_tags=None, exclude_tags=None, has_files=None, start=None, end=None):
+        """
+        选择执行计划
+
+        Returns:
+            {"plan", "reason", "estimated_rows", "candidates": {计划: {"cost", "rows"}}, "statistics"}
+        """
+        if not self.local_available:
+            return {"plan": "server", "reason": "本地数据未同步，只能使用服务端搜索",
+                    "estimated_rows": None, "candidates": {}, "statistics": {}}
+
+        stats = self.statistics(query, include_tags, exclude_tags, has_files, start, end)
+        total = max(stats["total_memos"], 1)
+        filters = [rows for rows in (stats["tag_rows"], stats["date_rows"], stats["files_rows"]) if rows is not None]
+        # 各条件相互独立的假设下估算结果行数
+        selectivity = math.prod(rows / total for rows in filters)
+        estimated = min(REMOTE_MAX_RESULTS, math.ceil(stats["text_rows"] * selectivity))
+        terms = max(1, len([term for term in normalize_query(query).split(" ") if term]))
+
+        candidates = {}
+        remote_rows = min(REMOTE_MAX_RESULTS, stats["text_rows"])
+        candidates["server"] = {
+            "cost": math.ceil(max(remote_rows, 1) / REMOTE_PAGE_SIZE) * REMOTE_PAGE_COST + remote_rows * PARSE_COST,
+            "rows": remote_rows}
+        candidates["local_index"] = {
+            "cost": (stats["text_lookup"] + stats["text_rows"] * (1 + len(filters))) * PROBE_COST
+                    + estimated * PARSE_COST,
+            "rows": stats["text_rows"]}
+        drivers = [rows for rows in (stats["tag_rows"], stats["date_rows"]) if rows is not None]
+        if drivers:
+            driver = min(drivers)
+            candidates["tag_first"] = {
+                "cost": driver * (terms + len(filters)) * PROBE_COST + estimated * PARSE_COST,
+                "rows": driver}
+
+        chosen = min(candidates, key=lambda name: candidates[name]["cost"])
+        reasons = {
+            "server": "服务端搜索代价最低",
+            "local_index": f"关键词最多匹配 {stats['text_rows']} 条，先查倒排表再过滤",
+            "tag_first": f"标签/时间条件只有 {min(drivers) if drivers else 0} 条候选，逐条核对关键词",
+        }
+        return {"plan": chosen, "reason": reasons[chosen], "estimated_rows": estimated,
+                "candidates": candidates, "statistics": stats}
+
+    def execute(self, plan, query, include_tags=None, exclude_tags=None, has_files=None, start=None, end=None):
+        """
+        执行本地计划
+
+        Returns:
+            (slug 列表（按创建时间倒序，最多 REMOTE_MAX_RESULTS 条）, 扫描的候选数)
+        """
+        index = self.local_index
+        if plan == "tag_first":
+            drivers = []
+            if include_tags and self.tag_index is not None:
+                drivers.append(min((self.tag_index.tag_slugs.get(tag, set()) for tag in include_tags), key=len))
+            if (start is not None or end is not None) and self.timeline is not None:
+                drivers.append(self.timeline.between(start, end))
+            candidates = min(drivers, key=len)
+            text_checked = False
+        else:
+            candidates = index.match_text(query)
+            text_checked = True
+
+        scanned = len(candidates)
+        files = self._files() if has_files is not None else None
+        memo_tags = self.tag_index.memo_tags if self.tag_index is not None else {}
+        matched = []
+        for slug in candidates:
+            tags = memo_tags.get(slug, [])
+            if include_tags and not all(tag in tags for tag in include_tags):
+                continue
+            if exclude_tags and any(tag in tags for tag in exclude_tags):
+                continue
+            if start is not None or end is not None:
+                created = index.doc_created.get(slug)
+                if created is None or (start is not None and created < start) or (end is not None and created > end):
+                    continue
+            if files is not None and (slug in files) != has_files:
+                continue
+            if not text_checked and not index.contains_text(slug, query):
+                continue
+            matched.append(slug)
+        return index.most_recent(matched, limit=REMOTE_MAX_RESULTS), scanned
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from flomo_store import html_to_text, to_epoch
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """
+    规范化搜索词
+
+    - NFKC：全角字母、数字、空格统一为半角
+    - casefold：大小写不敏感
+    - 去掉首尾空白并合并连续空白
+    """
+    text = unicodedata.normalize("NFKC", query or "")
+    return _SPACE_RE.sub(" ", text).strip().casefold()
+
+
+class QueryResultCache:
+    """
+    搜索结果缓存
+
+    键为（操作名、规范化后的搜索词、其余参数）。同步引擎发现某条备忘录
+    在条目缓存之后有更新时，只失效可能受影响的条目：
+    结果中包含该备忘录，或该备忘录的内容/标签匹配搜索词。
+
+    工具线程读写缓存，同步监听器在后台线程失效条目，所有访问都持有 _lock。
+    """
+
+    def __init__(self, max_entries=512, ttl=None, tz="8:0"):
+        """
+        Args:
+            max_entries: 最多缓存的查询数（LRU 淘汰）
+            ttl: 可选的过期时间（秒），None 表示只依赖同步失效
+            tz: 账户时区，用于解释备忘录的 updated_at
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.tz = tz
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(operation, query, **params):
+        return (operation, normalize_query(query), tuple(sorted(params.items())))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self.ttl is not None and time.time() - entry["cached_at"] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            # 返回副本：调用方修改结果列表不会影响缓存
+            return list(entry["results"])
+
+    def set(self, key, results):
+        entry = {
+            "results": list(results),
+            "slugs": {memo.get("slug") for memo in results},
+            "cached_at": time.time()
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def report(self):
+        """命中统计和当前条目数的快照"""
+        with self._lock:
+            report = dict(self.stats)
+            report["entries"] = len(self._entries)
+        return report
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调：失效受这批备忘录影响的缓存条目"""
+        if not len(self):
+            return
+
+        changed = []
+        for memo in memos:
+            try:
+                updated_at = to_epoch(memo.get("updated_at"), self.tz)
+            except ValueError:
+                updated_at = None
+            text = normalize_query(html_to_text(memo.get("content", "")) + " " + " ".join(memo.get("tags", [])))
+            changed.append((memo.get("slug"), updated_at, text))
+
+        # HTML 转文本在锁外完成，锁内只做字符串匹配
+        with self._lock:
+            stale = []
+            for key, entry in self._entries.items():
+                # 多个词的查询按词分别匹配（与搜索一样不要求相邻）
+                terms = key[1].split()
+                for slug, updated_at, text in changed:
+                    if updated_at is not None and updated_at < int(entry["cached_at"]):
+                        continue
+                    if slug in entry["slugs"] or all(term in text for term in terms):
+                        stale.append(key)
+                        break
+
+            for key in stale:
+                del self._entries[key]
+            self.stats["invalidations"] += len(stale)
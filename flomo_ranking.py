@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import heapq
+import math
+import time
+from collections import Counter
+
+from flomo_index import LocalSearchIndex
+from flomo_query_cache import normalize_query
+from flomo_store import html_to_text, to_epoch
+
+
+class RelevanceRanker:
+    """
+    相关性排序：BM25 + 时间衰减 + 置顶 + 被引用次数
+
+    只对匹配到的候选打分，并用大小为 k 的最小堆保留前 k 名，
+    不对全部候选排序。
+    """
+
+    def __init__(self, index=None, store=None, k1=1.2, b=0.75,
+                 recency_weight=1.0, half_life_days=180,
+                 pin_boost=1.5, link_weight=0.5, tz="8:0"):
+        """
+        Args:
+            index: LocalSearchIndex，提供文档频率和平均文档长度
+            store: MemoStore，提供 pin、linked_count 等字段
+            k1, b: BM25 参数
+            recency_weight: 时间衰减加分的权重（最新的备忘录加满分）
+            half_life_days: 时间衰减的半衰期（天）
+            pin_boost: 置顶备忘录的加分
+            link_weight: log(1 + linked_count) 的权重
+        """
+        self.index = index
+        self.store = store
+        self.k1 = k1
+        self.b = b
+        self.recency_weight = recency_weight
+        self.half_life = half_life_days * 86400
+        self.pin_boost = pin_boost
+        self.link_weight = link_weight
+        self.tz = tz
+
+    def _idf(self, df, total):
+        return math.log(1 + (total - df + 0.5) / (df + 0.5))
+
+    def _bm25(self, tf_by_term, doc_length, idf, avg_length):
+        score = 0.0
+        norm = self.k1 * (1 - self.b + self.b * doc_length / avg_length) if avg_length else self.k1
+        for term, weight in idf.items():
+            tf = tf_by_term.get(term, 0)
+            if tf:
+                score += weight * tf * (self.k1 + 1) / (tf + norm)
+        return score
+
+    def _boost(self, memo, created, now):
+        boost = 0.0
+        if created:
+            age = max(now - created, 0)
+            boost += self.recency_weight * 0.5 ** (age / self.half_life)
+        if memo:
+            if memo.get("pin"):
+                boost += self.pin_boost
+            boost += self.link_weight * math.log1p(memo.get("linked_count") or 0)
+        return boost
+
+    @staticmethod
+    def _push(heap, k, item):
+        """维护大小为 k 的最小堆"""
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def top_k(self, slugs, terms, k=10, now=None):
+        """
+        对本地索引中的候选打分，返回 [(score, slug)]，分数从高到低
+
+        Args:
+            slugs: 候选 slug（LocalSearchIndex.match 的结果）
+            terms: 参与打分的词
+            k: 返回数量
+        """
+        index = self.index
+        now = now or time.time()
+        total = len(index) or 1
+        avg_length = index.total_length / total
+        idf = {term: self._idf(len(index.postings.get(term, ())), total) for term in set(terms)}
+        postings = {term: index.postings.get(term, {}) for term in idf}
+
+        heap = []
+        for slug in slugs:
+            tf_by_term = {term: docs.get(slug, 0) for term, docs in postings.items()}
+            memo = self.store.get(slug) if self.store is not None else None
+            score = self._bm25(tf_by_term, index.doc_lengths.get(slug, 0), idf, avg_length)
+            score += self._boost(memo, index.doc_created.get(slug), now)
+            self._push(heap, k, (score, slug))
+
+        return sorted(heap, reverse=True)
+
+    def rank_memos(self, query, memos, k=10, now=None):
+        """
+        对任意备忘录列表（原始或 parse_search_result 解析后的）按相关性取前 k 条
+
+        有本地索引时使用索引的全局文档频率；否则以这批备忘录本身作为语料统计。
+        """
+        now = now or time.time()
+        terms = LocalSearchIndex.tokenize(normalize_query(query))
+        # 多字查询只用双字词和英文单词打分，单字区分度太低
+        terms = [t for t in terms if len(t) != 1 or t.isascii() or len(terms) == 1]
+
+        documents = []
+        for memo in memos:
+            text = memo.get("plain_text") or html_to_text(memo.get("content", ""))
+            tokens = LocalSearchIndex.tokenize(normalize_query(text))
+            documents.append((memo, Counter(tokens), len(tokens)))
+
+        if self.index is not None and len(self.index):
+            total = len(self.index)
+            avg_length = self.index.total_length / total
+            df = {term: len(self.index.postings.get(term, ())) for term in set(terms)}
+        else:
+            total = len(documents) or 1
+            avg_length = sum(length for _, _, length in documents) / total
+            df = {term: sum(1 for _, counts, _ in documents if counts.get(term)) for term in set(terms)}
+        idf = {term: self._idf(count, total) for term, count in df.items()}
+
+        heap = []
+        for position, (memo, counts, length) in enumerate(documents):
+            try:
+                created = to_epoch(memo.get("created_at"), self.tz)
+            except ValueError:
+                created = None
+            score = self._bm25(counts, length, idf, avg_length) + self._boost(memo, created, now)
+            # position 作为平分时的次序，避免比较 dict
+            self._push(heap, k, (score, -position, memo))
+
+        return [memo for _, _, memo in sorted(heap, key=lambda item: item[:2], reverse=True)]
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import random
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+# 优先级通道：数值越小越优先
+INTERACTIVE = 0   # 工具调用等前台请求
+SYNC = 1          # 增量同步
+BULK = 2          # 推荐抓取等批量任务
+
+LANE_NAMES = {INTERACTIVE: "interactive", SYNC: "sync", BULK: "bulk"}
+
+_local = threading.local()
+
+
+@contextmanager
+def lane(priority):
+    """在 with 块内，本线程发出的请求使用指定优先级"""
+    previous = getattr(_local, "priority", INTERACTIVE)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority():
+    """本线程当前的优先级，默认为 INTERACTIVE"""
+    return getattr(_local, "priority", INTERACTIVE)
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，最多积攒 capacity 个"""
+
+    def __init__(self, rate=5.0, capacity=10):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        """取一个令牌；不够时返回还需等待的秒数"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    """
+    按优先级分配共享的请求配额
+
+    每个 HTTP 请求发出前调用 acquire()；所有等待者按 (优先级, 到达顺序) 排队，
+    令牌总是先给最高优先级的等待者，因此前台请求会插到批量任务前面。
+    当前线程的优先级由 lane() 上下文设置，默认为 INTERACTIVE。
+
+    设置 upstream（FairShareScheduler）时，取得本账号的令牌后还要再向
+    进程级的共享配额排队，name 是本账号在共享配额中的名字。
+    """
+
+    def __init__(self, rate=5.0, capacity=10, upstream=None, name=None):
+        self.bucket = TokenBucket(rate, capacity)
+        self.upstream = upstream
+        self.name = name
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.stats = {name: {"requests": 0, "wait": 0.0} for name in LANE_NAMES.values()}
+
+    lane = staticmethod(lane)
+    current_priority = staticmethod(current_priority)
+
+    def acquire(self, priority=None):
+        """阻塞直到轮到本请求并取得令牌"""
+        priority = current_priority() if priority is None else priority
+        start = time.monotonic()
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    if self._waiters[0] == entry:
+                        delay = self.bucket.try_take()
+                        if not delay:
+                            break
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+        if self.upstream is not None:
+            self.upstream.acquire(self.name, priority)
+        with self._condition:
+            stats = self.stats[LANE_NAMES.get(priority, "bulk")]
+            stats["requests"] += 1
+            stats["wait"] += time.monotonic() - start
+
+    def report(self):
+        return {name: {"requests": stats["requests"], "wait": round(stats["wait"], 3)}
+                for name, stats in self.stats.items()}
+
+
+class FairShareScheduler:
+    """
+    多个账号共享的进程级请求配额（加权公平排队）
+
+    每个请求按所属账号的权重计算虚拟完成时间：
+    finish = max(当前虚拟时间, 该账号上一个请求的 finish) + 1 / weight，
+    令牌按 (优先级, finish) 顺序发放。一个账号排了再多请求，它的 finish
+    也会不断后移，其他账号新到的请求会插到前面，整体吞吐按权重分配。
+    """
+
+    def __init__(self, rate=50.0, capacity=100):
+        self.bucket = TokenBucket(rate, capacity)
+        self.weights = {}
+        self._finish = {}
+        self._virtual_time = 0.0
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.stats = {}
+
+    def set_weight(self, tenant, weight):
+        with self._condition:
+            self.weights[tenant] = float(weight)
+
+    def remove(self, tenant):
+        with self._condition:
+            self.weights.pop(tenant, None)
+            self._finish.pop(tenant, None)
+            self.stats.pop(tenant, None)
+
+    def acquire(self, tenant, priority=INTERACTIVE):
+        start = time.monotonic()
+        with self._condition:
+            finish = max(self._virtual_time, self._finish.get(tenant, 0.0)) + \
+                1.0 / self.weights.get(tenant, 1.0)
+            self._finish[tenant] = finish
+            entry = (priority, finish, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    if self._waiters[0] == entry:
+                        delay = self.bucket.try_take()
+                        if not delay:
+                            break
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+            self._virtual_time = max(self._virtual_time, finish - 1.0 / self.weights.get(tenant, 1.0))
+            stats = self.stats.setdefault(tenant, {"requests": 0, "wait": 0.0})
+            stats["requests"] += 1
+            stats["wait"] += time.monotonic() - start
+
+    def report(self):
+        with self._condition:
+            return {tenant: {"requests": stats["requests"], "wait": round(stats["wait"], 3),
+                             "weight": self.weights.get(tenant, 1.0)}
+                    for tenant, stats in self.stats.items()}
+
+
+class BackgroundScheduler:
+    """
+    后台周期任务
+
+    每个任务按 interval 秒重复执行，实际间隔加入 ±jitter 比例的随机抖动，
+    避免多个任务（或多个实例）同时打到服务器。任务由 workers 个后台线程执行，
+    同一任务不会并发运行，发出的请求使用任务所在的优先级通道。
+    多个账号可以共用一个调度器（任务名加账号前缀）。
+
+    队列中每个任务名最多一项；正在运行的任务不在队列中，run_now 只做标记，
+    这一次执行完后立即再执行一次，而不是另外排一项。
+    """
+
+    def __init__(self, workers=1, seed=None):
+        self.workers = workers
+        self.jobs = {}
+        self._queue = []
+        self._running = set()     # 正在执行的任务名
+        self._rerun = set()       # 执行完后需要立即再执行一次的任务名
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self._random = random.Random(seed)
+
+    def add_job(self, name, func, interval, lane=SYNC, jitter=0.1, run_immediately=True):
+        """
+        注册周期任务
+
+        Args:
+            name: 任务名
+            func: 无参数的可调用对象
+            interval: 平均间隔（秒）
+            lane: 请求优先级通道
+            jitter: 抖动比例（0.1 表示 ±10%）
+            run_immediately: 启动后是否立即执行一次
+        """
+        with self._condition:
+            # 同名任务直接替换，旧的排队项一并移除
+            self.jobs[name] = {"func": func, "interval": interval, "lane": lane, "jitter": jitter,
+                               "runs": 0, "errors": 0, "last_run": None, "last_duration": None,
+                               "last_error": None}
+            self._schedule(name, time.monotonic() if run_immediately else self._next_time(name))
+
+    def remove_job(self, name):
+        """取消任务（正在运行的这一次会执行完）"""
+        with self._condition:
+            self.jobs.pop(name, None)
+            self._rerun.discard(name)
+            self._unschedule(name)
+
+    def is_running(self, name):
+        with self._condition:
+            return name in self._running
+
+    def _unschedule(self, name):
+        self._queue = [(when, job) for when, job in self._queue if job != name]
+        heapq.heapify(self._queue)
+
+    def _schedule(self, name, when):
+        """把任务排到 when（调用方持有锁）；已有的排队项被替换"""
+        self._unschedule(name)
+        heapq.heappush(self._queue, (when, name))
+        self._condition.notify()
+
+    def _next_time(self, name):
+        job = self.jobs[name]
+        spread = job["interval"] * job["jitter"]
+        return time.monotonic() + job["interval"] + self._random.uniform(-spread, spread)
+
+    def run_now(self, name):
+        """让任务尽快执行一次"""
+        with self._condition:
+            if name not in self.jobs:
+                return
+            if name in self._running:
+                self._rerun.add(name)
+            else:
+                self._schedule(name, time.monotonic())
+
+    def start(self):
+        if not self._threads:
+            self._stopped = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"flomo-scheduler-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if self._queue:
+                        delay = self._queue[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+                if self._stopped:
+                    return
+                _, name = heapq.heappop(self._queue)
+                job = self.jobs.get(name)
+                if job is None:
+                    continue
+                if name in self._running:
+                    # 同名任务被替换时旧的一次可能还在执行，等它结束后再执行
+                    self._rerun.add(name)
+                    continue
+                self._running.add(name)
+
+            try:
+                self._execute(job)
+            finally:
+                with self._condition:
+                    self._running.discard(name)
+                    if name in self.jobs:
+                        if name in self._rerun:
+                            self._rerun.discard(name)
+                            self._schedule(name, time.monotonic())
+                        elif not any(queued == name for _, queued in self._queue):
+                            self._schedule(name, self._next_time(name))
+
+    def _execute(self, job):
+        start = time.time()
+        try:
+            with lane(job["lane"]):
+                job["func"]()
+        except Exception as e:
+            job["errors"] += 1
+            job["last_error"] = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        job["runs"] += 1
+        job["last_run"] = start
+        job["last_duration"] = round(time.time() - start, 3)
+
+    def status(self, prefix=""):
+        with self._condition:
+            pending = {name: round(max(when - time.monotonic(), 0), 1) for when, name in self._queue}
+            jobs = {name[len(prefix):]: job for name, job in self.jobs.items() if name.startswith(prefix)}
+            pending = {name[len(prefix):]: when for name, when in pending.items() if name.startswith(prefix)}
+        return {name: {"lane": LANE_NAMES.get(job["lane"]), "interval": job["interval"],
+                       "runs": job["runs"], "errors": job["errors"], "last_run": job["last_run"],
+                       "last_duration": job["last_duration"], "last_error": job["last_error"],
+                       "next_run_in": pending.get(name)}
+                for name, job in jobs.items()}
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+SEGMENT_LOG_VERSION = 1
+_HEADER = struct.Struct("<II")   # 压缩后长度, crc32
+_SEGMENT_PREFIX = "seg-"
+_SEGMENT_SUFFIX = ".log"
+
+
+def _segment_name(number):
+    return f"{_SEGMENT_PREFIX}{number:06d}{_SEGMENT_SUFFIX}"
+
+
+def _segment_number(name):
+    return int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+
+
+class MemoSegmentLog:
+    """
+    原始备忘录的只追加分段日志
+
+    每次追加的一批备忘录（同步的一页）按 block_records 条一块压缩后写到当前分段
+    末尾：块头为压缩后长度和 crc32，块内是每行一条的原始 JSON。分段超过 segment_size
+    后换新文件。索引记录 slug -> (分段, 块偏移, 块内序号)，按 slug 随机读取时
+    只解压一个块，不需要加载整个归档；最近读过的块有少量缓存。
+
+    删除写入墓碑记录；被新版本覆盖或删除的记录由 compact() 清理：把存活记录
+    按顺序重写到新分段，原子替换索引后删除旧分段。索引在 flush() 时落盘，
+    打开时从索引记录的位置继续扫描最后的分段，补上崩溃前已写入但未进入索引的块，
+    并截掉末尾不完整的块。
+    """
+
+    def __init__(self, directory="flomo_archive", segment_size=16 << 20, block_records=32, level=6,
+                 cache_blocks=8):
+        """
+        Args:
+            directory: 归档目录
+            segment_size: 单个分段的大小上限（字节）
+            block_records: 每个压缩块最多的记录数（越大压缩率越高，随机读取越慢）
+            level: zlib 压缩级别
+            cache_blocks: 缓存的已解压块数
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.block_records = block_records
+        self.level = level
+        self.cache_blocks = cache_blocks
+        self.index_path = os.path.join(directory, "index.json")
+        self.index = {}          # slug -> [分段号, 块偏移, 块内序号]
+        self.segments = {}       # 分段号 -> 已确认的长度
+        self.records = 0         # 日志中的记录总数（包括已被覆盖的版本和墓碑）
+        self._blocks = OrderedDict()
+        self._writer = None
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, slug):
+        return slug in self.index
+
+    def _path(self, number):
+        return os.path.join(self.directory, _segment_name(number))
+
+    def _open(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") == SEGMENT_LOG_VERSION:
+                self.index = meta["slugs"]
+                self.segments = {int(number): length for number, length in meta["segments"].items()}
+                self.records = meta["records"]
+        on_disk = sorted(_segment_number(name) for name in os.listdir(self.directory)
+                         if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX))
+        last_known = max(self.segments) if self.segments else -1
+        for number in on_disk:
+            if number >= last_known:
+                self._recover(number, self.segments.get(number, 0))
+
+    def _recover(self, number, start):
+        """从 start 开始重放分段中索引之外的块；末尾损坏的块截掉"""
+        path = self._path(number)
+        offset = start
+        with open(path, "rb") as f:
+            f.seek(start)
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                self._apply_block(number, offset, self._decode(payload))
+                offset += _HEADER.size + length
+        if offset != os.path.getsize(path):
+            with open(path, "rb+") as f:
+                f.truncate(offset)
+        self.segments[number] = offset
+
+    @staticmethod
+    def _decode(payload):
+        return [json.loads(line) for line in zlib.decompress(payload).decode("utf-8").split("\n")]
+
+    def _apply_block(self, number, offset, memos):
+        for position, memo in enumerate(memos):
+            slug = memo["slug"]
+            if memo.get("deleted_at"):
+                self.index.pop(slug, None)
+            else:
+                self.index[slug] = [number, offset, position]
+        self.records += len(memos)
+
+    def _writable(self):
+        """当前可追加的分段 (分段号, 文件)；超过大小上限时换新分段"""
+        number = max(self.segments) if self.segments else 0
+        if self.segments.get(number, 0) >= self.segment_size:
+            number += 1
+        if self._writer is not None and self._writer[0] != number:
+            self._writer[1].close()
+            self._writer = None
+        if self._writer is None:
+            self._writer = (number, open(self._path(number), "ab"))
+            self.segments.setdefault(number, 0)
+        return self._writer
+
+    def _write_block(self, memos):
+        payload = zlib.compress("\n".join(json.dumps(memo, ensure_ascii=False) for memo in memos)
+                                .encode("utf-8"), self.level)
+        number, f = self._writable()
+        offset = self.segments[number]
+        f.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+        f.write(payload)
+        self.segments[number] = offset + _HEADER.size + len(payload)
+        self._apply_block(number, offset, memos)
+
+    def append(self, memos):
+        """追加一批原始备忘录（带 deleted_at 的写入墓碑）"""
+        memos = [memo for memo in memos if memo.get("slug")]
+        with self._lock:
+            for start in range(0, len(memos), self.block_records):
+                self._write_block(memos[start:start + self.block_records])
+            if self._writer is not None:
+                self._writer[1].flush()
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调"""
+        self.append(memos)
+
+    def _read_block(self, number, offset):
+        key = (number, offset)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            return block
+        with open(self._path(number), "rb") as f:
+            f.seek(offset)
+            length, _ = _HEADER.unpack(f.read(_HEADER.size))
+            block = self._decode(f.read(length))
+        self._blocks[key] = block
+        if len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def get(self, slug):
+        """按 slug 读取最新版本的原始备忘录；不存在时返回 None"""
+        with self._lock:
+            location = self.index.get(slug)
+            if location is None:
+                return None
+            number, offset, position = location
+            return self._read_block(number, offset)[position]
+
+    def iter_memos(self):
+        """按写入顺序遍历全部存活的备忘录，每个块只解压一次"""
+        with self._lock:
+            locations = sorted((tuple(location), slug) for slug, location in self.index.items())
+        current, block = None, None
+        for (number, offset, position), _ in locations:
+            if current != (number, offset):
+                with self._lock:
+                    block = self._read_block(number, offset)
+                current = (number, offset)
+            yield block[position]
+
+    def replay(self, *listeners, batch=200):
+        """
+        把全部存活的备忘录按批交给监听者（签名与同步监听者相同）
+
+        用于从归档重建存储和各类索引。
+        """
+        page = []
+        for memo in self.iter_memos():
+            page.append(memo)
+            if len(page) >= batch:
+                for callback in listeners:
+                    callback(page)
+                page = []
+        if page:
+            for callback in listeners:
+                callback(page)
+
+    def flush(self):
+        """fsync 当前分段并原子写入索引"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer[1].flush()
+                os.fsync(self._writer[1].fileno())
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": SEGMENT_LOG_VERSION, "records": self.records,
+                           "segments": self.segments, "slugs": self.index}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+
+    def garbage_ratio(self):
+        """被覆盖的旧版本和墓碑占全部记录的比例"""
+        return 1 - len(self.index) / self.records if self.records else 0.0
+
+    def compact(self):
+        """
+        把存活记录重写到新分段，删除旧分段
+
+        Returns:
+            回收的字节数
+        """
+        with self._lock:
+            if self._writer is not None:
+                self._writer[1].close()
+                self._writer = None
+            old_segments = dict(self.segments)
+            before = sum(old_segments.values())
+            memos = list(self.iter_memos())
+
+            # 新分段从现有最大编号之后开始，旧分段在索引替换前保持不变
+            self.segments = {max(old_segments, default=-1) + 1: 0}
+            self.index = {}
+            self.records = 0
+            self._blocks.clear()
+            for start in range(0, len(memos), self.block_records):
+                self._write_block(memos[start:start + self.block_records])
+            self.flush()
+            for number in old_segments:
+                if number not in self.segments:
+                    os.remove(self._path(number))
+            return before - sum(self.segments.values())
+
+    def maybe_compact(self, min_garbage_ratio=0.5):
+        """垃圾比例超过阈值时压缩，返回回收的字节数"""
+        if self.garbage_ratio() < min_garbage_ratio:
+            return 0
+        reclaimed = self.compact()
+        print(f"🗜️ 归档已压缩，回收 {reclaimed / 1024:.0f} KB，存活 {len(self)} 条")
+        return reclaimed
+
+    def stats(self):
+        return {"memos": len(self.index), "records": self.records, "segments": len(self.segments),
+                "bytes": sum(self.segments.values()), "garbage_ratio": round(self.garbage_ratio(), 3)}
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._writer is not None:
+                self._writer[1].close()
+                self._writer = None
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import html
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_BLOCK_RE = re.compile(r"</(p|li|div|h[1-6])>|<br\s*/?>", re.IGNORECASE)
+
+
+def html_to_text(content):
+    """不依赖 bs4 的轻量 HTML 转纯文本（用于索引和匹配，不用于展示）"""
+    if not content:
+        return ""
+    text = _BLOCK_RE.sub("\n", content)
+    text = html.unescape(_TAG_RE.sub("", text))
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def parse_tz(tz="8:0"):
+    """把 Flomo 的 tz 参数（如 "8:0"、"-5:30"）转换为 timezone"""
+    sign = -1 if tz.startswith("-") else 1
+    hours, _, minutes = tz.lstrip("+-").partition(":")
+    return timezone(sign * timedelta(hours=int(hours or 0), minutes=int(minutes or 0)))
+
+
+def to_epoch(value, tz="8:0"):
+    """
+    把 Flomo 返回的时间字符串转换为 epoch 秒
+
+    Args:
+        value: "2024-12-21 22:47:24" 这样的本地时间，或带 Z/偏移量的 ISO 时间
+        tz: 账户时区，用于解释不带偏移量的时间
+    """
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=parse_tz(tz))
+    return int(moment.timestamp())
+
+
+def epoch_bound(value, tz="8:0"):
+    """
+    把查询边界转换为 epoch 秒
+
+    value 可以是 epoch 数字、datetime（不带时区时按账户时区解释）或 Flomo 格式的时间字符串。
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=parse_tz(tz))
+        return int(value.timestamp())
+    return to_epoch(value, tz)
+
+
+class MemoStore:
+    """
+    本地备忘录存储
+
+    以 slug 为键保存 /memo/updated/ 返回的原始备忘录，以标签名为键保存 /tag/updated/
+    返回的标签，并分别记录增量同步的分页游标。指定 path 时以 JSON 快照持久化。
+    """
+
+    def __init__(self, path=None, tz="8:0"):
+        self.path = path
+        self.tz = tz
+        self.memos = {}
+        self.cursor = {"latest_slug": None, "latest_updated_at": None}
+        self.tags = {}
+        self.tag_cursor = {"latest_updated_at": None, "latest_id": None}
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.memos)
+
+    def __contains__(self, slug):
+        return slug in self.memos
+
+    def get(self, slug):
+        return self.memos.get(slug)
+
+    def values(self):
+        return self.memos.values()
+
+    def upsert(self, memo):
+        """
+        写入一条备忘录；带 deleted_at 的备忘录会被移除
+
+        Returns:
+            True 表示本地数据发生了变化
+        """
+        slug = memo.get("slug")
+        if not slug:
+            return False
+        if memo.get("deleted_at"):
+            return self.memos.pop(slug, None) is not None
+        if self.memos.get(slug) == memo:
+            return False
+        self.memos[slug] = memo
+        return True
+
+    def upsert_tag(self, tag):
+        """写入一个标签；带 deleted_at 的标签会被移除"""
+        name = tag.get("name")
+        if not name:
+            return False
+        if tag.get("deleted_at"):
+            return self.tags.pop(name, None) is not None
+        if self.tags.get(name) == tag:
+            return False
+        self.tags[name] = tag
+        return True
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        self.memos = {memo["slug"]: memo for memo in snapshot.get("memos", [])}
+        self.cursor = snapshot.get("cursor", self.cursor)
+        self.tags = {tag["name"]: tag for tag in snapshot.get("tags", [])}
+        self.tag_cursor = snapshot.get("tag_cursor", self.tag_cursor)
+        self.tz = snapshot.get("tz", self.tz)
+
+    def save(self):
+        """原子写入快照（先写临时文件再替换）"""
+        if not self.path:
+            return
+        from flomo_mmap import peek_items
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "tz": self.tz,
+                "cursor": self.cursor,
+                "memos": [memo for _, memo in peek_items(self.memos)],
+                "tag_cursor": self.tag_cursor,
+                "tags": list(self.tags.values())
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def save_mmap(self, directory):
+        """把备忘录写成每行一条 JSON 的字符串表，供 load_mmap 内存映射打开"""
+        from flomo_mmap import StringBlob, peek_items
+
+        os.makedirs(directory, exist_ok=True)
+        slugs = []
+
+        def lines():
+            for slug, memo in peek_items(self.memos):
+                slugs.append(slug)
+                yield json.dumps(memo, ensure_ascii=False)
+
+        StringBlob.write(directory, "memos", lines())
+        with open(os.path.join(directory, "store.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "tz": self.tz,
+                "cursor": self.cursor,
+                "slugs": slugs,
+                "tag_cursor": self.tag_cursor,
+                "tags": list(self.tags.values())
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load_mmap(cls, directory, path=None, read_only=False):
+        """
+        内存映射打开 save_mmap 的快照；备忘录在第一次读取时才解码
+
+        path 为之后 save() 写入的 JSON 快照位置（不会在这里读取）。
+        read_only 时每次读取都从映射文件解码，不常驻进程内存。
+        """
+        from flomo_mmap import FrozenMapping, StringBlob
+
+        with open(os.path.join(directory, "store.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        store = cls(tz=meta["tz"])
+        store.path = path
+        blob = StringBlob(directory, "memos")
+        rows = {slug: row for row, slug in enumerate(meta["slugs"])}
+        store.memos = FrozenMapping(rows, lambda row: json.loads(blob[row]), cache=not read_only)
+        store.cursor = meta["cursor"]
+        store.tags = {tag["name"]: tag for tag in meta["tags"]}
+        store.tag_cursor = meta["tag_cursor"]
+        return store
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import asyncio
+import codecs
+import json
+
+_WHITESPACE = " \t\n\r"
+
+
+class StreamingPageDecoder:
+    """
+    增量解析 Flomo 分页响应
+
+    响应体形如 {"code": 0, "message": "...", "data": [memo, memo, ...]}。
+    按块喂入字节，`data` 数组中的每条备忘录一旦完整即被返回，
+    不需要先把整个响应体读入内存。
+    """
+
+    def __init__(self, array_key="data"):
+        self.array_key = array_key
+        self.envelope = {}  # 除 data 数组以外的顶层字段（code、message 等）
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._key = None
+        self._finished = False
+        self.item_count = 0
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def feed(self, chunk):
+        """
+        喂入一块原始字节，返回本块解析出的完整备忘录列表
+
+        Args:
+            chunk: bytes 或 str
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._text_decoder.decode(chunk)
+        if chunk:
+            # 丢弃已消费的前缀，避免缓冲区随页面增长
+            if self._pos:
+                self._buffer = self._buffer[self._pos:]
+                self._pos = 0
+            self._buffer += chunk
+        return list(self._parse(final=False))
+
+    def close(self):
+        """输入结束，返回剩余的备忘录；响应体不完整时抛出 ValueError"""
+        tail = self._text_decoder.decode(b"", final=True)
+        if tail:
+            self._buffer = self._buffer[self._pos:] + tail
+            self._pos = 0
+        items = list(self._parse(final=True))
+        if not self._finished:
+            raise ValueError("响应体不完整，JSON 未闭合")
+        return items
+
+    def _skip(self, chars):
+        buf = self._buffer
+        pos = self._pos
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+        self._pos = pos
+        return pos < len(buf)
+
+    def _decode_value(self, final):
+        """
+        尝试从当前位置解码一个完整的 JSON 值
+
+        值后面必须还有字符（逗号、括号或空白）才算完整，
+        否则像 12 这样的数字可能只是 123 的前半截。
+        """
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return False, None
+        if end >= len(self._buffer) and not final:
+            return False, None
+        self._pos = end
+        return True, value
+
+    def _parse(self, final):
+        while not self._finished:
+            if not self._skip(_WHITESPACE):
+                return
+
+            char = self._buffer[self._pos]
+
+            if self._state == "start":
+                if char != "{":
+                    raise ValueError(f"响应不是 JSON 对象: {self._buffer[self._pos:self._pos + 20]!r}")
+                self._pos += 1
+                self._state = "key"
+
+            elif self._state == "key":
+                if char == ",":
+                    self._pos += 1
+                    continue
+                if char == "}":
+                    self._pos += 1
+                    self._finished = True
+                    return
+                ok, key = self._decode_value(final)
+                if not ok:
+                    return
+                self._key = key
+                self._state = "colon"
+
+            elif self._state == "colon":
+                if char != ":":
+                    raise ValueError(f"字段 {self._key!r} 后缺少冒号")
+                self._pos += 1
+                self._state = "value"
+
+            elif self._state == "value":
+                if self._key == self.array_key and char == "[":
+                    # code 先于 data 出现且不为 0 时不再解析数据
+                    if self.envelope.get("code", 0) != 0:
+                        raise ValueError(f"API错误: {self.envelope.get('message')}")
+                    self._pos += 1
+                    self._state = "array"
+                    continue
+                ok, value = self._decode_value(final)
+                if not ok:
+                    return
+                self.envelope[self._key] = value
+                self._state = "key"
+
+            elif self._state == "array":
+                if char == ",":
+                    self._pos += 1
+                    continue
+                if char == "]":
+                    self._pos += 1
+                    self._state = "key"
+                    continue
+                ok, item = self._decode_value(final)
+                if not ok:
+                    return
+                self.item_count += 1
+                yield item
+
+
+def iter_page_memos(chunks, decoder=None):
+    """
+    从响应字节块中逐条产出备忘录
+
+    Args:
+        chunks: 字节块迭代器，例如 response.iter_content(chunk_size=65536)
+        decoder: 可选的 StreamingPageDecoder，用于事后读取 code/message
+
+    code 可能出现在 data 之后，所以一页的备忘录先暂存，读完响应并确认 code 为 0 后才产出；
+    code 不为 0 或响应体不完整时抛出 ValueError，不会产出这一页的任何备忘录，
+    同步引擎不会写入半页数据或移动游标。原始响应体仍然逐块解析，不会整体读入内存。
+    """
+    decoder = decoder or StreamingPageDecoder()
+    memos = []
+    for chunk in chunks:
+        memos.extend(decoder.feed(chunk))
+    memos.extend(decoder.close())
+
+    if decoder.envelope.get("code") != 0:
+        raise ValueError(f"API错误: {decoder.envelope.get('message')}")
+    yield from memos
+
+
+async def aiterate(iterable, executor=None):
+    """
+    把同步迭代器（如逐页请求的生成器）包装为异步迭代器
+
+    每次取下一项都在线程池中执行，事件循环不会被网络请求或解析阻塞。
+    调用方提前退出时关闭底层生成器，不再继续翻页。
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    finished = object()
+    running = False
+    try:
+        while True:
+            running = True
+            item = await loop.run_in_executor(executor, next, iterator, finished)
+            running = False
+            if item is finished:
+                break
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        # 被取消时生成器可能仍在线程中执行，不能关闭，留给它自然结束
+        if close is not None and not running:
+            close()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+from flomo_store import to_epoch
+
+
+class FlomoSyncEngine:
+    """
+    增量同步引擎
+
+    从 MemoStore 中记录的分页游标继续拉取 /memo/updated/，
+    把新增、修改、删除的备忘录写入本地存储，并通知监听者
+    （查询缓存、本地索引等）。
+    """
+
+    def __init__(self, api, store, limit_per_page=200):
+        """
+        Args:
+            api: 提供 iter_memo_pages() 的客户端（FlomoCompleteAPI）
+            store: MemoStore
+            limit_per_page: 每页数量
+        """
+        self.api = api
+        self.store = store
+        self.limit_per_page = limit_per_page
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """
+        注册同步监听者
+
+        callback(memos) 在每页同步后调用，memos 为该页的原始备忘录
+        （已删除的备忘录带有 deleted_at）。
+        """
+        self.listeners.append(callback)
+
+    def sync(self):
+        """
+        执行一次增量同步
+
+        Returns:
+            本次同步中发生变化的备忘录数量
+        """
+        cursor = self.store.cursor
+        start_cursor = dict(cursor)
+        changed = 0
+        pages = self.api.iter_memo_pages(cursor.get("latest_slug"),
+                                         cursor.get("latest_updated_at"),
+                                         limit_per_page=self.limit_per_page)
+
+        for memos in pages:
+            changed += sum(1 for memo in memos if self.store.upsert(memo))
+
+            last_memo = memos[-1]
+            self.store.cursor = {
+                "latest_slug": last_memo["slug"],
+                "latest_updated_at": to_epoch(last_memo["updated_at"], self.store.tz)
+            }
+
+            for callback in self.listeners:
+                callback(memos)
+
+        if changed or self.store.cursor != start_cursor:
+            # 没有变化时不重写 JSON 快照：既省去逐条解码，也不会让预热快照显得过期
+            self.store.save()
+        print(f"🔄 同步完成，{changed} 条备忘录有变化，本地共 {len(self.store)} 条")
+        return changed
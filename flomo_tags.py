@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from collections import Counter
+
+from flomo_store import to_epoch
+
+
+def root_tag(tag):
+    """层级标签的顶级部分（/tag/updated/ 只返回顶级标签）"""
+    return tag.split("/", 1)[0]
+
+
+class MemoTagIndex:
+    """
+    备忘录标签计数索引
+
+    作为同步引擎的监听者增量维护 标签 → 使用次数 和 标签 → 备忘录，
+    不需要每次重新遍历全部备忘录。
+    """
+
+    def __init__(self):
+        self.memo_tags = {}       # slug -> [标签]
+        self.counts = Counter()   # 完整标签 -> 次数
+        self.root_counts = Counter()
+        self.tag_slugs = {}       # 完整标签 -> {slug}
+
+    def _apply(self, slug, tags, delta):
+        for tag in tags:
+            if delta > 0:
+                self.tag_slugs.setdefault(tag, set()).add(slug)
+            else:
+                self.tag_slugs.get(tag, set()).discard(slug)
+                if not self.tag_slugs.get(tag, True):
+                    del self.tag_slugs[tag]
+            self.counts[tag] += delta
+            self.root_counts[root_tag(tag)] += delta
+            if self.counts[tag] <= 0:
+                del self.counts[tag]
+            if self.root_counts[root_tag(tag)] <= 0:
+                del self.root_counts[root_tag(tag)]
+
+    def add(self, memo):
+        slug = memo.get("slug")
+        if not slug:
+            return
+        old_tags = self.memo_tags.pop(slug, None)
+        if old_tags:
+            self._apply(slug, old_tags, -1)
+        if memo.get("deleted_at"):
+            return
+        tags = list(dict.fromkeys(memo.get("tags", [])))
+        self.memo_tags[slug] = tags
+        self._apply(slug, tags, 1)
+
+    def build(self, memos):
+        for memo in memos:
+            self.add(memo)
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调"""
+        for memo in memos:
+            self.add(memo)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.memo_tags, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """从 save() 的结果恢复（只读标签列表，不需要解析备忘录正文）"""
+        index = cls()
+        with open(path, "r", encoding="utf-8") as f:
+            index.memo_tags = json.load(f)
+        for slug, tags in index.memo_tags.items():
+            index._apply(slug, tags, 1)
+        return index
+
+    def save_mmap(self, directory):
+        """保存为可以内存映射打开的快照：每条备忘录的标签为字符串表，标签 → 备忘录为 CSR"""
+        from flomo_mmap import StringBlob, peek_items, save_csr
+
+        os.makedirs(directory, exist_ok=True)
+        slugs = []
+
+        def lines():
+            for slug, tags in peek_items(self.memo_tags):
+                slugs.append(slug)
+                yield "\t".join(tags)
+
+        StringBlob.write(directory, "memo_tags", lines())
+        rows = {slug: row for row, slug in enumerate(slugs)}
+        save_csr(directory, "tag_slugs", ((tag, [rows[slug] for slug in members], None)
+                                          for tag, members in peek_items(self.tag_slugs)))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"slugs": slugs, "counts": dict(self.counts), "root_counts": dict(self.root_counts)},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load_mmap(cls, directory, read_only=False):
+        """
+        内存映射打开 save_mmap 的快照
+
+        计数直接读取；每条备忘录的标签和标签 → 备忘录在第一次访问时才解码，
+        多个进程打开同一代快照时共享同一份页缓存。read_only 时解码结果不缓存。
+        """
+        from flomo_mmap import FrozenMapping, StringBlob, load_csr
+
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        slugs = meta["slugs"]
+        blob = StringBlob(directory, "memo_tags")
+        keys, ptr, cols, _ = load_csr(directory, "tag_slugs")
+
+        def load_members(row):
+            return {slugs[i] for i in cols[int(ptr[row]):int(ptr[row + 1])].tolist()}
+
+        index = cls()
+        index.memo_tags = FrozenMapping({slug: row for row, slug in enumerate(slugs)},
+                                        lambda row: blob[row].split("\t") if blob[row] else [],
+                                        cache=not read_only)
+        index.tag_slugs = FrozenMapping({key: row for row, key in enumerate(keys)}, load_members, set,
+                                        cache=not read_only)
+        index.counts = Counter(meta["counts"])
+        index.root_counts = Counter(meta["root_counts"])
+        return index
+
+
+class TagSync:
+    """
+    标签目录同步
+
+    从 MemoStore 记录的游标继续增量拉取 /tag/updated/，写入本地存储；
+    与 MemoTagIndex 对比即可得到全量的缺失/孤立标签。
+    """
+
+    def __init__(self, client, store, limit=200):
+        """
+        Args:
+            client: 提供 _generate_params、transport、base_url 的客户端
+                    （FlomoTagEnhancedTest、FlomoCompleteAPI 等）
+            store: MemoStore
+            limit: 每页数量
+        """
+        self.client = client
+        self.store = store
+        self.limit = limit
+
+    def sync(self):
+        """
+        增量同步标签
+
+        文档中 /tag/updated/ 只有 latest_updated_at 一个分页参数。能力缓存确认服务器
+        支持 latest_id 时，游标为上一页最后一个标签的 (updated_at, id)，与备忘录同步的
+        (updated_at, slug) 相同，同一秒内更新的标签超过一页也能继续翻页；否则只用
+        latest_updated_at，这种情况下同一秒内超过 limit 个标签时，其余的会被跳过。
+
+        Returns:
+            发生变化的标签数量
+        """
+        prober = getattr(self.client, "prober", None)
+        tie_breaker = (prober is not None and prober.capabilities is not None
+                       and "latest_id" in prober.supported_cursor_fields())
+        cursor = (self.store.tag_cursor.get("latest_updated_at"),
+                  self.store.tag_cursor.get("latest_id") if tie_breaker else None)
+        start_cursor = dict(self.store.tag_cursor)
+        changed = 0
+        page = 1
+
+        while True:
+            request_params = {"limit": str(self.limit), "tz": self.store.tz}
+            if cursor[0]:
+                request_params["latest_updated_at"] = str(cursor[0])
+                if tie_breaker and cursor[1] is not None:
+                    request_params["latest_id"] = str(cursor[1])
+            params = self.client._generate_params(request_params)
+
+            try:
+                response = self.client.transport.get(f"{self.client.base_url}/tag/updated/", params=params)
+                if response.status_code != 200:
+                    print(f"❌ HTTP错误: {response.status_code}")
+                    break
+                data = response.json()
+                if data.get("code") != 0:
+                    print(f"❌ API错误: {data.get('message')}")
+                    break
+            except Exception as e:
+                print(f"💥 标签同步失败: {e}")
+                break
+
+            tags = data.get("data", [])
+            changed += sum(1 for tag in tags if self.store.upsert_tag(tag))
+            print(f"🏷️ 标签第 {page} 页: {len(tags)} 个")
+            if not tags:
+                break
+
+            next_cursor = (to_epoch(tags[-1].get("updated_at"), self.store.tz),
+                           tags[-1].get("id") if tie_breaker else None)
+            if next_cursor == cursor:
+                # 游标没有前进（整页 updated_at 相同，或服务器忽略了 latest_id），停止以免死循环
+                print("⚠️ 标签分页游标没有前进，本次同步提前结束")
+                break
+            cursor = next_cursor
+            self.store.tag_cursor = {"latest_updated_at": cursor[0], "latest_id": cursor[1]}
+
+            if len(tags) < self.limit:
+                break
+            page += 1
+
+        if changed or self.store.tag_cursor != start_cursor:
+            self.store.save()
+        print(f"✅ 标签同步完成，{changed} 个有变化，本地共 {len(self.store.tags)} 个标签")
+        return changed
+
+    def reconcile(self, tag_index):
+        """
+        对比标签目录和全部备忘录的标签
+
+        Args:
+            tag_index: MemoTagIndex
+
+        Returns:
+            {"memo_tags": 备忘录在用的全部标签,
+             "missing_tags": 备忘录在用但目录中没有的顶级标签,
+             "orphaned_tags": 目录中有但没有任何备忘录使用的标签, ...}
+        """
+        catalogue = set(self.store.tags)
+        used_roots = set(tag_index.root_counts)
+        missing = used_roots - catalogue
+        orphaned = catalogue - used_roots
+        return {
+            "memo_tags": sorted(tag_index.counts),
+            "missing_tags": sorted(missing),
+            "orphaned_tags": sorted(orphaned),
+            "tag_counts": dict(tag_index.counts.most_common()),
+            "comparison": {
+                "known_count": len(catalogue),
+                "memo_count": len(tag_index.counts),
+                "memo_root_count": len(used_roots),
+                "missing_count": len(missing),
+                "orphaned_count": len(orphaned)
+            }
+        }
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flomo_mcp_server import FlomoContext
+from flomo_scheduler import BackgroundScheduler, FairShareScheduler, RequestScheduler
+
+
+class FlomoTenantManager:
+    """
+    单进程多账号管理
+
+    每个 token 对应一个独立的 FlomoContext：各自的连接池、条件请求缓存、
+    本地存储、索引和预热快照（目录按 token 的哈希区分），以及每账号的速率配额。
+    所有账号的请求再经过一个进程级的加权公平配额（FairShareScheduler），
+    后台同步共用一组工作线程。
+
+    常驻内存超过 memory_limit 时，按最近最少使用的顺序关闭空闲账号；
+    被关闭的账号下次访问时从预热快照内存映射打开，并重新开始后台同步。
+    """
+
+    def __init__(self, root="flomo_tenants", memory_limit=512 * 1024 * 1024, rate=50.0, burst=100,
+                 tenant_rate=5.0, tenant_burst=10, background_sync=None, workers=4, check_interval=5.0):
+        """
+        Args:
+            root: 各账号数据目录的根目录
+            memory_limit: 所有账号常驻内存估算值的上限（字节）
+            rate, burst: 进程级共享配额（每秒请求数、突发上限）
+            tenant_rate, tenant_burst: 每个账号的配额
+            background_sync: FlomoContext.start_background_sync 的参数；None 表示不做后台同步
+            workers: 后台同步线程数
+            check_interval: 两次内存检查的最短间隔（秒），估算需要遍历常驻数据
+        """
+        self.root = root
+        self.memory_limit = memory_limit
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.background_sync = background_sync
+        self.fair = FairShareScheduler(rate=rate, capacity=burst)
+        self.background = BackgroundScheduler(workers=workers)
+        self.weights = {}
+        self.evictions = 0
+        self.check_interval = check_interval
+        self._checked_at = 0.0
+        self._tenants = OrderedDict()   # tenant_id -> {"context", "users", "ready"}，按最近使用排序
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tenant_id(token):
+        """token 的哈希，用作目录名和调度中的账号名（不把 token 写到磁盘路径里）"""
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+    def set_weight(self, token, weight):
+        """设置账号在共享配额中的权重（默认 1）"""
+        tenant_id = self.tenant_id(token)
+        self.weights[tenant_id] = weight
+        self.fair.set_weight(tenant_id, weight)
+
+    @contextmanager
+    def session(self, token):
+        """
+        取得账号的上下文
+
+        with 块内该账号不会被淘汰；第一次访问时打开本地数据并开始后台同步。
+        """
+        tenant = self._checkout(token)
+        try:
+            yield tenant["context"]
+        finally:
+            with self._lock:
+                tenant["users"] -= 1
+                due = time.monotonic() - self._checked_at >= self.check_interval
+                if due:
+                    self._checked_at = time.monotonic()
+            if due:
+                self.enforce_memory_limit()
+
+    def _checkout(self, token):
+        tenant_id = self.tenant_id(token)
+        with self._lock:
+            tenant = self._tenants.get(tenant_id)
+            if tenant is None:
+                tenant = self._tenants[tenant_id] = {"context": None, "users": 0, "ready": threading.Lock()}
+            tenant["users"] += 1
+            self._tenants.move_to_end(tenant_id)
+
+        try:
+            with tenant["ready"]:
+                if tenant["context"] is None:
+                    tenant["context"] = self._open(token, tenant_id)
+        except Exception:
+            with self._lock:
+                tenant["users"] -= 1
+                if tenant["context"] is None and self._tenants.get(tenant_id) is tenant:
+                    del self._tenants[tenant_id]
+            raise
+        return tenant
+
+    def _open(self, token, tenant_id):
+        directory = os.path.join(self.root, tenant_id)
+        os.makedirs(directory, exist_ok=True)
+        self.fair.set_weight(tenant_id, self.weights.get(tenant_id, 1.0))
+        scheduler = RequestScheduler(rate=self.tenant_rate, capacity=self.tenant_burst,
+                                     upstream=self.fair, name=tenant_id)
+        context = FlomoContext(token,
+                               store_path=os.path.join(directory, "store.json"),
+                               warm_dir=os.path.join(directory, "warm"),
+                               archive_dir=os.path.join(directory, "archive"),
+                               request_scheduler=scheduler,
+                               background=self.background,
+                               job_prefix=tenant_id + ":")
+        context.warm_up()
+        if self.background_sync is not None:
+            context.start_background_sync(**self.background_sync)
+        print(f"👤 账号 {tenant_id} 已打开，当前 {len(self._tenants)} 个账号", file=sys.stderr)
+        return context
+
+    def memory_usage(self):
+        """{tenant_id: 常驻内存估算值}"""
+        with self._lock:
+            contexts = {tenant_id: tenant["context"] for tenant_id, tenant in self._tenants.items()
+                        if tenant["context"] is not None}
+        return {tenant_id: context.memory_estimate() for tenant_id, context in contexts.items()}
+
+    def enforce_memory_limit(self):
+        """超过内存上限时，从最久未用的空闲账号开始关闭"""
+        usage = self.memory_usage()
+        total = sum(usage.values())
+        if total <= self.memory_limit:
+            return []
+
+        candidates = []
+        with self._lock:
+            for tenant_id, tenant in self._tenants.items():
+                if total <= self.memory_limit:
+                    break
+                # 有调用在用、或后台同步/推荐任务正在运行的账号不淘汰
+                if tenant["users"] or tenant["context"] is None or tenant["context"].background_busy():
+                    continue
+                total -= usage.get(tenant_id, 0)
+                candidates.append((tenant_id, tenant))
+
+        evicted = []
+        for tenant_id, tenant in candidates:
+            # 关闭期间持有 ready 锁：同一账号的新请求等旧上下文关闭后才重新打开，
+            # 不会有两个上下文同时写同一个归档和预热目录
+            with tenant["ready"]:
+                with self._lock:
+                    context = tenant["context"]
+                    if tenant["users"] or context is None:
+                        continue
+                    tenant["context"] = None
+                context.close()
+            with self._lock:
+                if not tenant["users"] and self._tenants.get(tenant_id) is tenant:
+                    del self._tenants[tenant_id]
+            self.fair.remove(tenant_id)
+            self.evictions += 1
+            evicted.append(tenant_id)
+            print(f"🧹 内存超限，关闭账号 {tenant_id}", file=sys.stderr)
+        return evicted
+
+    def stats(self):
+        usage = self.memory_usage()
+        with self._lock:
+            users = {tenant_id: tenant["users"] for tenant_id, tenant in self._tenants.items()}
+        return {
+            "tenants": len(users),
+            "memory_estimate": sum(usage.values()),
+            "memory_limit": self.memory_limit,
+            "evictions": self.evictions,
+            "accounts": {tenant_id: {"memory_estimate": usage.get(tenant_id, 0), "active_calls": count}
+                         for tenant_id, count in users.items()},
+            "fair_share": self.fair.report(),
+        }
+
+    def close(self):
+        with self._lock:
+            tenants, self._tenants = list(self._tenants.values()), OrderedDict()
+        self.background.stop(timeout=1)
+        for tenant in tenants:
+            if tenant["context"] is not None:
+                tenant["context"].close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import bisect
+import json
+import os
+import time
+
+import numpy as np
+
+from flomo_store import epoch_bound, to_epoch
+
+
+class TimestampIndex:
+    """
+    按时间排序的备忘录索引
+
+    写入时把 created_at（或 updated_at）按账户时区转换一次为 epoch 秒，
+    按 (epoch, slug) 有序保存。“某段时间内”“最近 N 天”“最新 N 条”
+    都是两次二分查找加一次切片，查询时不再解析任何时间字符串。
+    """
+
+    def __init__(self, tz="8:0", field="created_at"):
+        self.tz = tz
+        self.field = field
+        self.epochs = []     # 升序
+        self.slugs = []      # 与 epochs 对齐
+        self.by_slug = {}    # slug -> epoch
+
+    def __len__(self):
+        return len(self.slugs)
+
+    def get(self, slug):
+        return self.by_slug.get(slug)
+
+    def add(self, memo):
+        slug = memo.get("slug")
+        if not slug:
+            return
+        self.remove(slug)
+        if memo.get("deleted_at"):
+            return
+        try:
+            epoch = to_epoch(memo.get(self.field), self.tz)
+        except ValueError:
+            epoch = None
+        if epoch is None:
+            return
+        position = bisect.bisect_right(self.epochs, epoch)
+        # 同一秒内按 slug 排序，保证结果稳定
+        while position > 0 and self.epochs[position - 1] == epoch and self.slugs[position - 1] > slug:
+            position -= 1
+        self.epochs.insert(position, epoch)
+        self.slugs.insert(position, slug)
+        self.by_slug[slug] = epoch
+
+    def remove(self, slug):
+        epoch = self.by_slug.pop(slug, None)
+        if epoch is None:
+            return
+        position = bisect.bisect_left(self.epochs, epoch)
+        while self.slugs[position] != slug:
+            position += 1
+        del self.epochs[position]
+        del self.slugs[position]
+
+    def build(self, memos):
+        for memo in memos:
+            self.add(memo)
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调"""
+        self.build(memos)
+
+    def _positions(self, start=None, end=None):
+        start = epoch_bound(start, self.tz)
+        end = epoch_bound(end, self.tz)
+        low = bisect.bisect_left(self.epochs, start) if start is not None else 0
+        high = bisect.bisect_right(self.epochs, end) if end is not None else len(self.epochs)
+        return low, max(low, high)
+
+    def between(self, start=None, end=None):
+        """[start, end] 内的 slug（含两端，按时间升序）；边界可以是 epoch、datetime 或时间字符串"""
+        low, high = self._positions(start, end)
+        return self.slugs[low:high]
+
+    def count_between(self, start=None, end=None):
+        low, high = self._positions(start, end)
+        return high - low
+
+    def recent(self, limit=20, start=None, end=None):
+        """时间范围内最新的 limit 条（按时间倒序）"""
+        low, high = self._positions(start, end)
+        return self.slugs[max(low, high - limit):high][::-1]
+
+    def last_days(self, days, limit=None, now=None):
+        """最近 days 天内的 slug（按时间倒序）"""
+        since = (now if now is not None else time.time()) - days * 86400
+        if limit is None:
+            return self.between(since)[::-1]
+        return self.recent(limit, start=since)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "epochs.npy"), np.asarray(self.epochs, dtype=np.int64))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"tz": self.tz, "field": self.field, "slugs": self.slugs}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(tz=meta["tz"], field=meta["field"])
+        index.epochs = np.load(os.path.join(directory, "epochs.npy")).tolist()
+        index.slugs = meta["slugs"]
+        index.by_slug = dict(zip(index.slugs, index.epochs))
+        return index
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import threading
+import requests
+from collections import OrderedDict
+
+# 只有安装了 brotli 解码器时才声明支持 br，否则服务端返回 br 会无法解压
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = "gzip, deflate, br"
+    except ImportError:
+        ACCEPT_ENCODING = "gzip, deflate"
+
+# 每次请求都会变化、不影响响应内容的参数
+VOLATILE_PARAMS = ("timestamp", "sign")
+
+
+def cache_key(url, params=None):
+    """生成请求的规范化键（去掉 timestamp 和 sign）"""
+    items = sorted((k, str(v)) for k, v in (params or {}).items() if k not in VOLATILE_PARAMS)
+    return url + "?" + "&".join(f"{k}={v}" for k, v in items)
+
+
+class FlomoTransport:
+    """
+    Flomo HTTP 传输层
+
+    - 复用 requests.Session 连接池
+    - 协商 gzip/brotli 压缩
+    - 服务端返回 ETag/Last-Modified 时发送条件请求，304 时从本地响应缓存返回
+    - 并发的相同请求（去掉 timestamp/sign 后参数相同）合并为一次，共享结果
+    - 传入 RequestScheduler 时，每个实际发出的请求先按优先级领取共享配额
+    - 统计节省的流量
+
+    工具线程和后台同步共用一个传输层：响应缓存和统计由 _lock 保护，
+    进行中的请求表由 _inflight_lock 保护。
+    """
+
+    def __init__(self, token, session=None, max_cache_entries=256, scheduler=None):
+        self.session = session or requests.Session()
+        self.session.headers.update({
+            "Authorization": token,
+            "Accept-Encoding": ACCEPT_ENCODING,
+        })
+        self.max_cache_entries = max_cache_entries
+        self.scheduler = scheduler
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "not_modified": 0,
+            "coalesced": 0,              # 搭上进行中请求、没有单独发出的请求数
+            "bytes_wire": 0,             # 实际传输的字节数
+            "bytes_decoded": 0,          # 解压后的字节数
+            "bytes_saved_compression": 0,
+            "bytes_saved_cache": 0,      # 304 时省下的完整响应体
+        }
+
+    def get(self, url, params=None, stream=False, timeout=None):
+        """
+        发送 GET 请求
+
+        Args:
+            url: 完整 URL
+            params: 查询参数（已签名）
+            stream: 为 True 时不立即读取响应体，调用方需通过 iter_content() 读取
+            timeout: 超时时间（秒）
+
+        Returns:
+            requests.Response；304 时返回由缓存构造的 200 响应
+
+        非流式请求会合并：同一个键已有请求在进行时，等待它完成并返回其响应的副本
+        （异常同样共享）。流式请求的响应体由调用方逐块读取，不参与合并。
+        """
+        key = cache_key(url, params)
+        if stream:
+            return self._send(key, url, params, stream, timeout)
+
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = {"done": threading.Event(), "response": None, "error": None}
+
+        if not leader:
+            call["done"].wait()
+            self._count("coalesced")
+            if call["error"] is not None:
+                raise call["error"]
+            return self._copy_response(call["response"])
+
+        try:
+            call["response"] = self._send(key, url, params, stream, timeout)
+            return call["response"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            call["done"].set()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _send(self, key, url, params, stream, timeout):
+        with self._lock:
+            entry = self._cache.get(key)
+
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        if self.scheduler is not None:
+            self.scheduler.acquire()
+        response = self.session.get(url, params=params, headers=headers,
+                                    stream=stream, timeout=timeout)
+        self._count("requests")
+
+        if response.status_code == 304 and entry:
+            response.close()
+            with self._lock:
+                # 请求期间可能已被其它线程淘汰；entry 在发请求前已取出（缓存项不会原地修改），仍可使用
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                self.stats["not_modified"] += 1
+                self.stats["bytes_saved_cache"] += len(entry["content"])
+            return self._cached_response(response, entry)
+
+        cacheable = response.status_code == 200 and (
+            response.headers.get("ETag") or response.headers.get("Last-Modified"))
+        response._flomo_cache_key = key if cacheable else None
+
+        if not stream:
+            self._finish(response, response.content)
+        return response
+
+    def iter_content(self, response, chunk_size=65536):
+        """
+        逐块读取响应体
+
+        可缓存的响应会在读完后写入缓存；缓存构造的响应直接按块返回缓存内容。
+        """
+        if getattr(response, "_flomo_from_cache", False):
+            yield from response.iter_content(chunk_size=chunk_size)
+            return
+
+        key = getattr(response, "_flomo_cache_key", None)
+        chunks = [] if key else None
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunks is not None:
+                chunks.append(chunk)
+            yield chunk
+
+        self._finish(response, b"".join(chunks) if chunks is not None else None)
+
+    def _finish(self, response, content):
+        """记录流量统计，并把可缓存的响应写入缓存"""
+        decoded = len(content) if content is not None else 0
+        wire = self._wire_bytes(response, decoded)
+        key = getattr(response, "_flomo_cache_key", None)
+        with self._lock:
+            self.stats["bytes_wire"] += wire
+            if content is not None:
+                self.stats["bytes_decoded"] += decoded
+                self.stats["bytes_saved_compression"] += max(decoded - wire, 0)
+
+            if key and content is not None:
+                self._cache[key] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "content": content,
+                    "headers": dict(response.headers),
+                    "encoding": response.encoding,
+                }
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_cache_entries:
+                    self._cache.popitem(last=False)
+
+    @staticmethod
+    def _wire_bytes(response, default):
+        raw = getattr(response, "raw", None)
+        try:
+            read = raw.tell() if raw is not None else None
+        except Exception:
+            read = None
+        if read:
+            return read
+        length = response.headers.get("Content-Length")
+        return int(length) if length and length.isdigit() else default
+
+    @staticmethod
+    def _copy_response(response):
+        """复制已读完的响应，供合并的请求各自使用"""
+        shared = requests.Response()
+        shared.status_code = response.status_code
+        shared.reason = response.reason
+        shared.url = response.url
+        shared.request = response.request
+        shared.headers.update(response.headers)
+        shared.encoding = response.encoding
+        shared._content = response.content
+        shared._content_consumed = True
+        shared._flomo_from_cache = True
+        shared._flomo_cache_key = None
+        return shared
+
+    @staticmethod
+    def _cached_response(not_modified, entry):
+        cached = requests.Response()
+        cached.status_code = 200
+        cached.reason = "OK (cached)"
+        cached.url = not_modified.url
+        cached.request = not_modified.request
+        cached.headers.update(entry["headers"])
+        cached.encoding = entry["encoding"]
+        cached._content = entry["content"]
+        cached._content_consumed = True
+        cached._flomo_from_cache = True
+        cached._flomo_cache_key = None
+        return cached
+
+    def bytes_saved(self):
+        """压缩和条件请求一共节省的字节数"""
+        return self.stats["bytes_saved_compression"] + self.stats["bytes_saved_cache"]
+
+    def cached_bytes(self):
+        """响应缓存占用的字节数"""
+        with self._lock:
+            return sum(len(entry["content"]) for entry in self._cache.values())
+
+    def report(self):
+        """流量节省报告"""
+        with self._lock:
+            report = dict(self.stats)
+            report["cache_entries"] = len(self._cache)
+        report["bytes_saved"] = report["bytes_saved_compression"] + report["bytes_saved_cache"]
+        return report
+
+    def print_report(self):
+        report = self.report()
+        print(f"📡 请求数: {report['requests']}，304 命中: {report['not_modified']}，"
+              f"合并: {report['coalesced']}")
+        print(f"   传输 {report['bytes_wire']:,} 字节，解压后 {report['bytes_decoded']:,} 字节")
+        print(f"   节省 {report['bytes_saved']:,} 字节"
+              f"（压缩 {report['bytes_saved_compression']:,}，缓存 {report['bytes_saved_cache']:,}）")
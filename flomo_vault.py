@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flomo_store import html_to_text
+
+VAULT_MANIFEST_VERSION = 1
+
+
+def _yaml_value(value):
+    """front-matter 的值：JSON 字符串/数组同时也是合法的 YAML"""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def file_reference(item):
+    if isinstance(item, dict):
+        return item.get("url") or item.get("name") or ""
+    return str(item)
+
+
+class MarkdownVaultExporter:
+    """
+    增量导出到 Markdown 目录（每条备忘录一个文件，例如 Obsidian 仓库）
+
+    清单 .flomo_manifest.json 记录 slug -> updated_at、内容哈希和文件路径：
+    updated_at 未变且文件还在的备忘录直接跳过，不渲染也不写入；渲染结果与
+    上次哈希相同的也不重写。已删除（或不在本次全量列表中）的备忘录文件会被移除。
+    渲染和写入在线程池中进行，每个文件先写临时文件再原子替换。
+    """
+
+    def __init__(self, directory="flomo_vault", render=None, max_workers=8):
+        """
+        Args:
+            directory: 导出目录
+            render: memo -> Markdown 正文，默认转为纯文本
+            max_workers: 写文件的线程数
+        """
+        self.directory = directory
+        self.render = render or (lambda memo: html_to_text(memo.get("content", "")))
+        self.max_workers = max_workers
+        self.manifest_path = os.path.join(directory, ".flomo_manifest.json")
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        if data.get("version") != VAULT_MANIFEST_VERSION:
+            return {}
+        return data.get("memos", {})
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": VAULT_MANIFEST_VERSION, "memos": self.manifest}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def relative_path(memo):
+        """按年份分目录，文件名为 日期-slug.md（创建时间不变，文件名稳定）"""
+        created_at = memo.get("created_at") or ""
+        year = created_at[:4] or "unknown"
+        prefix = created_at[:10] + "-" if created_at else ""
+        return os.path.join(year, f"{prefix}{memo['slug']}.md")
+
+    def render_file(self, memo):
+        lines = ["---",
+                 f"slug: {_yaml_value(memo['slug'])}",
+                 f"created_at: {_yaml_value(memo.get('created_at'))}",
+                 f"updated_at: {_yaml_value(memo.get('updated_at'))}",
+                 f"tags: {_yaml_value(list(memo.get('tags') or []))}"]
+        files = [file_reference(item) for item in memo.get("files") or []]
+        if files:
+            lines.append(f"files: {_yaml_value(files)}")
+        lines += ["---", "", self.render(memo).strip(), ""]
+        return "\n".join(lines)
+
+    def _export_one(self, memo, force):
+        """渲染并在需要时写入一条备忘录，返回 (新的清单项, 是否写入)"""
+        slug = memo["slug"]
+        entry = self.manifest.get(slug)
+        path = self.relative_path(memo)
+        full_path = os.path.join(self.directory, path)
+        exists = entry is not None and os.path.exists(os.path.join(self.directory, entry["path"]))
+        if not force and exists and entry["updated_at"] == memo.get("updated_at") and entry["path"] == path:
+            return entry, False
+
+        text = self.render_file(memo)
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        new_entry = {"updated_at": memo.get("updated_at"), "hash": digest, "path": path}
+        if exists and entry["hash"] == digest and entry["path"] == path:
+            return new_entry, False
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = full_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, full_path)
+        if entry is not None and entry["path"] != path:
+            self._remove_file(entry["path"])
+        return new_entry, True
+
+    def _remove_file(self, path):
+        try:
+            os.remove(os.path.join(self.directory, path))
+        except FileNotFoundError:
+            pass
+
+    def export(self, memos, complete=True, force=False):
+        """
+        导出备忘录
+
+        Args:
+            memos: 备忘录列表（已删除的带 deleted_at）
+            complete: memos 是否为全部备忘录；是则移除清单中不在列表里的文件
+            force: 忽略清单，全部重新渲染（内容相同的文件仍不重写）
+
+        Returns:
+            {"written", "unchanged", "removed", "elapsed"}
+        """
+        start = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        live, removed = {}, 0
+        for memo in memos:
+            slug = memo.get("slug")
+            if not slug:
+                continue
+            if memo.get("deleted_at"):
+                live.pop(slug, None)
+                entry = self.manifest.pop(slug, None)
+                if entry is not None:
+                    self._remove_file(entry["path"])
+                    removed += 1
+            else:
+                live[slug] = memo
+
+        if complete:
+            for slug in [slug for slug in self.manifest if slug not in live]:
+                self._remove_file(self.manifest.pop(slug)["path"])
+                removed += 1
+
+        written = 0
+        if live:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(live))) as executor:
+                futures = {slug: executor.submit(self._export_one, memo, force) for slug, memo in live.items()}
+                for slug, future in futures.items():
+                    self.manifest[slug], changed = future.result()
+                    written += changed
+
+        self._save_manifest()
+        return {"written": written, "unchanged": len(live) - written, "removed": removed,
+                "elapsed": round(time.time() - start, 3)}
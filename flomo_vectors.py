@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+import json
+import math
+import os
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from flomo_index import LocalSearchIndex
+from flomo_query_cache import normalize_query
+from flomo_store import html_to_text
+
+
+def memo_text(memo):
+    """备忘录用于向量化的文本（正文 + 标签）"""
+    return html_to_text(memo.get("content", "")) + " " + " ".join(memo.get("tags", []))
+
+
+class HashedNgramEmbedder:
+    """
+    确定性的 CPU 文本向量
+
+    文本切分为 CJK 单字/双字词和英文单词，以 crc32 哈希到 hash_dim 维（带符号），
+    再投影到 dim 维并归一化。fit() 用样本的截断 SVD（LSA）得到投影矩阵；
+    未训练时使用固定种子的随机投影。相同输入永远得到相同向量。
+    """
+
+    def __init__(self, hash_dim=4096, dim=128, seed=0):
+        self.hash_dim = hash_dim  # 必须是 2 的幂
+        self.dim = dim
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.components = (rng.standard_normal((dim, hash_dim)) / math.sqrt(dim)).astype(np.float32)
+        self.fitted = False
+
+    def hashed(self, texts):
+        """返回 (len(texts), hash_dim) 的哈希特征矩阵（未投影）"""
+        matrix = np.zeros((len(texts), self.hash_dim), dtype=np.float32)
+        mask = self.hash_dim - 1
+        for row, text in enumerate(texts):
+            counts = Counter(LocalSearchIndex.tokenize(normalize_query(text)))
+            for token, tf in counts.items():
+                h = zlib.crc32(token.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                matrix[row, h & mask] += sign * (1.0 + math.log(tf))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def fit(self, texts, oversample=10, power_iterations=2):
+        """用样本文本训练截断 SVD 投影（随机化 SVD，固定种子）"""
+        if len(texts) < 2:
+            return
+        sample = self.hashed(texts)
+        rank = min(self.dim + oversample, *sample.shape)
+        rng = np.random.default_rng(self.seed)
+        basis = sample @ rng.standard_normal((self.hash_dim, rank)).astype(np.float32)
+        for _ in range(power_iterations):
+            basis, _ = np.linalg.qr(basis)
+            basis = sample @ (sample.T @ basis)
+        basis, _ = np.linalg.qr(basis)
+        _, _, vt = np.linalg.svd(basis.T @ sample, full_matrices=False)
+        dim = min(self.dim, vt.shape[0])
+        self.components = np.ascontiguousarray(vt[:dim], dtype=np.float32)
+        self.dim = dim
+        self.fitted = True
+
+    def embed(self, texts):
+        """返回 (len(texts), dim) 的归一化向量"""
+        reduced = self.hashed(texts) @ self.components.T
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        return (reduced / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class MemoVectorIndex:
+    """
+    备忘录向量索引（IVF 近似最近邻）
+
+    - 向量存放在按倍数扩容的 NumPy 数组中，slug 映射到行号
+    - 训练后用 k-means 得到 nlist 个中心，每行归入最近的中心；
+      查询时只扫描最相近的 nprobe 个倒排表
+    - 新备忘录直接归入最近的中心，支持增量插入；删除的行放回空闲列表，
+      之后加入的备忘录优先复用，数组不会随编辑次数增长
+    """
+
+    def __init__(self, embedder=None, nlist=None, nprobe=8, seed=0):
+        self.embedder = embedder or HashedNgramEmbedder(seed=seed)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.centroids = None
+        self.lists = []
+        self.slugs = []
+        self.slug_to_id = {}
+        self.size = 0
+        self._free = []
+
+    def __len__(self):
+        return len(self.slug_to_id)
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        capacity = len(self.vectors)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        vectors = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        assign = np.full(capacity, -1, dtype=np.int32)
+        assign[:self.size] = self.assign[:self.size]
+        self.vectors, self.alive, self.assign = vectors, alive, assign
+
+    def build(self, memos, sample_size=2000):
+        """训练投影和 IVF 中心，并加入全部备忘录"""
+        start = time.time()
+        memos = [memo for memo in memos if memo.get("slug") and not memo.get("deleted_at")]
+        rng = np.random.default_rng(self.seed)
+        if len(memos) > sample_size:
+            picks = rng.choice(len(memos), sample_size, replace=False)
+            sample = [memos[i] for i in sorted(picks)]
+        else:
+            sample = memos
+        self.embedder.fit([memo_text(memo) for memo in sample])
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.slugs, self.slug_to_id, self.size, self._free = [], {}, 0, []
+        self.centroids, self.lists = None, []
+
+        for i in range(0, len(memos), 1000):
+            self.add_many(memos[i:i + 1000])
+        self.train()
+        print(f"🧭 向量索引已建立: {len(self)} 条备忘录，{len(self.lists)} 个分区，耗时 {time.time() - start:.1f}s")
+
+    def train(self, iterations=10):
+        """对现有向量做球面 k-means，建立倒排表"""
+        ids = np.flatnonzero(self.alive[:self.size])
+        nlist = self.nlist or max(1, int(math.sqrt(len(ids))))
+        if len(ids) < nlist * 4:
+            # 数据太少时直接暴力搜索
+            self.centroids, self.lists = None, []
+            self.assign[:self.size] = -1
+            return
+
+        data = self.vectors[ids]
+        rng = np.random.default_rng(self.seed)
+        centroids = data[rng.choice(len(ids), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, data)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            sums[empty] = centroids[empty]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+
+        labels = np.argmax(data @ centroids.T, axis=1)
+        self.centroids = centroids.astype(np.float32)
+        self.assign[:self.size] = -1
+        self.assign[ids] = labels
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+        self.lists = [list(ids[order[bounds[c]:bounds[c + 1]]]) for c in range(nlist)]
+
+    def add_many(self, memos):
+        """增量加入备忘录（已存在的 slug 会被替换）"""
+        memos = [memo for memo in memos if memo.get("slug")]
+        for memo in memos:
+            self.remove(memo["slug"])
+        memos = [memo for memo in memos if not memo.get("deleted_at")]
+        if not memos:
+            return
+
+        vectors = self.embedder.embed([memo_text(memo) for memo in memos])
+        # 先复用删除留下的空行，不够时再在末尾追加
+        reused = [self._free.pop() for _ in range(min(len(self._free), len(memos)))]
+        appended = len(memos) - len(reused)
+        self._reserve(appended)
+        if not self.vectors.flags.writeable:
+            # mmap 只读打开的向量在第一次写入时复制到内存
+            self.vectors = np.array(self.vectors)
+        rows = np.array(reused + list(range(self.size, self.size + appended)), dtype=np.int64)
+        self.slugs.extend([None] * appended)
+        self.size += appended
+
+        self.vectors[rows] = vectors
+        self.alive[rows] = True
+        if self.centroids is not None:
+            labels = np.argmax(vectors @ self.centroids.T, axis=1)
+            for row, label in zip(rows, labels):
+                self.assign[row] = label
+                self.lists[label].append(int(row))
+        for row, memo in zip(rows, memos):
+            self.slug_to_id[memo["slug"]] = int(row)
+            self.slugs[row] = memo["slug"]
+
+    def add(self, memo):
+        self.add_many([memo])
+
+    def remove(self, slug):
+        row = self.slug_to_id.pop(slug, None)
+        if row is None:
+            return
+        self.alive[row] = False
+        self.slugs[row] = None
+        if self.centroids is not None and self.assign[row] >= 0:
+            self.lists[self.assign[row]].remove(row)
+        self.assign[row] = -1
+        self._free.append(row)
+
+    def on_memos_synced(self, memos):
+        """同步引擎的监听回调"""
+        self.add_many(memos)
+
+    def _candidates(self, query):
+        if self.centroids is None:
+            return np.flatnonzero(self.alive[:self.size])
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.fromiter((row for c in probes for row in self.lists[c]), dtype=np.int64)
+        return rows[self.alive[rows]] if len(rows) else rows
+
+    def search_vector(self, query, k=10, exclude=None):
+        """返回 [(similarity, slug)]，相似度从高到低"""
+        rows = self._candidates(query)
+        if exclude is not None:
+            rows = rows[rows != exclude]
+        if not len(rows):
+            return []
+        scores = self.vectors[rows] @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.slugs[rows[i]]) for i in top]
+
+    def related(self, slug, k=10):
+        """与已有备忘录最相近的 k 条"""
+        row = self.slug_to_id.get(slug)
+        if row is None:
+            return []
+        return self.search_vector(self.vectors[row], k=k, exclude=row)
+
+    def related_text(self, text, k=10):
+        """与任意文本最相近的 k 条"""
+        return self.search_vector(self.embedder.embed([text])[0], k=k)
+
+    def save(self, directory):
+        """保存为独立的 .npy 文件（可以用 mmap 打开）"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "vectors.npy"), self.vectors[:self.size])
+        np.save(os.path.join(directory, "alive.npy"), self.alive[:self.size])
+        np.save(os.path.join(directory, "assign.npy"), self.assign[:self.size])
+        np.save(os.path.join(directory, "components.npy"), self.embedder.components)
+        if self.centroids is not None:
+            np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "slugs": self.slugs,
+                "hash_dim": self.embedder.hash_dim,
+                "nprobe": self.nprobe,
+                "has_centroids": self.centroids is not None
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        """加载索引；mmap_mode="r" 时向量以只读内存映射打开"""
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        components = np.load(os.path.join(directory, "components.npy"))
+        embedder = HashedNgramEmbedder(hash_dim=meta["hash_dim"], dim=components.shape[0])
+        embedder.components = components
+        embedder.fitted = True
+
+        index = cls(embedder=embedder, nprobe=meta["nprobe"])
+        index.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode=mmap_mode)
+        index.alive = np.load(os.path.join(directory, "alive.npy"))
+        index.assign = np.load(os.path.join(directory, "assign.npy"))
+        index.slugs = meta["slugs"]
+        index.size = len(index.slugs)
+        index.slug_to_id = {slug: row for row, slug in enumerate(index.slugs) if index.alive[row]}
+        index._free = [int(row) for row in np.flatnonzero(~index.alive[:index.size])]
+        if meta["has_centroids"]:
+            index.centroids = np.load(os.path.join(directory, "centroids.npy"))
+            index.lists = [[] for _ in range(len(index.centroids))]
+            for row in np.flatnonzero(index.assign >= 0):
+                index.lists[index.assign[row]].append(int(row))
+        return index
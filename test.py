@@ -4,6 +4,7 @@ import requests
 import hashlib
 import json
 from datetime import datetime
+from flomo_store import to_epoch
 
 def get_flomo_memos(token, latest_slug=None, latest_updated_at=None):
     """
@@ -116,7 +117,7 @@ def get_all_memos(token):
         # 设置下一页的分页参数
         last_memo = memos[-1]
         latest_slug = last_memo["slug"]
-        latest_updated_at = int(datetime.fromisoformat(last_memo["updated_at"]).timestamp())
+        latest_updated_at = to_epoch(last_memo["updated_at"])
         
         print(f"准备获取下一页，latest_slug: {latest_slug}, latest_updated_at: {latest_updated_at}")
     
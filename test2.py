@@ -1,20 +1,28 @@
 #!/usr/bin/env python3
 
-import requests
 import hashlib
 import json
 import csv
 from datetime import datetime
-from bs4 import BeautifulSoup
-from html2text import html2text
 import os
-from collections import Counter
+from flomo_analytics import MemoAnalyticsViews
+from flomo_insights import InsightEngine
+from flomo_store import to_epoch
+from flomo_stream import iter_page_memos
+from flomo_transport import FlomoTransport
+from flomo_vault import MarkdownVaultExporter
 
 class FlomoAnalyzer:
-    def __init__(self, token):
+    def __init__(self, token, transport=None, views=None):
         self.token = token
         self.salt = "dbbc3dd73364b4084c3a69346e0ce2b2"
         self.base_url = "https://flomoapp.com/api/v1/memo/updated/"
+        self.transport = transport or FlomoTransport(token)
+        # 统计视图随每次分析增量更新；解析结果按 (slug, updated_at) 缓存，只解析有变化的备忘录
+        self.views = views or MemoAnalyticsViews(parse=self._parse_cached)
+        # 关键词引擎同样只为有变化的备忘录重新切词
+        self.insights = InsightEngine()
+        self._parsed = {}
         
     def get_memos_page(self, latest_slug=None, latest_updated_at=None, limit=200):
         """获取一页备忘录数据"""
@@ -41,14 +49,11 @@ class FlomoAnalyzer:
         sign = hashlib.md5((param_str + self.salt).encode("utf-8")).hexdigest()
         params["sign"] = sign
         
-        headers = {"Authorization": self.token}
-        
         try:
-            response = requests.get(self.base_url, params=params, headers=headers)
+            # 流式读取并逐条解析，不再先把整页读成 response.text
+            response = self.transport.get(self.base_url, params=params, stream=True)
             if response.status_code == 200:
-                data = response.json()
-                if data.get("code") == 0:
-                    return data.get("data", [])
+                return list(iter_page_memos(self.transport.iter_content(response)))
             return None
         except Exception as e:
             print(f"请求失败: {e}")
@@ -77,7 +82,7 @@ class FlomoAnalyzer:
             # 设置下一页参数
             last_memo = memos[-1]
             latest_slug = last_memo["slug"]
-            latest_updated_at = int(datetime.fromisoformat(last_memo["updated_at"]).timestamp())
+            latest_updated_at = to_epoch(last_memo["updated_at"])
             page += 1
         
         print(f"✅ 总共获取到 {len(all_memos)} 条备忘录")
@@ -85,6 +90,10 @@ class FlomoAnalyzer:
     
     def parse_memo_content(self, memo):
         """解析备忘录内容"""
+        # HTML 解析库较重，第一次解析时才导入
+        from bs4 import BeautifulSoup
+        from html2text import html2text
+        
         content = memo.get('content', '')
         
         # 转换为纯文本
@@ -105,6 +114,13 @@ class FlomoAnalyzer:
             'tags': self.extract_tags(content)
         }
     
+    def _parse_cached(self, memo):
+        key = (memo.get('slug'), memo.get('updated_at'))
+        parsed = self._parsed.get(key)
+        if parsed is None:
+            parsed = self._parsed[key] = self.parse_memo_content(memo)
+        return parsed
+
     def extract_tags(self, content):
         """提取标签"""
         import re
@@ -113,40 +129,21 @@ class FlomoAnalyzer:
         return tags
     
     def analyze_memos(self, memos):
-        """分析备忘录数据"""
-        parsed_memos = [self.parse_memo_content(memo) for memo in memos]
-        
-        # 统计信息
-        total_count = len(parsed_memos)
-        total_words = sum(memo['word_count'] for memo in parsed_memos)
-        
-        # 按年月统计
-        date_counter = Counter()
-        tag_counter = Counter()
-        
-        for memo in parsed_memos:
-            if memo['created_at']:
-                date = memo['created_at'][:7]  # YYYY-MM
-                date_counter[date] += 1
-            
-            for tag in memo['tags']:
-                tag_counter[tag] += 1
-        
-        # 时间范围
-        dates = [memo['created_at'] for memo in parsed_memos if memo['created_at']]
-        earliest = min(dates) if dates else "N/A"
-        latest = max(dates) if dates else "N/A"
-        
-        analysis = {
-            'total_memos': total_count,
-            'total_words': total_words,
-            'avg_words_per_memo': round(total_words / total_count, 2) if total_count > 0 else 0,
-            'date_range': f"{earliest} 到 {latest}",
-            'monthly_distribution': dict(date_counter.most_common()),
-            'top_tags': dict(tag_counter.most_common(20)),
-            'parsed_memos': parsed_memos
-        }
-        
+        """分析备忘录数据（统计来自增量维护的物化视图）"""
+        current = {memo.get('slug') for memo in memos}
+        # 不在本次列表中的备忘录视为已删除
+        for slug in [slug for slug in self.views.records if slug not in current]:
+            self.views.add({'slug': slug, 'deleted_at': True})
+            self.insights.add({'slug': slug, 'deleted_at': True})
+        self.views.build(memos)
+        self.insights.build(memos)
+
+        parsed_memos = [self._parse_cached(memo) for memo in memos]
+        self._parsed = {(memo['slug'], memo['updated_at']): memo for memo in parsed_memos}
+
+        analysis = self.views.summary(top_tags=20)
+        analysis['yearly_keywords'] = self.insights.year_over_year(k=10)
+        analysis['parsed_memos'] = parsed_memos
         return analysis
     
     def export_to_csv(self, analysis, filename="flomo_export.csv"):
@@ -175,6 +172,14 @@ class FlomoAnalyzer:
             json.dump(analysis, f, ensure_ascii=False, indent=2)
         
         print(f"✅ 数据已导出到 {filename}")
+
+    def export_to_vault(self, memos, directory="flomo_vault"):
+        """增量导出到 Markdown 目录（每条备忘录一个文件，只重写有变化的）"""
+        exporter = MarkdownVaultExporter(directory, render=lambda memo: self._parse_cached(memo)['markdown'])
+        stats = exporter.export(memos)
+        print(f"✅ Markdown 已导出到 {directory}/：写入 {stats['written']} 个，"
+              f"未变化 {stats['unchanged']} 个，删除 {stats['removed']} 个，耗时 {stats['elapsed']}s")
+        return stats
     
     def print_analysis(self, analysis):
         """打印分析结果"""
@@ -194,12 +199,16 @@ class FlomoAnalyzer:
         for month, count in list(analysis['monthly_distribution'].items())[:10]:
             print(f"   {month}: {count} 条")
         
+        print(f"\n🔑 年度关键词:")
+        for year in analysis.get('yearly_keywords', []):
+            terms = '、'.join(item['term'] for item in year['top_terms'][:5])
+            print(f"   {year['year']} ({year['memos']} 条): {terms}")
+            if year['new_terms']:
+                print(f"      新出现: {'、'.join(year['new_terms'][:5])}")
+
         print(f"\n💡 最新的 5 条备忘录:")
-        latest_memos = sorted(analysis['parsed_memos'], 
-                            key=lambda x: x['created_at'] or '', reverse=True)[:5]
-        for i, memo in enumerate(latest_memos, 1):
-            preview = memo['plain_text'][:100] + "..." if len(memo['plain_text']) > 100 else memo['plain_text']
-            print(f"   {i}. [{memo['created_at']}] {preview}")
+        for i, memo in enumerate(analysis['latest_memos'], 1):
+            print(f"   {i}. [{memo['created_at']}] {memo['preview']}")
 
 def main():
     # 配置你的token
@@ -227,6 +236,7 @@ def main():
     print(f"\n💾 正在导出数据...")
     analyzer.export_to_csv(analysis)
     analyzer.export_to_json(analysis)
+    analyzer.export_to_vault(memos)
     
     print(f"\n🎉 完成！你的 Flomo 数据已成功分析并导出。")
 
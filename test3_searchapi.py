@@ -1,18 +1,37 @@
 #!/usr/bin/env python3
 
-import requests
+import contextlib
 import hashlib
 import json
 from datetime import datetime
-from bs4 import BeautifulSoup
-from html2text import html2text
 import time
+from flomo_stream import aiterate
+from flomo_transport import FlomoTransport
+from flomo_mmap import peek
+from flomo_planner import REMOTE_MAX_RESULTS, REMOTE_PAGE_SIZE, QueryPlanner
+from flomo_query_cache import QueryResultCache
+from flomo_ranking import RelevanceRanker
+from flomo_store import epoch_bound, to_epoch
 
 class FlomoSearchAPI:
-    def __init__(self, token):
+    def __init__(self, token, transport=None, query_cache=None, store=None, local_index=None, timeline=None,
+                 tag_index=None):
         self.token = token
         self.salt = "dbbc3dd73364b4084c3a69346e0ce2b2"
         self.base_url = "https://flomoapp.com/api/v1/memo/updated/"
+        self.transport = transport or FlomoTransport(token)
+        # 搜索结果缓存；注册到同步引擎后会在备忘录更新时自动失效
+        self.query_cache = query_cache if query_cache is not None else QueryResultCache()
+        # 可选的本地存储和索引（由同步引擎维护），用于拼音/模糊搜索
+        self.store = store
+        self.local_index = local_index
+        self.ranker = RelevanceRanker(local_index, store)
+        # 可选的按创建时间排序的索引（flomo_timeline.TimestampIndex），用于日期范围查询
+        self.timeline = timeline
+        self.tz = store.tz if store is not None else "8:0"
+        # 高级搜索的代价优化器（需要注册为同步监听者）；last_plan 为最近一次查询的 explain 输出
+        self.planner = QueryPlanner(store, local_index, tag_index, timeline)
+        self.last_plan = None
         
     def _generate_params(self, extra_params=None):
         """生成API参数和签名"""
@@ -48,24 +67,29 @@ class FlomoSearchAPI:
         if not query.strip():
             return []
         
+        cache_key = self.query_cache.make_key("search", query, limit=limit)
+        cached = self.query_cache.get(cache_key)
+        if cached is not None:
+            print(f"⚡ 命中搜索缓存: '{query}'，{len(cached)} 条结果")
+            return cached
+        
         try:
             params = self._generate_params({
                 "q": query,
                 "limit": str(limit)
             })
             
-            headers = {"Authorization": self.token}
-            
             print(f"🔍 搜索关键词: '{query}'")
             print(f"📊 请求参数: {params}")
             
-            response = requests.get(self.base_url, params=params, headers=headers)
+            response = self.transport.get(self.base_url, params=params)
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get("code") == 0:
                     results = data.get("data", [])
                     print(f"✅ 搜索成功，找到 {len(results)} 条结果")
+                    self.query_cache.set(cache_key, results)
                     return results
                 else:
                     print(f"❌ API错误: {data.get('message')}")
@@ -78,22 +102,51 @@ class FlomoSearchAPI:
             print(f"💥 搜索异常: {e}")
             return []
     
-    def search_with_pagination(self, query, max_results=200):
+    def search_with_pagination(self, query, max_results=200, rank=False):
         """
         支持分页的搜索（获取更多结果）
         
         Args:
             query: 搜索关键词
             max_results: 最大结果数量
+            rank: 为 True 时按相关性（BM25 + 时间 + 置顶 + 引用）取前 max_results 条，
+                  否则保持服务端顺序
+        """
+        all_results = [memo for page in self.iter_search_pages(query, max_results) for memo in page]
+        if rank:
+            return self.ranker.rank_memos(query, all_results, k=max_results)
+        return all_results
+    
+    def iter_search_pages(self, query, max_results=200, page_size=50):
         """
+        逐页产出搜索结果（渐进式返回）
+        
+        每取到一页就产出该页的原始备忘录，调用方第一轮请求后即可展示结果；
+        不再需要更多结果时关闭生成器（或停止迭代）即可停止翻页。
+        只有完整取完的结果会写入缓存。
+        
+        Args:
+            query: 搜索关键词
+            max_results: 最大结果数量
+            page_size: 每页数量
+        """
+        cache_key = self.query_cache.make_key("search_with_pagination", query, max_results=max_results)
+        cached = self.query_cache.get(cache_key)
+        if cached is not None:
+            print(f"⚡ 命中搜索缓存: '{query}'，{len(cached)} 条结果")
+            if cached:
+                yield cached
+            return
+        
         all_results = []
         latest_slug = None
         latest_updated_at = None
         page = 1
+        completed = True
         
         while len(all_results) < max_results:
             try:
-                search_params = {"q": query, "limit": "50"}
+                search_params = {"q": query, "limit": str(page_size)}
                 
                 # 添加分页参数
                 if latest_slug and latest_updated_at:
@@ -103,11 +156,10 @@ class FlomoSearchAPI:
                     })
                 
                 params = self._generate_params(search_params)
-                headers = {"Authorization": self.token}
                 
                 print(f"🔍 搜索第 {page} 页: '{query}'")
                 
-                response = requests.get(self.base_url, params=params, headers=headers)
+                response = self.transport.get(self.base_url, params=params)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -117,36 +169,109 @@ class FlomoSearchAPI:
                         if not results:
                             break
                         
-                        all_results.extend(results)
-                        print(f"📄 第 {page} 页获取 {len(results)} 条结果")
+                        page_results = results[:max_results - len(all_results)]
+                        all_results.extend(page_results)
+                        print(f"📄 第 {page} 页获取 {len(results)} 条结果，累计 {len(all_results)} 条")
+                        yield page_results
                         
-                        # 如果这页结果少于50条，说明没有更多数据了
-                        if len(results) < 50:
+                        # 如果这页结果少于 page_size 条，说明没有更多数据了
+                        if len(results) < page_size:
                             break
                         
                         # 设置下一页参数
                         last_memo = results[-1]
                         latest_slug = last_memo["slug"]
-                        latest_updated_at = int(datetime.fromisoformat(last_memo["updated_at"]).timestamp())
+                        latest_updated_at = to_epoch(last_memo["updated_at"], self.tz)
                         
                         page += 1
-                        time.sleep(0.5)  # 避免请求过快
+                        if len(all_results) < max_results:
+                            time.sleep(0.5)  # 避免请求过快
                     else:
                         print(f"❌ API错误: {data.get('message')}")
+                        completed = False
                         break
                 else:
                     print(f"❌ HTTP错误: {response.status_code}")
+                    completed = False
                     break
                     
             except Exception as e:
                 print(f"💥 搜索异常: {e}")
+                completed = False
                 break
         
         print(f"✅ 搜索完成，总共找到 {len(all_results)} 条结果")
-        return all_results[:max_results]
+        # 中途出错的结果不完整，不写入缓存
+        if completed:
+            self.query_cache.set(cache_key, all_results)
+    
+    def aiter_search_pages(self, query, max_results=200, page_size=50, executor=None):
+        """iter_search_pages 的异步迭代版本（每页的网络请求和解析在线程池中执行）"""
+        return aiterate(self.iter_search_pages(query, max_results, page_size), executor)
+    
+    def local_search(self, query, limit=50):
+        """
+        本地模糊搜索：一次本地查找依次尝试原文、拼音、首字母和编辑距离扩展
+        
+        Args:
+            query: 搜索关键词（可以是拼音、首字母或有错别字的英文）
+            limit: 结果数量限制
+        """
+        if self.store is None or self.local_index is None:
+            print("❌ 未配置本地索引，请先同步备忘录")
+            return []
+        
+        slugs, modes, terms = self.local_index.match(query)
+        print(f"🔎 本地搜索 '{query}'（{'/'.join(m or '-' for m in modes)}）: {len(slugs)} 条结果")
+        if terms and "text" not in modes:
+            print(f"   匹配词: {terms[:10]}")
+        
+        ranked = self.local_index.most_recent(slugs, limit=limit)
+        return [self.store.get(slug) for slug in ranked if slug in self.store]
+    
+    def memos_between(self, date_from=None, date_to=None, limit=None):
+        """
+        本地日期范围查询（按创建时间倒序）
+
+        Args:
+            date_from, date_to: epoch、datetime（按账户时区解释）或时间字符串，含两端
+            limit: 只要最新的 limit 条
+        """
+        if self.store is None or self.timeline is None:
+            print("❌ 未配置本地时间索引，请先同步备忘录")
+            return []
+        if limit is None:
+            slugs = self.timeline.between(date_from, date_to)[::-1]
+        else:
+            slugs = self.timeline.recent(limit, date_from, date_to)
+        return [self.store.get(slug) for slug in slugs if slug in self.store]
+    
+    def recent_memos(self, days=7, limit=20):
+        """本地查询最近 days 天内最新的 limit 条"""
+        return self.memos_between(time.time() - days * 86400, limit=limit)
+    
+    def ranked_search(self, query, k=10):
+        """
+        本地相关性搜索：在本地索引的候选中按 BM25 + 时间 + 置顶 + 引用取前 k 条
+        
+        Returns:
+            [(score, memo)]，分数从高到低
+        """
+        if self.store is None or self.local_index is None:
+            print("❌ 未配置本地索引，请先同步备忘录")
+            return []
+        
+        slugs, _, terms = self.local_index.match(query)
+        top = self.ranker.top_k(slugs, terms, k=k)
+        print(f"🏆 相关性搜索 '{query}': {len(slugs)} 条候选，返回前 {len(top)} 条")
+        return [(score, self.store.get(slug)) for score, slug in top]
     
     def parse_search_result(self, memo):
         """解析搜索结果"""
+        # HTML 解析库较重，第一次解析时才导入
+        from bs4 import BeautifulSoup
+        from html2text import html2text
+        
         content = memo.get('content', '')
         
         # 转换HTML为文本
@@ -172,6 +297,7 @@ class FlomoSearchAPI:
         return {
             'slug': memo.get('slug'),
             'created_at': memo.get('created_at'),
+            'created_epoch': self._created_epoch(memo),
             'updated_at': memo.get('updated_at'),
             'creator_id': memo.get('creator_id'),
             'source': memo.get('source'),
@@ -188,62 +314,141 @@ class FlomoSearchAPI:
         }
     
     def advanced_search(self, query, include_tags=None, exclude_tags=None, 
-                       has_files=None, date_from=None, date_to=None):
+                       has_files=None, date_from=None, date_to=None, top_k=None):
         """
-        高级搜索（在搜索结果基础上进行过滤）
+        高级搜索（QueryPlanner 在服务端搜索后过滤、本地索引、标签优先之间选择代价最低的执行方式，
+        选择结果见 last_plan / explain_search）
         
         Args:
             query: 基础搜索关键词
             include_tags: 必须包含的标签列表
             exclude_tags: 必须排除的标签列表  
             has_files: True=只要有文件的, False=只要没文件的, None=不限制
-            date_from: 开始日期 (datetime对象)
-            date_to: 结束日期 (datetime对象)
+            date_from: 开始日期（datetime、epoch 或时间字符串；不带时区的 datetime 按账户时区解释）
+            date_to: 结束日期（同上）
+            top_k: 指定时按相关性排序并只返回前 top_k 条
         """
-        # 先进行基础搜索
-        base_results = self.search_with_pagination(query, max_results=500)
+        scanned = 0
+        filtered_results = []
+        for page, page_scanned in self._iter_filtered_pages(query, include_tags, exclude_tags,
+                                                           has_files, date_from, date_to):
+            scanned += page_scanned
+            filtered_results.extend(page)
         
-        if not base_results:
+        if not scanned:
             return []
         
-        # 解析所有结果
-        parsed_results = [self.parse_search_result(memo) for memo in base_results]
+        print(f"🎯 高级搜索完成（{self.last_plan['plan']}），从 {scanned} 条结果中筛选出 {len(filtered_results)} 条")
+        if top_k:
+            return self.ranker.rank_memos(query, filtered_results, k=top_k)
+        return filtered_results
+    
+    def iter_advanced_search(self, query, include_tags=None, exclude_tags=None,
+                             has_files=None, date_from=None, date_to=None, plan=None, lock=None):
+        """
+        逐页产出高级搜索结果（已解析、已过滤，可能为空列表），参数同 advanced_search
+
+        plan 为 explain_search 事先选好的计划，不传时重新选择。
+        lock 为保护本地索引的锁：本地计划只在执行计划和取出每页原始备忘录时持有，
+        HTML 解析在锁外进行
+        """
+        for page, _ in self._iter_filtered_pages(query, include_tags, exclude_tags,
+                                                 has_files, date_from, date_to, plan, lock):
+            yield page
+    
+    def explain_search(self, query, include_tags=None, exclude_tags=None,
+                       has_files=None, date_from=None, date_to=None):
+        """
+        不执行查询，只返回 advanced_search 会选择的计划（各计划的估算代价、行数和统计信息）
+        """
+        return self.planner.plan(query, include_tags, exclude_tags, has_files,
+                                 epoch_bound(date_from, self.tz), epoch_bound(date_to, self.tz))
+    
+    def aiter_advanced_search(self, query, executor=None, **filters):
+        """iter_advanced_search 的异步迭代版本"""
+        return aiterate(self.iter_advanced_search(query, **filters), executor)
+    
+    def _created_epoch(self, memo):
+        """创建时间的 epoch 秒：优先取时间索引中已转换好的值"""
+        if self.timeline is not None:
+            epoch = self.timeline.get(memo.get('slug'))
+            if epoch is not None:
+                return epoch
+        try:
+            return to_epoch(memo.get('created_at'), self.tz)
+        except ValueError:
+            return None
+    
+    def _iter_filtered_pages(self, query, include_tags, exclude_tags, has_files, date_from, date_to, plan=None,
+                             lock=None):
+        """产出 (过滤后的解析结果, 本页扫描数量)"""
+        lock = lock or contextlib.nullcontext()
+        # 日期边界每次查询只转换一次；日期过滤在解析 HTML 之前进行
+        start = epoch_bound(date_from, self.tz)
+        end = epoch_bound(date_to, self.tz)
+        plan = plan or self.planner.plan(query, include_tags, exclude_tags, has_files, start, end)
+        self.last_plan = plan
+        started = time.time()
+        if plan["plan"] != "server":
+            with lock:
+                slugs, scanned = self.planner.execute(plan["plan"], query, include_tags, exclude_tags,
+                                                      has_files, start, end)
+            plan["actual"] = {"scanned": scanned, "rows": len(slugs), "elapsed": round(time.time() - started, 4)}
+            print(f"🧭 执行计划 {plan['plan']}：{plan['reason']}，扫描 {scanned} 条候选")
+            # 与服务端分页相同的粒度逐页解析，调用方够数即可停止
+            for i in range(0, max(len(slugs), 1), REMOTE_PAGE_SIZE):
+                with lock:
+                    memos = [self.store.get(slug) for slug in slugs[i:i + REMOTE_PAGE_SIZE] if slug in self.store]
+                # 标签、时间、附件条件已由计划按本地标签索引核对过，这里不再重复过滤
+                yield [self.parse_search_result(memo) for memo in memos], 0 if i else scanned
+            return
+        scanned = 0
+        for memos in self.iter_search_pages(query, max_results=REMOTE_MAX_RESULTS):
+            scanned += len(memos)
+            plan["actual"] = {"scanned": scanned, "elapsed": round(time.time() - started, 4)}
+            candidates = memos
+            if start is not None or end is not None:
+                candidates = [memo for memo in memos
+                              if self._in_range(self._created_epoch(memo), start, end)]
+            parsed_results = [self.parse_search_result(memo) for memo in candidates]
+            yield [result for result in parsed_results
+                   if self._matches_filters(result, self._result_tags(result), include_tags, exclude_tags,
+                                            has_files)], len(memos)
+    
+    @staticmethod
+    def _in_range(epoch, start, end):
+        if epoch is None:
+            return False
+        return (start is None or epoch >= start) and (end is None or epoch <= end)
+    
+    def _result_tags(self, result):
+        """与 QueryPlanner 相同的标签来源：本地标签索引收录了该备忘录时以索引为准，否则用 HTML 中提取的标签"""
+        tag_index = self.planner.tag_index
+        if tag_index is not None:
+            tags = peek(tag_index.memo_tags, result['slug'])
+            if tags is not None:
+                return tags
+        return result['tags']
+    
+    @staticmethod
+    def _matches_filters(result, tags, include_tags, exclude_tags, has_files):
+        # 标签过滤
+        if include_tags:
+            if not all(tag in tags for tag in include_tags):
+                return False
         
-        # 应用过滤条件
-        filtered_results = []
+        if exclude_tags:
+            if any(tag in tags for tag in exclude_tags):
+                return False
         
-        for result in parsed_results:
-            # 标签过滤
-            if include_tags:
-                if not all(tag in result['tags'] for tag in include_tags):
-                    continue
-            
-            if exclude_tags:
-                if any(tag in result['tags'] for tag in exclude_tags):
-                    continue
-            
-            # 文件过滤
-            if has_files is not None:
-                if has_files and not result['has_files']:
-                    continue
-                elif not has_files and result['has_files']:
-                    continue
-            
-            # 日期过滤
-            if date_from or date_to:
-                try:
-                    memo_date = datetime.fromisoformat(result['created_at'].replace('Z', '+00:00'))
-                    if date_from and memo_date < date_from:
-                        continue
-                    if date_to and memo_date > date_to:
-                        continue
-                except:
-                    continue
-            
-            filtered_results.append(result)
+        # 文件过滤
+        if has_files is not None:
+            if has_files and not result['has_files']:
+                return False
+            elif not has_files and result['has_files']:
+                return False
         
-        print(f"🎯 高级搜索完成，从 {len(parsed_results)} 条结果中筛选出 {len(filtered_results)} 条")
-        return filtered_results
+        return True
     
     def get_file_details(self, file_ids):
         """
@@ -262,12 +467,10 @@ class FlomoSearchAPI:
                 file_params[f"ids[{i}]"] = str(file_id)
             
             params = self._generate_params(file_params)
-            headers = {"Authorization": self.token}
             
-            response = requests.get(
+            response = self.transport.get(
                 "https://flomoapp.com/api/v1/file/",
-                params=params,
-                headers=headers
+                params=params
             )
             
             if response.status_code == 200:
@@ -1,18 +1,30 @@
 #!/usr/bin/env python3
 
-import requests
 import hashlib
 import json
 from datetime import datetime
-from bs4 import BeautifulSoup
-from html2text import html2text
 import time
+from flomo_stream import iter_page_memos
+from flomo_transport import FlomoTransport
+from flomo_graph import MemoGraph
+from flomo_clustering import ClusterEngine, build_knn_graph
+from flomo_checkpoint import JobCheckpoint
+from flomo_dedup import NearDuplicateIndex
+from flomo_store import to_epoch
 
 class FlomoCompleteAPI:
-    def __init__(self, token):
+    def __init__(self, token, transport=None, store=None, vector_index=None, graph=None, dedup_index=None):
         self.token = token
         self.salt = "dbbc3dd73364b4084c3a69346e0ce2b2"
         self.base_url = "https://flomoapp.com/api/v1"
+        self.transport = transport or FlomoTransport(token)
+        # 可选的本地存储和向量索引，用于不访问服务器的相关推荐
+        self.store = store
+        self.vector_index = vector_index
+        # 备忘录关系图（CSR），聚类结果和推荐关系都增量写入这里
+        self.graph = graph if graph is not None else MemoGraph()
+        # 近似重复指纹索引（MinHash），由同步引擎增量维护时直接复用
+        self.dedup_index = dedup_index
         
     def _generate_params(self, extra_params=None):
         """生成API参数和签名"""
@@ -34,17 +46,28 @@ class FlomoCompleteAPI:
         
         return params
     
-    def get_all_memos(self, limit_per_page=200):
-        """获取所有备忘录"""
-        all_memos = []
-        latest_slug = None
-        latest_updated_at = None
+    @property
+    def tz(self):
+        """账户时区（有本地存储时取存储记录的时区），用于请求参数和分页游标"""
+        return self.store.tz if self.store is not None else "8:0"
+    
+    def iter_memo_pages(self, latest_slug=None, latest_updated_at=None, limit_per_page=200,
+                        raise_errors=False):
+        """
+        从指定的分页游标开始，逐页产出备忘录
+        
+        Args:
+            latest_slug: 分页游标（上一页最后一条的 slug），None 表示从头开始
+            latest_updated_at: 分页游标（上一页最后一条的更新时间戳）
+            limit_per_page: 每页数量
+            raise_errors: 为 True 时请求失败抛出异常，而不是当作已取完
+        """
         page = 1
         
         while True:
             print(f"正在获取第 {page} 页数据...")
             
-            search_params = {"limit": str(limit_per_page), "tz": "8:0"}
+            search_params = {"limit": str(limit_per_page), "tz": self.tz}
             
             # 添加分页参数
             if latest_slug and latest_updated_at:
@@ -54,49 +77,107 @@ class FlomoCompleteAPI:
                 })
             
             params = self._generate_params(search_params)
-            headers = {"Authorization": self.token}
             
             try:
-                response = requests.get(f"{self.base_url}/memo/updated/", 
-                                     params=params, headers=headers)
+                # 流式读取响应，逐条解析 data 数组，避免整页同时以文本和对象两种形式驻留内存
+                response = self.transport.get(f"{self.base_url}/memo/updated/", 
+                                              params=params, stream=True)
                 
                 if response.status_code == 200:
-                    data = response.json()
-                    if data.get("code") == 0:
-                        memos = data.get("data", [])
-                        
-                        if not memos:
-                            break
-                        
-                        all_memos.extend(memos)
-                        print(f"第 {page} 页获取 {len(memos)} 条备忘录")
-                        
-                        # 如果这页结果少于限制数量，说明没有更多数据了
-                        if len(memos) < limit_per_page:
-                            break
-                        
-                        # 设置下一页参数
-                        last_memo = memos[-1]
-                        latest_slug = last_memo["slug"]
-                        latest_updated_at = int(datetime.fromisoformat(last_memo["updated_at"]).timestamp())
-                        
-                        page += 1
-                        # time.sleep(0.5)  # 避免请求过快
-                    else:
-                        print(f"API错误: {data.get('message')}")
-                        break
+                    memos = list(iter_page_memos(self.transport.iter_content(response)))
                 else:
-                    print(f"HTTP错误: {response.status_code}")
-                    break
+                    raise RuntimeError(f"HTTP错误: {response.status_code}")
                     
             except Exception as e:
+                if raise_errors:
+                    raise
                 print(f"请求异常: {e}")
-                break
+                return
+            
+            if not memos:
+                return
+            
+            print(f"第 {page} 页获取 {len(memos)} 条备忘录")
+            yield memos
+            
+            # 如果这页结果少于限制数量，说明没有更多数据了
+            if len(memos) < limit_per_page:
+                return
+            
+            # 设置下一页参数
+            last_memo = memos[-1]
+            latest_slug = last_memo["slug"]
+            latest_updated_at = to_epoch(last_memo["updated_at"], self.tz)
+            
+            page += 1
+            # time.sleep(0.5)  # 避免请求过快
+    
+    def get_all_memos(self, limit_per_page=200, checkpoint_path=None, keep_checkpoint=False):
+        """
+        获取所有备忘录
+        
+        Args:
+            limit_per_page: 每页数量
+            checkpoint_path: 检查点路径；中断后用同一路径重新运行会从断点继续
+            keep_checkpoint: 完成后保留检查点（供上层任务恢复时复用）
+        """
+        if checkpoint_path:
+            return self._get_all_memos_resumable(limit_per_page, checkpoint_path, keep_checkpoint)
+        
+        all_memos = []
+        
+        for memos in self.iter_memo_pages(limit_per_page=limit_per_page):
+            all_memos.extend(memos)
+        
+        print(f"✅ 总共获取到 {len(all_memos)} 条备忘录")
+        return all_memos
+    
+    def _get_all_memos_resumable(self, limit_per_page, checkpoint_path, keep_checkpoint):
+        """
+        带检查点的全量拉取：每页追加到检查点日志，游标取自日志最后一条
+
+        请求失败时保存进度后重新抛出异常，不把不完整的结果当作全部备忘录返回。
+        """
+        checkpoint = JobCheckpoint(checkpoint_path)
+        records = checkpoint.results()
+        # 按 slug 去重（保留最新版本）
+        all_memos = list({memo["slug"]: memo for memo in records}.values())
+        
+        if checkpoint.done:
+            print(f"♻️ 检查点已完成，直接使用 {len(all_memos)} 条备忘录")
+            if not keep_checkpoint:
+                checkpoint.discard()
+            return all_memos
+        
+        latest_slug = latest_updated_at = None
+        if records:
+            # 去重后的顺序是 slug 第一次出现的位置，游标必须取日志中最后写入的一条
+            last_memo = records[-1]
+            latest_slug = last_memo["slug"]
+            latest_updated_at = to_epoch(last_memo["updated_at"], self.tz)
+            print(f"♻️ 从检查点恢复: 已有 {len(all_memos)} 条备忘录，从 {latest_slug} 继续")
+        
+        checkpoint.update(job="get_all_memos", limit_per_page=limit_per_page)
+        try:
+            for memos in self.iter_memo_pages(latest_slug, latest_updated_at, limit_per_page,
+                                              raise_errors=True):
+                checkpoint.append(memos)
+                all_memos.extend(memos)
+        except Exception as e:
+            checkpoint.sync()
+            checkpoint.close()
+            print(f"⏸️ 拉取中断: {e}，已保存 {len(all_memos)} 条，重新运行将从断点继续")
+            raise
+        
+        if keep_checkpoint:
+            checkpoint.complete()
+        else:
+            checkpoint.discard()
         
         print(f"✅ 总共获取到 {len(all_memos)} 条备忘录")
         return all_memos
     
-    def get_memo_recommendations(self, memo_slug, rec_type=1, no_same_tag=0):
+    def get_memo_recommendations(self, memo_slug, rec_type=1, no_same_tag=0, raise_errors=False):
         """
         获取备忘录的相关推荐
         
@@ -104,6 +185,7 @@ class FlomoCompleteAPI:
             memo_slug: 备忘录的slug标识符
             rec_type: 推荐类型 (默认为1)
             no_same_tag: 是否排除相同标签 (0=不排除, 1=排除)
+            raise_errors: 为 True 时请求失败抛出异常，而不是返回空列表
         """
         try:
             params = self._generate_params({
@@ -111,12 +193,11 @@ class FlomoCompleteAPI:
                 "no_same_tag": str(no_same_tag)
             })
             
-            headers = {"Authorization": self.token}
             url = f"{self.base_url}/memo/{memo_slug}/recommended"
             
             print(f"🔗 获取备忘录 {memo_slug} 的相关推荐...")
             
-            response = requests.get(url, params=params, headers=headers)
+            response = self.transport.get(url, params=params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -126,18 +207,48 @@ class FlomoCompleteAPI:
                     return recommendations
                 else:
                     print(f"❌ API错误: {data.get('message')}")
+                    if raise_errors:
+                        raise RuntimeError(f"API错误: {data.get('message')}")
                     return []
             else:
                 print(f"❌ HTTP错误: {response.status_code}")
+                if raise_errors:
+                    raise RuntimeError(f"HTTP错误: {response.status_code}")
                 return []
                 
         except Exception as e:
+            if raise_errors:
+                raise
             print(f"💥 获取推荐失败: {e}")
             return []
     
-    def analyze_memo_relationships(self, memo_slug):
+    def get_local_recommendations(self, memo_slug=None, text=None, k=10):
+        """
+        基于本地向量索引的相关推荐（不访问服务器）
+        
+        Args:
+            memo_slug: 已有备忘录的 slug
+            text: 任意文本（memo_slug 为空时使用）
+            k: 返回数量
+        
+        Returns:
+            与 get_memo_recommendations 相同结构的列表: [{"similarity", "memo"}]
+        """
+        if self.vector_index is None or self.store is None:
+            print("❌ 未配置本地向量索引")
+            return []
+        
+        if memo_slug:
+            neighbours = self.vector_index.related(memo_slug, k=k)
+        else:
+            neighbours = self.vector_index.related_text(text or "", k=k)
+        
+        return [{"similarity": str(similarity), "memo": self.store.get(slug)}
+                for similarity, slug in neighbours if slug in self.store]
+    
+    def analyze_memo_relationships(self, memo_slug, raise_errors=False):
         """分析备忘录的关联关系"""
-        recommendations = self.get_memo_recommendations(memo_slug)
+        recommendations = self.get_memo_recommendations(memo_slug, raise_errors=raise_errors)
         
         if not recommendations:
             return None
@@ -178,15 +289,21 @@ class FlomoCompleteAPI:
         
         return analysis
     
-    def find_memo_clusters(self, memos_sample=50):
+    def find_memo_clusters(self, memos_sample=50, checkpoint_path=None):
         """
         发现备忘录的聚类关系
         
         Args:
             memos_sample: 要分析的备忘录样本数量
+            checkpoint_path: 检查点路径；中断后用同一路径重新运行，
+                             已拉取的备忘录和已分析的推荐都不会重复请求；
+                             备忘录没有拉取完整时抛出异常，不用部分数据抽样
         """
         # 获取一些备忘录样本
-        all_memos = self.get_all_memos()
+        if checkpoint_path:
+            all_memos = self.get_all_memos(checkpoint_path=f"{checkpoint_path}.memos", keep_checkpoint=True)
+        else:
+            all_memos = self.get_all_memos()
         
         if len(all_memos) > memos_sample:
             # 取最新的N条备忘录作为样本
@@ -194,107 +311,205 @@ class FlomoCompleteAPI:
         else:
             sample_memos = all_memos
         
-        print(f"🔍 分析 {len(sample_memos)} 条备忘录的聚类关系...")
-        
         clusters = {}
+        processed = set()
+        checkpoint = JobCheckpoint(f"{checkpoint_path}.clusters") if checkpoint_path else None
         
-        for i, memo in enumerate(sample_memos):
-            memo_slug = memo.get("slug")
-            print(f"分析备忘录 {i+1}/{len(sample_memos)}: {memo_slug}")
-            
-            # 获取推荐
-            analysis = self.analyze_memo_relationships(memo_slug)
-            
-            if analysis:
-                # 找出高相似度的备忘录
-                high_sim_memos = []
-                for rec in analysis["recommendations"]:
-                    if float(rec["similarity"]) > 0.85:  # 高相似度阈值
-                        high_sim_memos.append({
-                            "slug": rec["memo"]["slug"],
-                            "similarity": rec["similarity"],
-                            "tags": rec["memo"].get("tags", [])
-                        })
+        if checkpoint:
+            # 恢复已分析的结果（包括写入关系图的边）
+            for record in checkpoint.results():
+                processed.add(record["slug"])
+                for target, similarity in record["edges"]:
+                    self.graph.upsert_edge(record["slug"], target, similarity)
+                if record["cluster"]:
+                    clusters[record["slug"]] = record["cluster"]
+            if processed:
+                print(f"♻️ 从检查点恢复: 已分析 {len(processed)} 条备忘录")
+            checkpoint.update(job="find_memo_clusters", memos_sample=memos_sample)
+        
+        print(f"🔍 分析 {len(sample_memos)} 条备忘录的聚类关系...")
+        
+        try:
+            for i, memo in enumerate(sample_memos):
+                memo_slug = memo.get("slug")
+                if memo_slug in processed:
+                    continue
+                print(f"分析备忘录 {i+1}/{len(sample_memos)}: {memo_slug}")
                 
-                if high_sim_memos:
-                    clusters[memo_slug] = {
-                        "memo_info": {
-                            "slug": memo_slug,
-                            "content_preview": memo.get("content", "")[:100],
-                            "tags": memo.get("tags", []),
-                            "created_at": memo.get("created_at")
-                        },
-                        "related_memos": high_sim_memos,
-                        "analysis": analysis
-                    }
-            
-            # 避免请求过快
-            if i < len(sample_memos) - 1:
-                time.sleep(1)
+                # 获取推荐（有检查点时请求失败直接中断，避免把失败当作“没有推荐”记下来）
+                analysis = self.analyze_memo_relationships(memo_slug, raise_errors=checkpoint is not None)
+                
+                edges = []
+                cluster = None
+                if analysis:
+                    # 找出高相似度的备忘录
+                    high_sim_memos = []
+                    for rec in analysis["recommendations"]:
+                        # 所有推荐关系都写入关系图，供全量聚类使用
+                        edges.append([rec["memo"]["slug"], float(rec["similarity"])])
+                        self.graph.upsert_edge(memo_slug, rec["memo"]["slug"], float(rec["similarity"]))
+                        if float(rec["similarity"]) > 0.85:  # 高相似度阈值
+                            high_sim_memos.append({
+                                "slug": rec["memo"]["slug"],
+                                "similarity": rec["similarity"],
+                                "tags": rec["memo"].get("tags", [])
+                            })
+                    
+                    if high_sim_memos:
+                        cluster = {
+                            "memo_info": {
+                                "slug": memo_slug,
+                                "content_preview": memo.get("content", "")[:100],
+                                "tags": memo.get("tags", []),
+                                "created_at": memo.get("created_at")
+                            },
+                            "related_memos": high_sim_memos,
+                            "analysis": analysis
+                        }
+                        clusters[memo_slug] = cluster
+                
+                if checkpoint:
+                    checkpoint.append([{"slug": memo_slug, "edges": edges, "cluster": cluster}])
+                
+                # 避免请求过快
+                if i < len(sample_memos) - 1:
+                    time.sleep(1)
+        except Exception as e:
+            if checkpoint is None:
+                raise
+            checkpoint.sync()
+            checkpoint.close()
+            print(f"⏸️ 聚类分析中断: {e}，已保存进度，重新运行将从断点继续")
+            return clusters
+        
+        if checkpoint:
+            checkpoint.discard()
+            JobCheckpoint(f"{checkpoint_path}.memos").discard()
         
         print(f"✅ 发现 {len(clusters)} 个备忘录聚类")
         return clusters
     
-    def export_relationship_network(self, clusters, filename="flomo_network.json"):
-        """导出备忘录关系网络"""
-        network_data = {
-            "nodes": [],
-            "edges": [],
-            "metadata": {
-                "export_time": datetime.now().isoformat(),
-                "total_clusters": len(clusters),
-                "total_nodes": 0,
-                "total_edges": 0
-            }
-        }
+    def find_communities(self, min_similarity=0.85, min_cluster_size=2, k=10):
+        """
+        全量社区发现：对整个相似度图做连通分量 + 标签传播
         
-        # 收集所有节点
-        all_slugs = set()
+        配置了本地向量索引时先用它为全部备忘录建立近邻图；
+        否则使用 self.graph 中已有的关系（例如 find_memo_clusters 写入的推荐关系）。
         
-        for main_slug, cluster_data in clusters.items():
-            all_slugs.add(main_slug)
-            for related in cluster_data["related_memos"]:
-                all_slugs.add(related["slug"])
+        Args:
+            min_similarity: 参与聚类的最低相似度
+            min_cluster_size: 最小社区大小
+            k: 每条备忘录取的近邻数
+        """
+        if self.vector_index is not None:
+            build_knn_graph(self.vector_index, self.graph, k=k, min_similarity=min_similarity)
         
-        # 创建节点
-        for slug in all_slugs:
-            node = {"id": slug, "type": "memo"}
-            
-            # 如果是主节点，添加更多信息
-            if slug in clusters:
-                cluster_data = clusters[slug]
-                node.update({
-                    "content_preview": cluster_data["memo_info"]["content_preview"],
-                    "tags": cluster_data["memo_info"]["tags"],
-                    "created_at": cluster_data["memo_info"]["created_at"],
-                    "is_main_node": True
-                })
-            else:
-                node["is_main_node"] = False
-            
-            network_data["nodes"].append(node)
+        engine = ClusterEngine(self.graph, min_similarity=min_similarity)
+        communities = engine.run(min_cluster_size=min_cluster_size)
+        
+        if self.store is not None:
+            for community in communities:
+                community["representative_memos"] = [
+                    {
+                        "slug": slug,
+                        "content_preview": self.store.get(slug).get("content", "")[:100],
+                        "tags": self.store.get(slug).get("tags", [])
+                    }
+                    for slug in community["representatives"] if slug in self.store
+                ]
         
-        # 创建边
+        return communities
+    
+    def find_near_duplicates(self, memos=None, threshold=0.7, min_size=2):
+        """
+        全库近似重复检测（本地 MinHash 指纹，不需要逐条调用 /recommended）
+        
+        Args:
+            memos: 要检查的备忘录；为 None 时使用本地存储（有指纹索引时直接复用）
+            threshold: 视为重复的最低相似度（字符切片的 Jaccard 估计）
+            min_size: 最小组大小
+        
+        Returns:
+            [{"size", "memos": [{"slug", "created_at", "content_preview", "similarity"}]}]，
+            组内第一条为最早创建的备忘录，similarity 为与它的相似度
+        """
+        index = self.dedup_index
+        if memos is not None or index is None:
+            if memos is None:
+                if self.store is None:
+                    print("❌ 未配置本地存储，请先同步备忘录或传入 memos")
+                    return []
+                memos = list(self.store.values())
+            index = NearDuplicateIndex(threshold=threshold)
+            index.build(memos)
+            lookup = {memo["slug"]: memo for memo in memos}
+        else:
+            lookup = self.store
+        
+        groups = []
+        for slugs in index.groups(threshold=threshold, min_size=min_size):
+            members = sorted((lookup.get(slug) or {"slug": slug} for slug in slugs),
+                             key=lambda memo: memo.get("created_at") or "")
+            first = members[0]["slug"]
+            groups.append({
+                "size": len(members),
+                "memos": [{
+                    "slug": memo["slug"],
+                    "created_at": memo.get("created_at"),
+                    "content_preview": memo.get("content", "")[:100],
+                    "similarity": 1.0 if memo["slug"] == first else index.similarity(first, memo["slug"])
+                } for memo in members]
+            })
+        
+        print(f"🪞 近似重复检测完成: {len(index)} 条备忘录中发现 {len(groups)} 组重复")
+        return groups
+    
+    def build_relationship_graph(self, clusters):
+        """
+        只用给定聚类建立关系图（不含 self.graph 中累积的其它推荐关系）
+
+        self.graph 保存全部相似度的推荐边，供 find_communities 按阈值过滤；
+        导出的网络只包含 clusters 中的高相似度关系，节点和边数与聚类一致。
+        """
+        graph = MemoGraph()
         for main_slug, cluster_data in clusters.items():
+            memo_info = cluster_data["memo_info"]
+            graph.node_id(main_slug,
+                          content_preview=memo_info["content_preview"],
+                          tags=memo_info["tags"],
+                          created_at=memo_info["created_at"],
+                          is_main_node=True)
             for related in cluster_data["related_memos"]:
-                edge = {
-                    "source": main_slug,
-                    "target": related["slug"],
-                    "similarity": float(related["similarity"]),
-                    "type": "similarity"
-                }
-                network_data["edges"].append(edge)
-        
-        # 更新元数据
-        network_data["metadata"]["total_nodes"] = len(network_data["nodes"])
-        network_data["metadata"]["total_edges"] = len(network_data["edges"])
-        
-        # 导出到文件
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(network_data, f, ensure_ascii=False, indent=2)
+                graph.upsert_edge(main_slug, related["slug"], float(related["similarity"]))
+                # 相关备忘录标记为非主节点；它本身也是聚类中心时保留 True
+                graph.node_attrs.setdefault(graph.node_id(related["slug"]), {}).setdefault("is_main_node", False)
+        return graph
+    
+    def export_relationship_network(self, clusters, filename="flomo_network.json", format="json"):
+        """
+        导出备忘录关系网络（从关系图流式写出）
+        
+        Args:
+            clusters: find_memo_clusters 的结果
+            filename: 输出文件
+            format: json / graphml / edgelist
+        """
+        graph = self.build_relationship_graph(clusters)
+        metadata = {
+            "total_clusters": len(clusters),
+            "total_nodes": graph.node_count,
+            "total_edges": graph.edge_count
+        }
+        
+        if format == "graphml":
+            graph.export_graphml(filename)
+        elif format == "edgelist":
+            graph.export_edgelist(filename)
+        else:
+            metadata = graph.export_json(filename, metadata)
         
         print(f"✅ 关系网络已导出到 {filename}")
-        return network_data
+        return {"metadata": metadata}
 
 def main():
     # 配置token
@@ -330,8 +545,16 @@ def main():
             print(f"   相关备忘录: {len(cluster['related_memos'])} 条")
             print(f"   标签: {cluster['memo_info']['tags']}")
     
-    # 3. 导出关系网络
-    print(f"\n3️⃣ 导出关系网络")
+    # 3. 近似重复检测
+    print(f"\n3️⃣ 近似重复检测")
+    duplicates = api.find_near_duplicates(api.get_all_memos())
+    for group in duplicates[:3]:
+        print(f"\n   {group['size']} 条相似备忘录:")
+        for memo in group["memos"]:
+            print(f"   - [{memo['created_at']}] {memo['content_preview'][:60]} ({memo['similarity']:.2f})")
+    
+    # 4. 导出关系网络
+    print(f"\n4️⃣ 导出关系网络")
     if clusters:
         network = api.export_relationship_network(clusters)
         print(f"🌐 网络统计:")
@@ -1,16 +1,66 @@
 #!/usr/bin/env python3
 
-import requests
 import hashlib
 import json
 from datetime import datetime
 import time
+from flomo_capabilities import CapabilityProber, DEFAULT_ENDPOINTS
+from flomo_transport import FlomoTransport
+from flomo_store import MemoStore, to_epoch
+from flomo_tags import MemoTagIndex, TagSync
 
 class FlomoTagEnhancedTest:
-    def __init__(self, token):
+    def __init__(self, token, transport=None, store=None, capabilities_path="flomo_capabilities.json",
+                 tag_index=None, probe_retry_interval=600):
         self.token = token
         self.salt = "dbbc3dd73364b4084c3a69346e0ce2b2"
         self.base_url = "https://flomoapp.com/api/v1"
+        self.transport = transport or FlomoTransport(token)
+        self.store = store or MemoStore()
+        if tag_index is None:
+            tag_index = MemoTagIndex()
+            tag_index.build(self.store.values())
+        self.tag_index = tag_index
+        # 启动时读取能力缓存，跳过已知不可用的端点和分页参数
+        self.prober = CapabilityProber(self, capabilities_path)
+        self.capabilities = self.prober.load()
+        self.probe_retry_interval = probe_retry_interval
+        self._probe_failed_at = None
+        max_page_size = (self.capabilities or {}).get("max_page_size")
+        self.tag_sync = TagSync(self, self.store, limit=min(200, max_page_size or 200))
+
+    def attach_sync_engine(self, sync_engine):
+        """让标签计数随备忘录同步增量更新"""
+        sync_engine.add_listener(self.tag_index.on_memos_synced)
+
+    def ensure_capabilities(self):
+        """
+        确保有可用的能力结果；按每页上限调整标签同步
+
+        内存中的结果未过期时直接使用，不再读文件。没有可用结果时读取缓存或探测，
+        探测全部失败（多半是离线）后 probe_retry_interval 秒内不再重试，
+        期间沿用已有结果（可能为 None，即按默认策略同步）。
+        """
+        if not self.prober.expired(self.capabilities):
+            return self.capabilities
+        if self._probe_failed_at is not None and time.time() - self._probe_failed_at < self.probe_retry_interval:
+            return self.capabilities
+
+        self.prober.ensure()
+        if self.prober.expired():
+            # 探测没有成功，prober 不会采用这次的结果
+            self._probe_failed_at = time.time()
+            return self.capabilities
+
+        self._probe_failed_at = None
+        self.capabilities = self.prober.capabilities
+        self.tag_sync.limit = min(200, self.capabilities.get("max_page_size") or 200)
+        return self.capabilities
+
+    def sync_tags(self):
+        """增量同步标签目录到本地存储"""
+        self.ensure_capabilities()
+        return self.tag_sync.sync()
         
     def _generate_params(self, extra_params=None):
         """生成API参数和签名"""
@@ -33,72 +83,40 @@ class FlomoTagEnhancedTest:
         return params
     
     def test_different_tag_endpoints(self):
-        """测试不同的标签端点"""
-        endpoints_to_test = [
-            "/tag/updated/",
-            "/tag/",
-            "/tag/list/",
-            "/tag/all/",
-            "/tags/",
-            "/tags/updated/",
-            "/tags/list/",
-            "/memo/tags/",
-        ]
+        """测试不同的标签端点（并发探测，跳过能力缓存中已知不可用的端点）"""
+        endpoints_to_test = [endpoint for endpoint in DEFAULT_ENDPOINTS if self.prober.is_supported(endpoint)]
+        skipped = len(DEFAULT_ENDPOINTS) - len(endpoints_to_test)
         
-        headers = {"Authorization": self.token}
         results = {}
         
         print("🔍 测试不同的标签端点...")
+        if skipped:
+            print(f"⏭️ 根据能力缓存跳过 {skipped} 个不可用端点")
         print("=" * 60)
         
+        probe_results = self.prober.probe_endpoints(endpoints_to_test)
+        
         for endpoint in endpoints_to_test:
+            result = probe_results[endpoint]
             print(f"\n📍 测试端点: {endpoint}")
+            print(f"   📊 状态码: {result['status']}，耗时 {result['elapsed']}s")
             
-            try:
-                params = self._generate_params({"limit": "200", "tz": "8:0"})
-                url = self.base_url + endpoint
-                
-                response = requests.get(url, params=params, headers=headers, timeout=10)
-                
-                print(f"   📊 状态码: {response.status_code}")
-                
-                if response.status_code == 200:
-                    try:
-                        data = response.json()
-                        api_code = data.get("code")
-                        print(f"   ✅ API码: {api_code}")
-                        
-                        if api_code == 0:
-                            tag_data = data.get("data", [])
-                            print(f"   🎯 获取到 {len(tag_data)} 个标签")
-                            
-                            if tag_data:
-                                first_item = tag_data[0] if isinstance(tag_data, list) else tag_data
-                                if isinstance(first_item, dict):
-                                    print(f"   📋 字段: {list(first_item.keys())}")
-                                
-                                results[endpoint] = {
-                                    "success": True,
-                                    "count": len(tag_data) if isinstance(tag_data, list) else 1,
-                                    "sample": first_item,
-                                    "data": tag_data
-                                }
-                        else:
-                            print(f"   ❌ API错误: {data.get('message', 'Unknown')}")
-                            results[endpoint] = {"success": False, "error": data.get('message')}
-                    except json.JSONDecodeError:
-                        print(f"   ❌ JSON解析失败")
-                        results[endpoint] = {"success": False, "error": "JSON decode error"}
-                else:
-                    print(f"   ❌ HTTP错误: {response.status_code}")
-                    results[endpoint] = {"success": False, "error": f"HTTP {response.status_code}"}
-                    
-            except requests.exceptions.Timeout:
-                print(f"   ⏱️ 请求超时")
-                results[endpoint] = {"success": False, "error": "Timeout"}
-            except Exception as e:
-                print(f"   💥 异常: {str(e)[:50]}...")
-                results[endpoint] = {"success": False, "error": str(e)[:50]}
+            if result["success"]:
+                tag_data = result["items"]
+                print(f"   🎯 获取到 {len(tag_data)} 个标签")
+                if tag_data:
+                    first_item = tag_data[0]
+                    if isinstance(first_item, dict):
+                        print(f"   📋 字段: {list(first_item.keys())}")
+                    results[endpoint] = {
+                        "success": True,
+                        "count": len(tag_data),
+                        "sample": first_item,
+                        "data": tag_data
+                    }
+            else:
+                print(f"   ❌ 错误: {result['error']}")
+                results[endpoint] = {"success": False, "error": result["error"]}
         
         return results
     
@@ -125,6 +143,12 @@ class FlomoTagEnhancedTest:
             {"param": "start_cursor", "value": None},
         ]
         
+        if self.capabilities:
+            supported_fields = set(self.prober.supported_cursor_fields())
+            pagination_strategies = [strategy for strategy in pagination_strategies
+                                     if strategy['param'] in supported_fields]
+            print(f"📦 根据能力缓存只测试: {[strategy['param'] for strategy in pagination_strategies]}")
+        
         for strategy in pagination_strategies:
             print(f"\n📋 测试分页策略: {strategy['param']}")
             
@@ -146,10 +170,9 @@ class FlomoTagEnhancedTest:
                         request_params[strategy['param']] = str(param_value)
                     
                     params = self._generate_params(request_params)
-                    headers = {"Authorization": self.token}
                     
-                    response = requests.get(f"{self.base_url}/tag/updated/", 
-                                          params=params, headers=headers)
+                    response = self.transport.get(f"{self.base_url}/tag/updated/", 
+                                                  params=params)
                     
                     if response.status_code == 200:
                         data = response.json()
@@ -168,7 +191,7 @@ class FlomoTagEnhancedTest:
                                 last_tag = tags[-1]
                                 if 'updated_at' in last_tag:
                                     try:
-                                        param_value = int(datetime.fromisoformat(last_tag['updated_at']).timestamp())
+                                        param_value = to_epoch(last_tag['updated_at'])
                                     except:
                                         print("     时间解析失败")
                                         break
@@ -256,14 +279,28 @@ class FlomoTagEnhancedTest:
         print("\n🔍 搜索可能遗漏的标签...")
         print("=" * 60)
         
+        if self.tag_index.memo_tags:
+            # 本地存储中有完整的备忘录：对全部备忘录做一次集合差
+            for tag in known_tags or []:
+                self.store.upsert_tag(tag)
+            if not self.store.tags:
+                self.sync_tags()
+            result = self.tag_sync.reconcile(self.tag_index)
+            print(f"📝 基于本地 {len(self.tag_index.memo_tags)} 条备忘录分析标签")
+            print(f"🏷️  从备忘录中发现 {result['comparison']['memo_count']} 个不同的标签")
+            print(f"❓ 可能遗漏的标签: {result['comparison']['missing_count']} 个，"
+                  f"未被使用的标签: {result['comparison']['orphaned_count']} 个")
+            for tag in result["missing_tags"][:20]:
+                print(f"   - {tag}")
+            return result
+        
         # 从备忘录中提取所有使用过的标签
         try:
             # 获取一些备忘录样本
             memo_params = self._generate_params({"limit": "100", "tz": "8:0"})
-            headers = {"Authorization": self.token}
             
-            response = requests.get(f"{self.base_url}/memo/updated/", 
-                                  params=memo_params, headers=headers)
+            response = self.transport.get(f"{self.base_url}/memo/updated/", 
+                                          params=memo_params)
             
             if response.status_code == 200:
                 data = response.json()